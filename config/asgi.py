@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Overdue checkout alerts from this web process, when OVERDUE_SCHEDULER is enabled
+from visitorapi.overdue import start_overdue_scheduler
+start_overdue_scheduler()
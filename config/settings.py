@@ -77,12 +77,13 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Enable WhiteNoise for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'visitorapi.middleware.SessionRefreshMiddleware',  # Sliding session expiry without a write per request
+    'visitorapi.middleware.SessionInvalidationMiddleware',  # Logs out sessions from before the last epoch bump
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'visitorapi.middleware.SessionInvalidationMiddleware',  # Custom session invalidation
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -212,6 +213,25 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')  # Set in Render environment
 DEFAULT_FROM_EMAIL = f"Visitor Management <{EMAIL_HOST_USER}>"
 
+# Views queue email in the Mongo outbox; it is sent in batches over one SMTP connection
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6  # Then the email is dead-lettered (status DEAD)
+EMAIL_OUTBOX_RETRY_SECONDS = 60  # First retry delay, doubled on each further attempt
+EMAIL_OUTBOX_LOCK_SECONDS = 300  # Emails claimed by a worker that died are retried after this
+EMAIL_OUTBOX_POLL_SECONDS = 10  # run_email_outbox --loop interval
+# Also drain on a background thread of the web process right after queueing. Turn off when
+# a dedicated `manage.py run_email_outbox --loop` worker runs
+EMAIL_OUTBOX_DRAIN_IN_PROCESS = os.environ.get('EMAIL_OUTBOX_DRAIN_IN_PROCESS', 'True').strip().lower() in {'1', 'true', 'yes', 'on'}
+# Digest mode (0 disables): a recipient notified within this many seconds has further
+# approval and overdue notifications held, then gets them as one summary per window
+EMAIL_DIGEST_SECONDS = int(os.environ.get('EMAIL_DIGEST_SECONDS', '0'))
+OVERDUE_CHECK_SECONDS = 300  # overdue_checkout_notify --loop interval
+# Fire overdue checkout alerts from an in-process deadline scheduler fed by check-ins/outs.
+# Started by config/wsgi.py and config/asgi.py, so each web worker runs one; with several
+# workers, leave this off and run `manage.py overdue_checkout_notify --scheduler` once instead
+OVERDUE_SCHEDULER = os.environ.get('OVERDUE_SCHEDULER', 'False').strip().lower() in {'1', 'true', 'yes', 'on'}
+OVERDUE_SCHEDULER_RESYNC_SECONDS = 900  # Reload today's open sessions to see other workers' check-ins
+
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
 # Security settings
@@ -228,17 +248,61 @@ SECURE_HSTS_PRELOAD = True
 # If behind a proxy/load balancer that handles SSL, enable this:
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
+# Background export jobs
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '2'))  # Worker threads per process
+EXPORT_ROOT = BASE_DIR / 'export_artifacts'  # Outside MEDIA_ROOT: exports contain visitor PII
+EXPORT_ARTIFACT_TTL = 24 * 3600  # Seconds a finished export is kept for reuse
+EXPORT_JOB_STALE_SECONDS = 600  # Requeue jobs that report no progress for this long
+# Processes used to format large exports in parallel (0 or 1 keeps formatting in-process)
+EXPORT_PROCESSES = int(os.environ.get('EXPORT_PROCESSES', '0'))
+EXPORT_SHARD_SIZE = 5000  # Visit requests per shard
+EXPORT_SHARD_MIN_ROWS = 20000  # Smaller exports are not worth the process hand-off
+# Delta exports do not report deletions, so old tokens are refused and the client resyncs in full
+DELTA_TOKEN_MAX_AGE = 30 * 24 * 3600
+
+# Visitor photos are shrunk to badge size and re-encoded by background workers
+PHOTO_WORKERS = 2
+PHOTO_FORMAT = 'JPEG'  # or 'WEBP'
+PHOTO_MAX_SIZE = (480, 600)  # Pixels; comfortably above the 2.2cm x 2.8cm badge photo at 200 dpi
+PHOTO_THUMBNAIL_SIZE = (96, 96)
+
+# New visit requests: 'first' host of the type (default), 'round_robin' or 'least_pending'
+# (fewest pending requests). Rotating moves requests between hosts' dashboards, so it is opt-in
+HOST_ROUTING = os.environ.get('HOST_ROUTING', 'first')
+HOST_CACHE_SECONDS = 300  # Eligible hosts are cached per worker; saves in other workers are seen after this
+
+# Visitor autocomplete: answer searches from a per-worker in-memory prefix index
+VISITOR_SEARCH_IN_MEMORY = os.environ.get('VISITOR_SEARCH_IN_MEMORY', 'False').strip().lower() in {'1', 'true', 'yes', 'on'}
+VISITOR_SEARCH_SYNC_SECONDS = 30  # How often each worker checks Mongo for other workers' writes
+DEFAULT_PHONE_COUNTRY_CODE = '91'  # Prefixed to local numbers when normalizing visitor identities
+# Seconds autocomplete results are cached when the in-memory index is off (0 disables). Visitor
+# writes invalidate the cache; with the default per-process cache other workers rely on the TTL
+VISITOR_SEARCH_CACHE_TTL = 30
+
+# Idempotency-Key handling for registration and check-in/out retries from kiosks
+IDEMPOTENCY_KEY_TTL = 24 * 3600  # Seconds a stored response is replayed for repeats of its key
+IDEMPOTENCY_LOCK_SECONDS = 60  # A repeat may redo the work if the first attempt has not finished by then
+
 # Custom login and redirect URLs
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/dashboard/'
 
+# Failed-login throttling (visitorapi.login_throttle); counted in the default cache
+LOGIN_FAILURE_LIMIT = 5  # Failed attempts per username before logins for it are refused
+LOGIN_IP_FAILURE_LIMIT = 50  # Failed attempts per client IP before its logins are refused
+LOGIN_FAILURE_WINDOW_SECONDS = 900  # Counting window, from the first failure
+LOGIN_TRUST_X_FORWARDED_FOR = os.environ.get('LOGIN_TRUST_X_FORWARDED_FOR', 'False').strip().lower() in {'1', 'true', 'yes', 'on'}  # Behind a reverse proxy
+
 # Session settings to prevent conflicts between different user types
 SESSION_COOKIE_AGE = 3600  # 1 hour
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
-SESSION_SAVE_EVERY_REQUEST = True
+SESSION_SAVE_EVERY_REQUEST = False  # SessionRefreshMiddleware re-saves unchanged sessions instead
+SESSION_REFRESH_SECONDS = 300  # An unchanged session's expiry is pushed back at most this often
 
-# Force session expiration on server restart
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# Session storage: 'django.contrib.sessions.backends.db' (default),
+# 'visitorapi.signed_sessions' (signed cookie with logout revocation, no database writes)
+# or 'django.contrib.sessions.backends.cached_db' (only with a cache shared by all workers)
+SESSION_ENGINE = os.environ.get('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
@@ -247,6 +311,8 @@ SESSION_COOKIE_SAMESITE = 'Lax'
 
 # Session invalidation on server restart
 CLEAR_SESSIONS_ON_RESTART = True  # Set to False to disable automatic session clearing
+SESSION_RESTART_COALESCE_SECONDS = 120  # Workers restarting within this window log users out once
+SESSION_EPOCH_CHECK_SECONDS = 5  # Other processes' epoch bumps take effect within this many seconds
 
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost',
@@ -33,8 +33,15 @@ urlpatterns = [
     path('register/', visitorapi_views.visitor_registration, name='visitor-registration'),
     path('register_visitor/', visitorapi_views.register_visitor, name='register-visitor-api'),
     path('search_visitors/', visitorapi_views.search_visitors, name='search-visitors-api'),
+    path('import_visitors/', visitorapi_views.import_visitors_view, name='import-visitors-api'),
     path('export-visitors-excel/', visitorapi_views.export_visitors_excel, name='export_visitors_excel'),
     path('export-hos-visitors-excel/', visitorapi_views.export_hos_visitors_excel, name='export_hos_visitors_excel'),
+    path('export-visitors-csv/', visitorapi_views.export_visitors_csv, name='export_visitors_csv'),
+    path('export-visitors-ndjson/', visitorapi_views.export_visitors_ndjson, name='export_visitors_ndjson'),
+    path('export-visitors-delta/', visitorapi_views.export_visitors_delta, name='export_visitors_delta'),
+    path('export-jobs/', visitorapi_views.create_export_job, name='create_export_job'),
+    path('export-jobs/<str:job_id>/', visitorapi_views.export_job_status, name='export_job_status'),
+    path('export-jobs/<str:job_id>/download/', visitorapi_views.download_export_job, name='download_export_job'),
     path('registration-login/', visitorapi_views.registration_user_login_view, name='registration-login'),
     path('registration-users-list/', visitorapi_views.registration_users_list, name='registration-users-list'),
     path('add-registration-user/', visitorapi_views.add_registration_user, name='add-registration-user'),
@@ -64,6 +71,7 @@ urlpatterns = [
     path('logout/', visitorapi_views.logout_view, name='logout'),
     path('dashboard/', visitorapi_views.hr_dashboard_view, name='hr-dashboard'),
     path('update-request/<str:request_id>/<str:action>/', visitorapi_views.update_request_status, name='update-request-status'),
+    path('update-group/<str:group_id>/<str:action>/', visitorapi_views.update_group_status, name='update-group-status'),
     path('clear-sessions/', visitorapi_views.clear_all_sessions, name='clear-sessions'),
     
     # Password Reset URLs
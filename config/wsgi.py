@@ -15,6 +15,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_wsgi_application()
 
+# Overdue checkout alerts from this web process, when OVERDUE_SCHEDULER is enabled
+from visitorapi.overdue import start_overdue_scheduler
+start_overdue_scheduler()
+
 # Enable WhiteNoise for static file serving
 from whitenoise import WhiteNoise
 import os as _os
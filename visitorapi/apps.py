@@ -1,3 +1,5 @@
+import os
+
 from django.apps import AppConfig
 from mongoengine import connect
 from django.conf import settings
@@ -7,10 +9,16 @@ class VisitorapiConfig(AppConfig):
     name = 'visitorapi'
 
     def ready(self):
+        from . import host_routing  # noqa: F401  (connects HRUser cache invalidation)
         if not hasattr(self, "mongo_connected"):
             try:
                 connect(**settings.MONGODB_SETTINGS)
                 self.mongo_connected = True
                 print("✅ MongoDB connected to:", settings.MONGODB_SETTINGS["db"])
+                from .export_shards import POOL_WORKER_ENV
+                if not os.environ.get(POOL_WORKER_ENV):
+                    # Export pool workers only format rows; they need no search index
+                    from .visitor_index import start_visitor_index
+                    start_visitor_index()
             except Exception as e:
                 print("❌ MongoDB connection failed:", e)
@@ -0,0 +1,284 @@
+import csv
+import io
+import os
+from datetime import date, datetime, time
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.utils import timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .host_routing import route_host
+from .identity import visitor_identity_key
+from .search import invalidate_search_cache, visitor_search_keys
+
+# Rows resolved and inserted per round trip
+IMPORT_BATCH_SIZE = 500
+
+VISITOR_COLUMNS = ('first_name', 'last_name', 'email', 'phone', 'company', 'id_proof_type', 'id_proof_number')
+REQUIRED_COLUMNS = ('first_name', 'last_name', 'phone', 'company', 'id_proof_type', 'id_proof_number', 'purpose')
+OPTIONAL_COLUMNS = (
+    'email', 'other_purpose', 'end_time', 'valid_upto', 'send_to_hr', 'allow_mobile', 'allow_laptop', 'group',
+)
+
+TRUE_VALUES = {'1', 'y', 'yes', 'true', 'on'}
+
+
+def _header(value):
+    return str(value or '').strip().lower().replace(' ', '_')
+
+
+def iter_import_rows(f, filename):
+    """
+    Yield one dict per data row of an uploaded CSV or XLSX file, keyed by
+    normalized header ("First Name" -> first_name). Rows are read lazily.
+    """
+    if os.path.splitext(filename)[1].lower() == '.xlsx':
+        import openpyxl
+
+        workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [_header(h) for h in next(rows, ())]
+        for values in rows:
+            if any(v not in (None, '') for v in values):
+                yield dict(zip(header, values))
+        workbook.close()
+    else:
+        reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+        header = [_header(h) for h in next(reader, [])]
+        for values in reader:
+            if any(v.strip() for v in values):
+                yield dict(zip(header, values))
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Excel stores phone and ID numbers typed as digits as floats
+        value = int(value)
+    return str(value).strip()
+
+
+def validate_row(raw):
+    """Return (cleaned row, errors) for one import row"""
+    row = {column: _text(raw.get(column)) for column in REQUIRED_COLUMNS + OPTIONAL_COLUMNS}
+    errors = [f'{column} is required' for column in REQUIRED_COLUMNS if not row[column]]
+
+    if row['email']:
+        try:
+            validate_email(row['email'])
+        except ValidationError:
+            errors.append('email is invalid')
+
+    end_time = raw.get('end_time')
+    if isinstance(end_time, (time, datetime)):
+        row['end_time'] = end_time.strftime('%H:%M:%S')
+    elif row['end_time']:
+        try:
+            row['end_time'] = str(datetime.strptime(row['end_time'][:5], '%H:%M').time())
+        except ValueError:
+            errors.append('end_time must be HH:MM')
+    else:
+        row['end_time'] = str(time(17, 30))
+
+    valid_upto = raw.get('valid_upto')
+    if isinstance(valid_upto, (datetime, date)):
+        row['valid_upto'] = valid_upto if not isinstance(valid_upto, datetime) else valid_upto.date()
+    elif row['valid_upto']:
+        try:
+            row['valid_upto'] = datetime.strptime(row['valid_upto'], '%Y-%m-%d').date()
+        except ValueError:
+            errors.append('valid_upto must be YYYY-MM-DD')
+    else:
+        row['valid_upto'] = None
+
+    for flag in ('send_to_hr', 'allow_mobile', 'allow_laptop'):
+        row[flag] = row[flag].lower() in TRUE_VALUES
+
+    if not errors:
+        # The bulk upsert bypasses mongoengine, so run the field checks
+        # (max_length and the like) resolve() gets from validate()
+        errors.extend(_visitor_field_errors(row))
+    return row, errors
+
+
+def _visitor_field_errors(row):
+    from mongoengine import ValidationError as DocumentValidationError
+    from visitorapi.mongo_models import MongoVisitor
+
+    try:
+        MongoVisitor(**{column: row[column] for column in VISITOR_COLUMNS if row[column]}).validate()
+    except DocumentValidationError as e:
+        return [f'{field}: {error}' for field, error in sorted((e.errors or {}).items())] or [str(e)]
+    return []
+
+
+def _resolve_visitors(rows, now):
+    """
+    Resolve a batch of rows to visitor ids with one bulk upsert keyed on the
+    identity key and one lookup, following register_visitor's rules: an email
+    row updates the stored details, a row without one reuses them as they are.
+    Returns (ids by identity key, keys of new visitors, errors by identity key).
+    """
+    from visitorapi.mongo_models import MongoVisitor
+
+    updates = {}
+    for row in rows:
+        fields = {column: row[column] for column in VISITOR_COLUMNS if row[column]}
+        key = visitor_identity_key(row['email'], row['first_name'], row['last_name'], row['phone'], row['company'])
+        row['identity_key'] = key
+        derived = {'updated_at': now, 'search_keys': visitor_search_keys(
+            row['first_name'], row['last_name'], row['email'], row['phone'], row['id_proof_number'],
+        )}
+        on_insert = {'created_at': now, 'identity_key': key}
+        if row['email']:
+            email = fields.pop('email')
+            update = {'$set': dict(fields, **derived), '$setOnInsert': dict(on_insert, email=email)}
+        else:
+            update = {'$setOnInsert': dict(fields, **derived, **on_insert)}
+        # Repeated identities in one file: the last row wins, as with sequential registrations
+        updates[key] = update
+
+    keys = list(updates)
+    collection = MongoVisitor._get_collection()
+    failed = {}
+    try:
+        result = collection.bulk_write(
+            [UpdateOne({'identity_key': key}, update, upsert=True) for key, update in updates.items()],
+            ordered=False,
+        )
+        new_keys = {keys[index] for index in result.upserted_ids}
+    except BulkWriteError as e:
+        # The other upserts went through; only the rows behind these keys fail
+        new_keys = {keys[upserted['index']] for upserted in e.details['upserted']}
+        for error in e.details['writeErrors']:
+            key = keys[error['index']]
+            update = updates[key]
+            email = update.get('$setOnInsert', {}).get('email')
+            if email and error['code'] == 11000:
+                # The unique email index of a visitor without an identity key
+                try:
+                    if MongoVisitor.key_unkeyed_by_email(email, key, update['$set']):
+                        continue
+                except DuplicateKeyError:
+                    pass
+            failed[key] = f"Visitor could not be saved: {error.get('errmsg', 'write error')}"
+    ids = {
+        doc['identity_key']: doc['_id']
+        for doc in collection.find({'identity_key': {'$in': keys}}, projection=['identity_key'])
+    }
+    # A visitor inserted meanwhile by a desk registering the same person is found anyway
+    failed = {key: message for key, message in failed.items() if key not in ids}
+    return ids, new_keys, failed
+
+
+def import_visitors(raw_rows, created_by=None, default_host_type='HOS', batch_size=IMPORT_BATCH_SIZE, group_name=None):
+    """
+    Validate and import pre-registration rows, returning a per-row report.
+
+    Rows are processed in batches: one bulk visitor upsert, one lookup and one
+    insert_many of PENDING visit requests per batch, instead of the several
+    round trips register_visitor makes per visitor.
+
+    Rows sharing a group value (or all rows, with group_name) become members
+    of one MongoVisitGroup, approved as a unit. A group's host is routed once,
+    for its first row.
+    """
+    from visitorapi.mongo_models import MongoVisitGroup, MongoVisitRequest
+
+    report = []
+    batch = []
+    groups = {}
+
+    def group_for(row, now):
+        name = row['group'] or group_name
+        if not name:
+            return None
+        if name not in groups:
+            host_id = route_host('HR' if row['send_to_hr'] else default_host_type)
+            if not host_id:
+                return None
+            groups[name] = MongoVisitGroup(
+                name=name,
+                host_id=host_id,
+                purpose=row['purpose'],
+                created_by_id=str(created_by.id) if created_by else None,
+                created_at=now,
+            )
+            groups[name].save()
+        return groups[name]
+
+    def flush():
+        if not batch:
+            return
+        now = timezone.localtime(timezone.now())
+        visitor_ids, new_keys, failed = _resolve_visitors([row for _, row in batch], now)
+        visits = []
+        for entry, row in batch:
+            if row['identity_key'] in failed:
+                entry.update(status='error', errors=[failed[row['identity_key']]])
+                continue
+            group = group_for(row, now)
+            host_id = group.host_id if group else route_host('HR' if row['send_to_hr'] else default_host_type)
+            if not host_id:
+                entry.update(status='error', errors=['No host available to assign the visit.'])
+                continue
+            visitor_id = visitor_ids[row['identity_key']]
+            entry.update(
+                visitor_id=str(visitor_id),
+                visitor='new' if row['identity_key'] in new_keys else 'existing',
+            )
+            visits.append((entry, MongoVisitRequest(
+                visitor_id=str(visitor_id),
+                host_id=host_id,
+                purpose=row['purpose'],
+                other_purpose=row['other_purpose'] or None,
+                visit_date=now.date(),
+                start_time=now,
+                end_time=row['end_time'],
+                status='PENDING',
+                allow_mobile=row['allow_mobile'],
+                allow_laptop=row['allow_laptop'],
+                created_by_id=str(created_by.id) if created_by else None,
+                valid_upto=row['valid_upto'],
+                group_id=str(group.id) if group else None,
+            ).to_mongo()))
+        if visits:
+            inserted = MongoVisitRequest._get_collection().insert_many([doc for _, doc in visits]).inserted_ids
+            for (entry, doc), visit_id in zip(visits, inserted):
+                entry.update(status='created', visit_request_id=str(visit_id))
+                if doc.get('group_id'):
+                    entry['group_id'] = doc['group_id']
+        batch.clear()
+
+    for number, raw in enumerate(raw_rows, start=2):  # Row 1 is the header
+        row, errors = validate_row(raw)
+        entry = {'row': number, 'name': f"{row['first_name']} {row['last_name']}".strip()}
+        report.append(entry)
+        if errors:
+            entry.update(status='error', errors=errors)
+            continue
+        batch.append((entry, row))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    for group in groups.values():
+        group.member_count = MongoVisitRequest.objects(group_id=str(group.id)).count()
+        group.save()
+
+    if any(entry['status'] == 'created' for entry in report):
+        invalidate_search_cache()
+    return report
+
+
+def summarize(report):
+    created = [entry for entry in report if entry['status'] == 'created']
+    return {
+        'rows': len(report),
+        'created': len(created),
+        'new_visitors': sum(1 for entry in created if entry.get('visitor') == 'new'),
+        'errors': len(report) - len(created),
+    }
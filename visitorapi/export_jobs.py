@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .export_shards import export_rows
+from .exports import (
+    CSV_CONTENT_TYPE,
+    CURSOR_BATCH_SIZE,
+    NDJSON_CONTENT_TYPE,
+    XLSX_CONTENT_TYPE,
+    _batched,
+    export_queryset,
+    filters_to_params,
+    iter_csv,
+    iter_ndjson,
+    parse_export_filters,
+    write_xlsx,
+)
+
+logger = logging.getLogger(__name__)
+
+# format -> (file extension, content type)
+EXPORT_FORMATS = {
+    'xlsx': ('.xlsx', XLSX_CONTENT_TYPE),
+    'csv': ('.csv', CSV_CONTENT_TYPE),
+    'ndjson': ('.ndjson', NDJSON_CONTENT_TYPE),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _now():
+    return timezone.localtime(timezone.now())
+
+
+def _get_executor():
+    """Per-process worker pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EXPORT_WORKERS', 2),
+                thread_name_prefix='export',
+            )
+    return _executor
+
+
+def _export_root():
+    root = getattr(settings, 'EXPORT_ROOT', None) or os.path.join(settings.BASE_DIR, 'export_artifacts')
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def data_watermark():
+    """
+    Cheap fingerprint of the exported data: the max updated_at of visit requests,
+    visitors and cards (all indexed) plus the visit request count, so deletions
+    also invalidate finished artifacts. HRUser has no updated_at, so the names
+    shown in the host and Approved By columns are hashed instead; there are
+    few enough users for that to stay cheap.
+    """
+    from visitorapi.models import HRUser
+    from visitorapi.mongo_models import MongoVisitor, MongoVisitorCard, MongoVisitRequest
+
+    parts = []
+    for model in (MongoVisitRequest, MongoVisitor, MongoVisitorCard):
+        latest = model.objects.order_by('-updated_at').only('updated_at').first()
+        parts.append(latest.updated_at.isoformat() if latest and latest.updated_at else '')
+    parts.append(str(MongoVisitRequest._get_collection().estimated_document_count()))
+    users = HRUser.objects.order_by('id').values_list('id', 'first_name', 'last_name', 'username', 'email', 'user_type')
+    parts.append(hashlib.sha256(json.dumps(list(users)).encode('utf-8')).hexdigest())
+    return '|'.join(parts)
+
+
+def _job_key(export_format, params, sheet_title, watermark):
+    raw = json.dumps([export_format, params, sheet_title, watermark], sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _is_stale(job):
+    """A queued or running job whose worker stopped reporting progress (e.g. the process was restarted)"""
+    timeout = getattr(settings, 'EXPORT_JOB_STALE_SECONDS', 600)
+    updated_at = job.updated_at
+    # pymongo returns naive UTC datetimes
+    if updated_at and timezone.is_naive(updated_at):
+        updated_at = timezone.make_aware(updated_at, dt_timezone.utc)
+    return job.status in ('QUEUED', 'RUNNING') and updated_at and updated_at < timezone.now() - timedelta(seconds=timeout)
+
+
+def submit_export(export_format, filters, sheet_title, user=None):
+    """
+    Return the export job for these filters at the current data watermark.
+
+    A finished artifact for the same format, filters and watermark is reused
+    as is, and a queued or running one is shared, so concurrent or repeated
+    exports of unchanged data do not rebuild the file.
+    """
+    from visitorapi.mongo_models import MongoExportJob
+
+    prune_expired_jobs()
+    params = filters_to_params(filters)
+    key = _job_key(export_format, params, sheet_title, data_watermark())
+    now = _now()
+    job = MongoExportJob.objects(job_key=key).modify(
+        upsert=True,
+        new=True,
+        set_on_insert__export_format=export_format,
+        set_on_insert__filters=params,
+        set_on_insert__sheet_title=sheet_title,
+        set_on_insert__status='QUEUED',
+        set_on_insert__dispatched=False,
+        set_on_insert__created_by_id=str(user.id) if user and user.is_authenticated else None,
+        set_on_insert__created_at=now,
+        set_on_insert__updated_at=now,
+    )
+
+    artifact_missing = job.status == 'DONE' and not (job.file_path and os.path.exists(job.file_path))
+    if job.status == 'FAILED' or artifact_missing or _is_stale(job):
+        # Requeue, guarded on the state we saw so only one request restarts it
+        MongoExportJob.objects(id=job.id, status=job.status, updated_at=job.updated_at).update_one(
+            set__status='QUEUED', set__rows_done=0, set__error=None, set__finished_at=None,
+            set__updated_at=now, set__dispatched=False,
+        )
+        job.reload()
+
+    # Exactly one request dispatches each queued job to the worker pool
+    if MongoExportJob.objects(id=job.id, status='QUEUED', dispatched__ne=True).update_one(set__dispatched=True):
+        _get_executor().submit(run_export_job, str(job.id))
+        job.reload()
+    return job
+
+
+def _track_progress(rows, job_id, progress):
+    """Pass rows through, recording progress every cursor batch"""
+    from visitorapi.mongo_models import MongoExportJob
+
+    for row in rows:
+        yield row
+        progress['rows'] += 1
+        if progress['rows'] % CURSOR_BATCH_SIZE == 0:
+            MongoExportJob.objects(id=job_id).update_one(set__rows_done=progress['rows'], set__updated_at=_now())
+
+
+def run_export_job(job_id):
+    """Build the artifact for a queued job; runs on the export worker pool"""
+    from visitorapi.mongo_models import MongoExportJob
+
+    try:
+        job = MongoExportJob.objects.get(id=job_id)
+        filters = parse_export_filters(job.filters)
+        MongoExportJob.objects(id=job_id).update_one(
+            set__status='RUNNING', set__total=export_queryset(filters).count(), set__updated_at=_now(),
+        )
+
+        extension, _ = EXPORT_FORMATS[job.export_format]
+        path = os.path.join(_export_root(), f'{job.job_key}{extension}')
+        partial_path = f'{path}.part'
+        progress = {'rows': 0}
+        rows = _track_progress(export_rows(filters), job_id, progress)
+        if job.export_format == 'xlsx':
+            write_xlsx(rows, job.sheet_title or 'Visitors', partial_path)
+        else:
+            lines = iter_csv(rows) if job.export_format == 'csv' else iter_ndjson(rows)
+            with open(partial_path, 'wb') as f:
+                for chunk in _batched(lines):
+                    f.write(chunk)
+        os.replace(partial_path, path)
+
+        now = _now()
+        MongoExportJob.objects(id=job_id).update_one(
+            set__status='DONE', set__file_path=path, set__rows_done=progress['rows'],
+            set__finished_at=now, set__updated_at=now,
+        )
+        logger.info(f"Export job {job_id} finished: {path}")
+    except Exception as e:
+        logger.exception(f"Export job {job_id} failed")
+        now = _now()
+        MongoExportJob.objects(id=job_id).update_one(
+            set__status='FAILED', set__error=str(e), set__finished_at=now, set__updated_at=now,
+        )
+    finally:
+        # Worker threads get their own Django DB connection; don't leak it
+        connection.close()
+
+
+def prune_expired_jobs():
+    """Delete finished jobs and their artifacts once they are older than EXPORT_ARTIFACT_TTL seconds"""
+    from visitorapi.mongo_models import MongoExportJob
+
+    ttl = getattr(settings, 'EXPORT_ARTIFACT_TTL', 24 * 3600)
+    cutoff = _now() - timedelta(seconds=ttl)
+    for job in MongoExportJob.objects(finished_at__lt=cutoff).only('file_path'):
+        if job.file_path and os.path.exists(job.file_path):
+            try:
+                os.unlink(job.file_path)
+            except OSError:
+                continue
+        job.delete()
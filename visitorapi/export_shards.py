@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+from .exports import export_queryset, filters_to_params, iter_export_rows, parse_export_filters
+
+# Set in spawned export workers, so AppConfig.ready skips the web process's startup hooks
+POOL_WORKER_ENV = 'VISITORAPI_EXPORT_WORKER'
+
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+
+def _init_worker(settings_module):
+    """Spawned workers start clean: set up Django, which also connects to MongoDB"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    os.environ[POOL_WORKER_ENV] = '1'
+    import django
+    django.setup()
+
+
+def _get_pool(processes):
+    """
+    Per-process pool of spawned workers, created on first use. Spawn (not fork)
+    keeps the parent's MongoClient and database sockets out of the children.
+    """
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size != processes:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'),),
+            )
+            _pool_size = processes
+    return _pool
+
+
+def shard_ranges(filters, shards):
+    """
+    Split the filtered visit set into up to `shards` contiguous created_at
+    ranges of roughly equal size, as (low, high, high_inclusive) tuples in
+    created_at order. $bucketAuto never splits equal values across buckets,
+    so no visit falls into two ranges.
+    """
+    pipeline = [{'$bucketAuto': {'groupBy': '$created_at', 'buckets': shards}}]
+    buckets = list(export_queryset(filters).order_by().aggregate(pipeline, allowDiskUse=True))
+    # $bucketAuto bounds are [min, max) except for the last bucket, which includes max
+    return [
+        (bucket['_id']['min'], bucket['_id']['max'], i == len(buckets) - 1)
+        for i, bucket in enumerate(buckets)
+    ]
+
+
+def format_shard(params, low, high, high_inclusive):
+    """Fetch and format one created_at range; runs in a worker process"""
+    filters = parse_export_filters(params)
+    return list(iter_export_rows(export_queryset(filters, created_range=(low, high, high_inclusive))))
+
+
+def iter_export_rows_sharded(filters, processes, shard_size=None, total=None):
+    """
+    Yield export rows formatted in parallel across a process pool.
+
+    Shards are submitted a few at a time and their results yielded strictly in
+    created_at order, the order of an unsharded export, so the output does not
+    depend on the export's size and at most a bounded number of formatted
+    shards is held in memory.
+    """
+    shard_size = shard_size or getattr(settings, 'EXPORT_SHARD_SIZE', 5000)
+    if total is None:
+        total = export_queryset(filters).count()
+    ranges = iter(shard_ranges(filters, max(total // shard_size, 1)))
+    params = filters_to_params(filters)
+    pool = _get_pool(processes)
+
+    pending = deque()
+    for _ in range(processes * 2):
+        shard = next(ranges, None)
+        if shard is None:
+            break
+        pending.append(pool.submit(format_shard, params, *shard))
+    while pending:
+        rows = pending.popleft().result()
+        shard = next(ranges, None)
+        if shard is not None:
+            pending.append(pool.submit(format_shard, params, *shard))
+        yield from rows
+
+
+def export_rows(filters):
+    """
+    Export rows for the given filters: sharded across EXPORT_PROCESSES worker
+    processes for large exports, otherwise formatted in this process.
+    """
+    processes = getattr(settings, 'EXPORT_PROCESSES', 0)
+    if processes > 1:
+        total = export_queryset(filters).count()
+        if total >= getattr(settings, 'EXPORT_SHARD_MIN_ROWS', 20000):
+            return iter_export_rows_sharded(filters, processes, total=total)
+    return iter_export_rows(export_queryset(filters))
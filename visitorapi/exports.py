@@ -0,0 +1,440 @@
+import csv
+import json
+import os
+import re
+import tempfile
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import HRUser
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv; charset=utf-8'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson; charset=utf-8'
+
+# Rows fetched per round trip from the server-side Mongo cursor
+CURSOR_BATCH_SIZE = 1000
+
+# Bytes sent to the client per chunk of the streamed file
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Header with day-specific columns
+EXPORT_HEADER = [
+    'Visitor ID', 'First Name', 'Last Name', 'Email', 'Phone', 'Organization',
+    'ID Proof Type', 'ID Proof Number', 'Photo URL',
+    "Reference Employee Name", "Reference Employee Department", "Reference Purpose",
+    'Start Time', 'End Time', 'Valid Upto',
+    'Visitor Card ID', 'Approved By', 'Approver Type'
+]
+# Add day-specific check-in/check-out columns (10 days)
+for _day in range(1, 11):
+    EXPORT_HEADER.extend([f'Day {_day} Check In', f'Day {_day} Check Out'])
+
+# NDJSON keys, e.g. 'Visitor ID' -> 'visitor_id', 'Day 1 Check In' -> 'day_1_check_in'
+EXPORT_FIELDS = [name.lower().replace(' ', '_') for name in EXPORT_HEADER]
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+
+# Delta exports stop this far behind "now" so writes stamped just before the
+# token was issued, but committed just after, are not skipped
+DELTA_SAFETY_SECONDS = 5
+DELTA_TOKEN_SALT = 'visitorapi.exports.delta'
+
+
+def get_user_display_name(user):
+    if not user:
+        return ""
+    if user.first_name or user.last_name:
+        return f"{user.first_name or ''} {user.last_name or ''}".strip()
+    return user.username or user.email or str(user)
+
+
+def format_local(dt, fmt):
+    """Format a datetime in IST; naive datetimes are assumed to already be IST"""
+    if not dt:
+        return ''
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    return dt.strftime(fmt)
+
+
+def parse_export_filters(params):
+    """
+    Validate export query parameters and return them as a normalized dict.
+    Raises ValueError with a user-facing message for invalid input.
+
+    Supported parameters: date_from / date_to (YYYY-MM-DD, inclusive, on the
+    request creation date), host (HR user id), host_type (HR or HOS),
+    status (one or more comma separated statuses), group (visit group id)
+    and checked_in (1/true/on).
+    """
+    from visitorapi.mongo_models import MongoVisitRequest
+
+    filters = {}
+    for key in ('date_from', 'date_to'):
+        value = (params.get(key) or '').strip()
+        if value:
+            try:
+                filters[key] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ValueError(f'Invalid {key}: expected YYYY-MM-DD.')
+    if 'date_from' in filters and 'date_to' in filters and filters['date_from'] > filters['date_to']:
+        raise ValueError('date_from must not be after date_to.')
+
+    host = (params.get('host') or '').strip()
+    if host:
+        filters['host'] = host
+
+    group = (params.get('group') or '').strip()
+    if group:
+        filters['group'] = group
+
+    host_type = (params.get('host_type') or '').strip().upper()
+    if host_type:
+        if host_type not in ('HR', 'HOS'):
+            raise ValueError('Invalid host_type: expected HR or HOS.')
+        filters['host_type'] = host_type
+
+    status = (params.get('status') or '').strip().upper()
+    if status:
+        valid = {choice for choice, _ in MongoVisitRequest.STATUS_CHOICES}
+        statuses = sorted({s.strip() for s in status.split(',') if s.strip()})
+        invalid = [s for s in statuses if s not in valid]
+        if invalid:
+            raise ValueError(f"Invalid status: {', '.join(invalid)}.")
+        filters['status'] = statuses
+
+    if (params.get('checked_in') or '').strip().lower() in ('1', 'true', 'on', 'yes'):
+        filters['checked_in'] = True
+    return filters
+
+
+def filters_to_params(filters):
+    """Inverse of parse_export_filters: plain string parameters, stable for hashing and storage"""
+    params = {}
+    for key in ('date_from', 'date_to'):
+        if key in filters:
+            params[key] = filters[key].isoformat()
+    for key in ('host', 'host_type', 'group'):
+        if key in filters:
+            params[key] = filters[key]
+    if 'status' in filters:
+        params['status'] = ','.join(filters['status'])
+    if filters.get('checked_in'):
+        params['checked_in'] = '1'
+    return params
+
+
+def export_queryset(filters=None, created_range=None):
+    """
+    Visit requests to export, read through a non-caching server-side cursor.
+    Filters are pushed down into the Mongo query so they can use the
+    (host_id, created_at) and (status, created_at) indexes.
+
+    created_range is an optional (low, high, high_inclusive) created_at range
+    used by sharded exports; each shard is ordered like a whole export.
+    """
+    from mongoengine.queryset.visitor import Q
+    from visitorapi.mongo_models import MongoVisitRequest
+
+    filters = filters or {}
+    query = {}
+    if 'date_from' in filters:
+        query['created_at__gte'] = timezone.make_aware(datetime.combine(filters['date_from'], time.min))
+    if 'date_to' in filters:
+        query['created_at__lt'] = timezone.make_aware(datetime.combine(filters['date_to'] + timedelta(days=1), time.min))
+
+    if 'host_type' in filters:
+        host_ids = [str(uid) for uid in HRUser.objects.filter(user_type=filters['host_type']).values_list('id', flat=True)]
+        if 'host' in filters:
+            host_ids = [uid for uid in host_ids if uid == filters['host']]
+        query['host_id__in'] = host_ids
+    elif 'host' in filters:
+        query['host_id'] = filters['host']
+
+    if 'status' in filters:
+        query['status__in'] = filters['status']
+    if 'group' in filters:
+        query['group_id'] = filters['group']
+
+    visit_requests = MongoVisitRequest.objects.filter(**query)
+    if filters.get('checked_in'):
+        # Checked in on at least one day of the visit
+        checked_in = Q(day_1_checkin__ne=None)
+        for day in range(2, 11):
+            checked_in |= Q(**{f'day_{day}_checkin__ne': None})
+        visit_requests = visit_requests.filter(checked_in)
+    if created_range:
+        low, high, high_inclusive = created_range
+        visit_requests = visit_requests.filter(
+            Q(created_at__gte=low) & Q(**{'created_at__lte' if high_inclusive else 'created_at__lt': high})
+        )
+    return visit_requests.order_by('created_at').no_cache().batch_size(CURSOR_BATCH_SIZE)
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _load_hr_users(user_ids, hr_users):
+    """Fill the hr_users cache (keyed by string id) with any ids not seen yet"""
+    missing = {uid for uid in user_ids if uid and uid not in hr_users}
+    if not missing:
+        return
+    found = HRUser.objects.in_bulk([int(uid) for uid in missing if uid.isdigit()])
+    for uid in missing:
+        user = found.get(int(uid)) if uid.isdigit() else None
+        hr_users[uid] = (get_user_display_name(user), user.user_type) if user else (f"User {uid}", 'Unknown')
+
+
+def _load_chunk_maps(chunk, hr_users):
+    """
+    Resolve visitors, card numbers and approvers for a chunk of visit requests.
+    Issues one visitors query, one cards query and at most one HR users query.
+    """
+    from bson import ObjectId
+    from visitorapi.mongo_models import MongoVisitor, MongoVisitorCard
+
+    visitor_ids = {vr.visitor_id for vr in chunk if vr.visitor_id and ObjectId.is_valid(vr.visitor_id)}
+    visitors = {
+        str(v.id): v
+        for v in MongoVisitor.objects(id__in=list(visitor_ids)).only(*MongoVisitor.PROJECTION_FIELDS)
+    }
+
+    card_numbers = {}
+    cards = MongoVisitorCard.objects(visit_request_id__in=[str(vr.id) for vr in chunk]).only('visit_request_id', 'card_number')
+    for card in cards:
+        # Keep the first card per request, matching .first() in the views
+        card_numbers.setdefault(card.visit_request_id, card.card_number)
+
+    _load_hr_users({vr.approved_by_id or vr.host_id for vr in chunk}, hr_users)
+    return visitors, card_numbers
+
+
+def build_row(vr, visitor, card_number, approver):
+    """Format a single export row from already-resolved documents"""
+    approver_name, approver_type = approver or ('', '')
+    # Base row data
+    row_data = [
+        str(visitor.id), visitor.first_name, visitor.last_name, visitor.email or '', visitor.phone, visitor.company,
+        visitor.id_proof_type, visitor.id_proof_number,
+        visitor.photo or '',
+        vr.reference_employee_name or '',
+        vr.reference_employee_department or '',
+        vr.reference_purpose or '',
+        format_local(vr.start_time, '%Y-%m-%d %H:%M'),
+        vr.end_time or '',
+        # Handle valid_upto - it can be date or datetime
+        vr.valid_upto.strftime('%Y-%m-%d') if vr.valid_upto else '',
+        card_number or '',
+        approver_name,
+        approver_type
+    ]
+
+    # Add day-specific check-in/check-out data
+    for day in range(1, 11):
+        row_data.append(format_local(getattr(vr, f'day_{day}_checkin'), '%Y-%m-%d %H:%M:%S'))
+        row_data.append(format_local(getattr(vr, f'day_{day}_checkout'), '%Y-%m-%d %H:%M:%S'))
+    return row_data
+
+
+def iter_export_rows(visit_requests, chunk_size=CURSOR_BATCH_SIZE):
+    """
+    Yield one export row per visit request whose visitor still exists.
+
+    Related documents are prefetched per chunk, so the number of queries is
+    constant per chunk instead of three or four per row.
+    """
+    hr_users = {}
+    for chunk in _chunks(visit_requests, chunk_size):
+        visitors, card_numbers = _load_chunk_maps(chunk, hr_users)
+        for vr in chunk:
+            visitor = visitors.get(vr.visitor_id)
+            if visitor is None:
+                continue
+            approver_id = vr.approved_by_id or vr.host_id
+            yield build_row(vr, visitor, card_numbers.get(str(vr.id)), hr_users.get(approver_id))
+
+
+def _stream_file(path):
+    """Yield a file in chunks and remove it once fully sent (or the client goes away)"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def write_xlsx(rows, sheet_title, path):
+    """Write rows to an XLSX file using openpyxl's constant-memory write-only mode"""
+    import openpyxl
+
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title=sheet_title)
+    ws.append(EXPORT_HEADER)
+    empty = True
+    for row in rows:
+        ws.append(row)
+        empty = False
+    if empty:
+        ws.append(['No data found'] + [''] * (len(EXPORT_HEADER) - 1))
+    wb.save(path)
+
+
+def xlsx_response(rows, sheet_title, filename):
+    """
+    Build the workbook in write-only mode and stream it back in chunks.
+
+    Rows are consumed lazily from the cursor and spooled to disk by openpyxl, so
+    memory stays flat regardless of the number of visits.
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write_xlsx(rows, sheet_title, path)
+        size = os.path.getsize(path)
+    except Exception:
+        os.unlink(path)
+        raise
+
+    response = StreamingHttpResponse(_stream_file(path), content_type=XLSX_CONTENT_TYPE)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Content-Length'] = size
+    return response
+
+
+class _Echo:
+    """File-like object whose write() returns the value, so csv.writer can feed a generator"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Yield the header and each row as an encoded CSV line"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_HEADER).encode('utf-8')
+    for row in rows:
+        yield writer.writerow(row).encode('utf-8')
+
+
+def iter_ndjson(rows):
+    """Yield each row as one encoded JSON object per line"""
+    for row in rows:
+        yield (json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _batched(chunks, size=STREAM_CHUNK_SIZE):
+    """Coalesce small byte strings into blocks of roughly `size` bytes"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _gzip(chunks):
+    """Gzip a byte stream incrementally, emitting compressed data as it becomes available"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_response(chunks, content_type, filename, request):
+    """
+    Stream generated bytes to the client, gzip-encoded when the client accepts it.
+    Rows are batched before compression so each gzip block covers many rows.
+    """
+    chunks = _batched(chunks)
+    gzipped = bool(_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+    if gzipped:
+        chunks = _gzip(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Vary'] = 'Accept-Encoding'
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    return response
+
+
+def make_delta_token(until):
+    """Opaque, signed token marking everything up to `until` as exported"""
+    return signing.dumps({'until': until.isoformat()}, salt=DELTA_TOKEN_SALT)
+
+
+def parse_delta_token(token):
+    """
+    Return the datetime encoded in a delta token; raises ValueError for
+    tampered, malformed or expired (older than DELTA_TOKEN_MAX_AGE) tokens
+    """
+    try:
+        payload = signing.loads(token, salt=DELTA_TOKEN_SALT, max_age=getattr(settings, 'DELTA_TOKEN_MAX_AGE', None))
+        return datetime.fromisoformat(payload['until'])
+    except signing.SignatureExpired:
+        raise ValueError('Expired updated_since token: omit it for a full sync.')
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise ValueError('Invalid updated_since token.')
+
+
+def _json_default(value):
+    from bson import ObjectId
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # pymongo returns naive UTC datetimes
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value, timezone.get_fixed_timezone(0))
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def iter_delta(since, until):
+    """
+    Yield NDJSON lines for visit requests, visitors and cards with
+    since < updated_at <= until, each ordered by the updated_at index, followed
+    by a final line carrying the token for the next call.
+    """
+    from visitorapi.mongo_models import MongoVisitor, MongoVisitorCard, MongoVisitRequest
+
+    for record_type, model in (
+        ('visit_request', MongoVisitRequest),
+        ('visitor', MongoVisitor),
+        ('visitor_card', MongoVisitorCard),
+    ):
+        window = {'$lte': until}
+        if since:
+            window['$gt'] = since
+        # Raw documents: no need to build mongoengine objects just to serialize them
+        cursor = model._get_collection().find(
+            {'updated_at': window},
+            sort=[('updated_at', 1)],
+            batch_size=CURSOR_BATCH_SIZE,
+        )
+        for doc in cursor:
+            yield (json.dumps({'type': record_type, 'data': doc}, default=_json_default, ensure_ascii=False) + '\n').encode('utf-8')
+    yield (json.dumps({'type': 'token', 'next_token': make_delta_token(until)}) + '\n').encode('utf-8')
@@ -0,0 +1,75 @@
+import itertools
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import HRUser
+
+# user_type -> (loaded_at, host ids as stored in MongoVisitRequest.host_id)
+_hosts = {}
+_hosts_lock = threading.Lock()
+_round_robin = itertools.count()
+
+
+def eligible_hosts(user_type):
+    """
+    Active hosts of this type, cached per worker. Saves and deletes in this
+    process clear the cache; HOST_CACHE_SECONDS bounds how long other workers
+    keep a stale list.
+    """
+    ttl = getattr(settings, 'HOST_CACHE_SECONDS', 300)
+    with _hosts_lock:
+        cached = _hosts.get(user_type)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    hosts = [
+        str(host_id)
+        for host_id in HRUser.objects.filter(user_type=user_type, is_active=True).order_by('id').values_list('id', flat=True)
+    ]
+    with _hosts_lock:
+        _hosts[user_type] = (time.monotonic(), hosts)
+    return hosts
+
+
+@receiver(post_save, sender=HRUser)
+@receiver(post_delete, sender=HRUser)
+def invalidate_hosts(sender, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        # Logins don't change which hosts are eligible
+        return
+    with _hosts_lock:
+        _hosts.clear()
+
+
+def _least_pending(hosts):
+    """The host with the fewest pending visit requests; one aggregate over the status index"""
+    from visitorapi.mongo_models import MongoVisitRequest
+
+    pending = {
+        row['_id']: row['count']
+        for row in MongoVisitRequest._get_collection().aggregate([
+            {'$match': {'status': 'PENDING', 'host_id': {'$in': hosts}}},
+            {'$group': {'_id': '$host_id', 'count': {'$sum': 1}}},
+        ])
+    }
+    return min(hosts, key=lambda host_id: pending.get(host_id, 0))
+
+
+def route_host(user_type):
+    """
+    Host id a new visit request of this type is assigned to, or None if there
+    is no eligible host. HOST_ROUTING picks the strategy: 'first' (default,
+    the lowest id, as before), 'round_robin' or 'least_pending'.
+    """
+    hosts = eligible_hosts(user_type)
+    if not hosts:
+        return None
+    strategy = getattr(settings, 'HOST_ROUTING', 'first')
+    if strategy == 'least_pending':
+        return _least_pending(hosts)
+    if strategy == 'round_robin':
+        return hosts[next(_round_robin) % len(hosts)]
+    return hosts[0]
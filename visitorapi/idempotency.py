@@ -0,0 +1,142 @@
+import hashlib
+import logging
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+FIELD = 'idempotency_key'  # Form field alternative to the header
+MAX_KEY_LENGTH = 255
+FORM_CONTENT_TYPES = ('multipart/form-data', 'application/x-www-form-urlencoded')
+
+
+def _fingerprint(request):
+    """Hash of the request parameters, so a key reused for a different request is refused"""
+    digest = hashlib.sha256()
+    if request.content_type in FORM_CONTENT_TYPES:
+        for name, values in sorted(request.POST.lists()):
+            if name not in (FIELD, 'csrfmiddlewaretoken'):
+                digest.update(repr((name, values)).encode())
+        for name, files in sorted(request.FILES.lists()):
+            digest.update(repr((name, [(f.name, f.size) for f in files])).encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _scope(request):
+    """
+    Whose keys these are: the session user, or for API clients a hash of
+    their Authorization header. DRF token authentication runs inside the
+    view, after this decorator, so request.user is anonymous for them.
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return str(user.pk)
+    authorization = request.headers.get('Authorization')
+    if authorization:
+        return 'auth:' + hashlib.sha256(authorization.encode()).hexdigest()
+    return ''
+
+
+def _claim(key, fingerprint):
+    """
+    Reserve key for this request. Returns None when the caller should run
+    the view, or the stored document of an earlier request with the key.
+    """
+    from visitorapi.mongo_models import MongoIdempotencyKey
+
+    collection = MongoIdempotencyKey._get_collection()
+    now = timezone.now()
+    lock = {
+        'fingerprint': fingerprint,
+        'status_code': None,
+        'locked_until': now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_SECONDS', 60)),
+        'created_at': now,
+        'expires_at': now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 3600)),
+    }
+    try:
+        collection.insert_one(dict(lock, _id=key))
+        return None
+    except DuplicateKeyError:
+        pass
+    # The first attempt died before storing its response: take over its claim
+    if collection.find_one_and_update(
+        {'_id': key, 'status_code': None, 'fingerprint': fingerprint, 'locked_until': {'$lt': now}},
+        {'$set': lock},
+    ):
+        return None
+    return collection.find_one({'_id': key}) or {'fingerprint': fingerprint, 'status_code': None}
+
+
+def _store(key, response):
+    from visitorapi.mongo_models import MongoIdempotencyKey
+
+    collection = MongoIdempotencyKey._get_collection()
+    if response.streaming or response.status_code >= 500:
+        # Not replayable; let a retry redo the work
+        collection.delete_one({'_id': key})
+        return
+    collection.update_one({'_id': key}, {'$set': {
+        'status_code': response.status_code,
+        'content': response.content,
+        'content_type': response.get('Content-Type'),
+    }})
+
+
+def _replay(stored, fingerprint):
+    if stored['fingerprint'] != fingerprint:
+        return JsonResponse({'error': 'This idempotency key was already used for a different request.'}, status=422)
+    if stored['status_code'] is None:
+        response = JsonResponse({'error': 'A request with this idempotency key is still being processed.'}, status=409)
+        response['Retry-After'] = '1'
+        return response
+    response = HttpResponse(stored['content'], status=stored['status_code'], content_type=stored['content_type'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """
+    Let clients retry a POST safely by sending an Idempotency-Key header (or
+    an idempotency_key form field). The first response for a key is stored
+    and returned as-is for repeats, without running the view again. Requests
+    without a key are handled as before.
+
+    Place above @api_view so the stored response is the rendered one.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+        client_key = (request.headers.get(HEADER) or '').strip()
+        if not client_key and request.content_type in FORM_CONTENT_TYPES:
+            client_key = (request.POST.get(FIELD) or '').strip()
+        if not client_key:
+            return view(request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return JsonResponse({'error': f'Idempotency key must be at most {MAX_KEY_LENGTH} characters.'}, status=400)
+
+        key = f'{request.path}|{_scope(request)}|{client_key}'
+        fingerprint = _fingerprint(request)
+        stored = _claim(key, fingerprint)
+        if stored is not None:
+            logger.info(f"Replaying response for idempotency key {key}")
+            return _replay(stored, fingerprint)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        except Exception:
+            _store(key, HttpResponse(status=500))
+            raise
+        _store(key, response)
+        return response
+    return wrapper
@@ -0,0 +1,48 @@
+from django.conf import settings
+
+from .search import digits_only, fold
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def normalize_phone(phone):
+    """
+    E.164-style digits with a leading '+': "098765 43210", "9876543210" and
+    "+91 98765-43210" all become "+919876543210". Local numbers get
+    DEFAULT_PHONE_COUNTRY_CODE.
+    """
+    digits = digits_only(phone)
+    if not digits:
+        return None
+    country_code = getattr(settings, 'DEFAULT_PHONE_COUNTRY_CODE', '91')
+    if digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith('0'):
+        digits = country_code + digits[1:]
+    elif len(digits) == 10:
+        digits = country_code + digits
+    return f'+{digits}'
+
+
+def normalize_name(value):
+    """Case-folded, accent-stripped, single-spaced"""
+    return ' '.join(fold(value).split())
+
+
+def visitor_identity_key(email, first_name, last_name, phone, company):
+    """
+    Key identifying a visitor: the normalized email when there is one,
+    otherwise normalized name, phone and company.
+    """
+    email = normalize_email(email)
+    if email:
+        return f'email:{email}'
+    return 'contact:' + '|'.join([
+        normalize_name(first_name),
+        normalize_name(last_name),
+        normalize_phone(phone) or '',
+        normalize_name(company),
+    ])
@@ -0,0 +1,54 @@
+"""
+Failed-login throttling, kept in the Django cache so a flood of bad
+passwords is turned away before any password hashing. Counters are per
+username and per client IP. With the default per-process cache each worker
+counts on its own; configure a shared CACHES backend for one count per site.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _window():
+    return getattr(settings, 'LOGIN_FAILURE_WINDOW_SECONDS', 900)
+
+
+def client_ip(request):
+    if getattr(settings, 'LOGIN_TRUST_X_FORWARDED_FOR', False):
+        # The last hop was added by our proxy; earlier ones come from the client
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _keys(request, username):
+    # Hashed: usernames are user input, and some cache backends restrict key characters
+    user = hashlib.sha256((username or '').strip().lower().encode()).hexdigest()
+    return [
+        (f'login-fail:user:{user}', getattr(settings, 'LOGIN_FAILURE_LIMIT', 5)),
+        (f'login-fail:ip:{client_ip(request)}', getattr(settings, 'LOGIN_IP_FAILURE_LIMIT', 50)),
+    ]
+
+
+def is_throttled(request, username):
+    keys = _keys(request, username)
+    counts = cache.get_many([key for key, _ in keys])
+    return any(counts.get(key, 0) >= limit for key, limit in keys)
+
+
+def record_failure(request, username):
+    for key, _ in _keys(request, username):
+        # add() starts the window on the first failure; incr() keeps it
+        cache.add(key, 0, _window())
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, _window())
+
+
+def reset_failures(request, username):
+    # The IP counter is kept: one good password does not clear a flood from that address
+    cache.delete(_keys(request, username)[0][0])
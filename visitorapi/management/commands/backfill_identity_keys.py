@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from visitorapi.exports import CURSOR_BATCH_SIZE
+from visitorapi.identity import visitor_identity_key
+from visitorapi.mongo_models import MongoVisitor
+
+
+class Command(BaseCommand):
+    help = 'Set the normalized identity key used by register_visitor on visitors that lack it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CURSOR_BATCH_SIZE,
+            help=f'Visitors updated per bulk write (default: {CURSOR_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        collection = MongoVisitor._get_collection()
+        MongoVisitor.ensure_indexes()
+
+        cursor = collection.find(
+            {'identity_key': None},
+            projection=['email', 'first_name', 'last_name', 'phone', 'company'],
+            batch_size=options['batch_size'],
+        )
+        updated = duplicates = 0
+        ops = []
+
+        def flush():
+            nonlocal updated, duplicates
+            try:
+                updated += collection.bulk_write(ops, ordered=False).modified_count
+            except BulkWriteError as e:
+                # Visitors whose key is already taken are duplicates; leave them unkeyed
+                updated += e.details['nModified']
+                duplicates += sum(1 for error in e.details['writeErrors'] if error['code'] == 11000)
+                if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                    raise
+            ops.clear()
+
+        for doc in cursor:
+            key = visitor_identity_key(
+                doc.get('email'), doc.get('first_name'), doc.get('last_name'), doc.get('phone'), doc.get('company'),
+            )
+            ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'identity_key': key}}))
+            if len(ops) >= options['batch_size']:
+                flush()
+        if ops:
+            flush()
+
+        self.stdout.write(self.style.SUCCESS(f'Set identity keys on {updated} visitors.'))
+        if duplicates:
+            self.stdout.write(self.style.WARNING(
+                f'{duplicates} visitors duplicate an existing identity and were left without a key.'
+            ))
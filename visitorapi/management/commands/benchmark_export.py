@@ -0,0 +1,183 @@
+import math
+import os
+import random
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from mongoengine import connect, disconnect
+from pymongo import monitoring
+
+from visitorapi.export_shards import _get_pool, iter_export_rows_sharded
+from visitorapi.exports import CURSOR_BATCH_SIZE, export_queryset, iter_export_rows
+from visitorapi.mongo_models import MongoVisitor, MongoVisitRequest, MongoVisitorCard
+
+
+class _CommandCounter(monitoring.CommandListener):
+    """Counts MongoDB commands issued by the client, by command name"""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def started(self, event):
+        self.counts[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark export row assembly and report queries issued per chunk'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            nargs='+',
+            default=[1000, 10000, 100000],
+            help='Row counts to benchmark (default: 1000 10000 100000)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CURSOR_BATCH_SIZE,
+            help=f'Visit requests resolved per bulk chunk (default: {CURSOR_BATCH_SIZE})',
+        )
+        parser.add_argument(
+            '--db',
+            default=f"{settings.MONGODB_SETTINGS['db']}_bench",
+            help='MongoDB database to benchmark against (default: <db>_bench)',
+        )
+        parser.add_argument(
+            '--seed',
+            action='store_true',
+            help='Insert synthetic visitors, visit requests and cards until the largest --rows count is available',
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            nargs='+',
+            help='Also time a full sharded export with each worker process count (1 = single process baseline)',
+        )
+
+    def handle(self, *args, **options):
+        if options['db'] == settings.MONGODB_SETTINGS['db'] and options['seed']:
+            raise CommandError('Refusing to seed synthetic data into the application database.')
+
+        # Spawned export workers read the database name from the environment
+        os.environ['MONGODB_DB_NAME'] = options['db']
+
+        # Reconnect with a command listener so every Mongo round trip is counted
+        counter = _CommandCounter()
+        disconnect(alias='default')
+        connect(
+            db=options['db'],
+            host=settings.MONGODB_SETTINGS['host'],
+            alias='default',
+            event_listeners=[counter],
+        )
+
+        if options['seed']:
+            self._seed(max(options['rows']))
+
+        available = MongoVisitRequest.objects.count()
+        self.stdout.write(f"Benchmarking against '{options['db']}' ({available} visit requests available)")
+        self.stdout.write(f"{'rows':>8} {'seconds':>9} {'chunks':>7} {'mongo':>7} {'sql':>5} {'per chunk':>10}")
+
+        for rows in options['rows']:
+            if rows > available:
+                self.stdout.write(self.style.WARNING(f'Skipping {rows}: only {available} visit requests available'))
+                continue
+            counter.counts.clear()
+            started = time.perf_counter()
+            with CaptureQueriesContext(connection) as sql:
+                produced = sum(1 for _ in iter_export_rows(export_queryset()[:rows], chunk_size=options['chunk_size']))
+            elapsed = time.perf_counter() - started
+            mongo_queries = counter.counts['find'] + counter.counts['getMore'] + counter.counts['aggregate']
+            chunks = math.ceil(rows / options['chunk_size'])
+            per_chunk = (mongo_queries + len(sql)) / chunks
+            self.stdout.write(
+                f"{produced:>8} {elapsed:>9.2f} {chunks:>7} {mongo_queries:>7} {len(sql):>5} {per_chunk:>10.2f}"
+            )
+
+        if options['processes']:
+            self._benchmark_processes(options['processes'], available)
+
+    def _benchmark_processes(self, process_counts, available):
+        """Time a full export of the benchmark database for each process count"""
+        self.stdout.write(f"\nSharded export of all {available} visit requests")
+        self.stdout.write(f"{'processes':>9} {'rows':>8} {'seconds':>9} {'speedup':>8}")
+        baseline = None
+        for processes in process_counts:
+            if processes > 1:
+                # Start every worker first so process start-up (Django setup) is not timed
+                pool = _get_pool(processes)
+                for future in [pool.submit(time.sleep, 0.5) for _ in range(processes)]:
+                    future.result()
+            started = time.perf_counter()
+            if processes > 1:
+                produced = sum(1 for _ in iter_export_rows_sharded({}, processes, total=available))
+            else:
+                produced = sum(1 for _ in iter_export_rows(export_queryset()))
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            self.stdout.write(f"{processes:>9} {produced:>8} {elapsed:>9.2f} {baseline / elapsed:>7.2f}x")
+
+    def _seed(self, target):
+        """Insert synthetic data directly with insert_many, bypassing per-document save hooks"""
+        existing = MongoVisitRequest.objects.count()
+        missing = target - existing
+        if missing <= 0:
+            return
+        self.stdout.write(f'Seeding {missing} synthetic visits...')
+        now = timezone.localtime(timezone.now())
+        batch = 5000
+        for offset in range(existing, target, batch):
+            size = min(batch, target - offset)
+            visitors = [
+                MongoVisitor(
+                    first_name=f'Bench{offset + i}',
+                    last_name='Visitor',
+                    email=f'bench{offset + i}@example.com',
+                    phone=f'9{offset + i:09d}',
+                    company='Bench Co',
+                    id_proof_type='Passport',
+                    id_proof_number=f'B{offset + i:08d}',
+                ).to_mongo()
+                for i in range(size)
+            ]
+            visitor_ids = MongoVisitor._get_collection().insert_many(visitors).inserted_ids
+            visits = []
+            for visitor_id in visitor_ids:
+                visit = MongoVisitRequest(
+                    visitor_id=str(visitor_id),
+                    host_id=str(random.randint(1, 5)),
+                    purpose='Meeting',
+                    visit_date=now.date(),
+                    start_time=now,
+                    end_time='17:30:00',
+                    status='APPROVED',
+                )
+                for day in range(1, 11):
+                    setattr(visit, f'day_{day}_checkin', now)
+                    setattr(visit, f'day_{day}_checkout', now)
+                visits.append(visit.to_mongo())
+            visit_ids = MongoVisitRequest._get_collection().insert_many(visits).inserted_ids
+            cards = [
+                MongoVisitorCard(
+                    visit_request_id=str(visit_id),
+                    card_number=f'VC-B{offset + i:09d}',
+                    qr_code_image='bench.png',
+                ).to_mongo()
+                for i, visit_id in enumerate(visit_ids)
+                if i % 2 == 0
+            ]
+            if cards:
+                MongoVisitorCard._get_collection().insert_many(cards)
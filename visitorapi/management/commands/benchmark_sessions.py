@@ -0,0 +1,63 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+# (label, SESSION_ENGINE, SESSION_SAVE_EVERY_REQUEST)
+MODES = [
+    ('db, save every request', 'django.contrib.sessions.backends.db', True),
+    ('db, refresh', 'django.contrib.sessions.backends.db', False),
+    ('signed cookie', 'visitorapi.signed_sessions', False),
+]
+
+
+class SessionQueryCounter:
+    """execute_wrapper that counts reads and writes of the django_session table"""
+
+    def __init__(self):
+        self.reads = self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'django_session' in sql:
+            if sql.lstrip().upper().startswith('SELECT'):
+                self.reads += 1
+            else:
+                self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Count django_session reads and writes per logged-in request for each session mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Requests per mode')
+        parser.add_argument('--path', default='/search_visitors/?q=zz', help='Page requested as a logged-in user')
+        parser.add_argument('--username', help='Existing user to log in as (default: a temporary user)')
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        temporary = None
+        if options['username']:
+            user = User.objects.get(username=options['username'])
+        else:
+            temporary = user = User.objects.create_user(
+                username='session-benchmark', password=None, employee_id='session-benchmark',
+            )
+        count = options['requests']
+        try:
+            for label, engine, save_every_request in MODES:
+                with override_settings(SESSION_ENGINE=engine, SESSION_SAVE_EVERY_REQUEST=save_every_request):
+                    client = Client()
+                    client.force_login(user)
+                    counter = SessionQueryCounter()
+                    with connection.execute_wrapper(counter):
+                        for _ in range(count):
+                            client.get(options['path'])
+                self.stdout.write(
+                    f'{label:<24} {counter.writes / count:5.2f} writes/request  '
+                    f'{counter.reads / count:5.2f} reads/request'
+                )
+        finally:
+            if temporary:
+                temporary.delete()
@@ -0,0 +1,80 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from visitorapi.mongo_models import MongoVisitor
+from visitorapi.search import (
+    RESULT_FIELDS,
+    SEARCH_LIMIT,
+    _cached_search,
+    query_filter,
+    result_from_document,
+    search_cache_stats,
+)
+from visitorapi.visitor_index import VisitorPrefixIndex
+
+
+class Command(BaseCommand):
+    help = 'Compare visitor search latency from the in-memory index, the result cache and MongoDB'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=1000,
+            help='Number of sampled autocomplete queries to time (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = VisitorPrefixIndex()
+        index.build()
+        build_seconds = time.perf_counter() - started
+        stats = index.stats()
+        self.stdout.write(
+            f"Index: {stats['visitors']} visitors, {stats['tokens']} tokens, "
+            f"{stats['bytes'] / 2**20:.1f} MiB, built in {build_seconds:.2f}s"
+        )
+        if not stats['visitors']:
+            return
+
+        # Keystroke-style prefixes of real names and phone numbers
+        sample = MongoVisitor._get_collection().aggregate([
+            {'$sample': {'size': options['queries']}},
+            {'$project': {'first_name': 1, 'phone': 1}},
+        ])
+        queries, keystrokes = [], []
+        for doc in sample:
+            value = random.choice([doc.get('first_name') or '', doc.get('phone') or ''])
+            if len(value) >= 2:
+                queries.append(value[:random.randint(2, len(value))])
+                keystrokes.extend(value[:n] for n in range(2, len(value) + 1))
+
+        collection = MongoVisitor._get_collection()
+        timings = {}
+        # Each sampled value typed one keystroke at a time through the result cache
+        for query in keystrokes:
+            _cached_search(query, SEARCH_LIMIT, 60)
+        stats = search_cache_stats()
+        self.stdout.write(
+            f"Cache over {len(keystrokes)} keystrokes: {stats.get('hit', 0)} hits, "
+            f"{stats.get('narrowed', 0)} narrowed, {stats.get('miss', 0)} misses ({stats['hit_rate']:.0%} hit rate)"
+        )
+
+        for name, search in (
+            ('memory', lambda q: index.search(q)),
+            ('cache', lambda q: _cached_search(q, SEARCH_LIMIT, 60)),
+            ('mongo', lambda q: [
+                result_from_document(doc)
+                for doc in collection.find(query_filter(q), projection=list(RESULT_FIELDS), limit=SEARCH_LIMIT)
+            ]),
+        ):
+            started = time.perf_counter()
+            for query in queries:
+                search(query)
+            timings[name] = (time.perf_counter() - started) / len(queries)
+
+        self.stdout.write(f"{'backend':>8} {'per query':>12}")
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name:>8} {seconds * 1e6:>9.1f} us")
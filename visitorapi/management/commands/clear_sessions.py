@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
-from django.contrib.sessions.models import Session
-from django.utils import timezone
+
+from visitorapi.session_epoch import bump_session_epoch, prune_stale_sessions
 
 class Command(BaseCommand):
     help = 'Clear all user sessions'
@@ -19,13 +19,13 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.WARNING('Operation cancelled.'))
                 return
 
-        # Clear all sessions
-        session_count = Session.objects.count()
-        Session.objects.all().delete()
+        # Invalidate all sessions, then delete their rows
+        epoch = bump_session_epoch()
+        pruned = prune_stale_sessions()
         
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully cleared {session_count} user sessions.')
+            self.style.SUCCESS(f'Successfully cleared all user sessions (epoch {epoch}, {pruned} stale sessions deleted).')
         )
         self.stdout.write(
             self.style.SUCCESS('All users will need to log in again.')
-        ) 
\ No newline at end of file
+        ) 
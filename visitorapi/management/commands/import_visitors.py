@@ -0,0 +1,76 @@
+import csv
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from visitorapi.bulk_import import IMPORT_BATCH_SIZE, import_visitors, iter_import_rows, summarize
+
+
+class Command(BaseCommand):
+    help = 'Pre-register visitors for an event from a CSV or XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with a header row')
+        parser.add_argument(
+            '--created-by',
+            help='Username of the registration user to record as creator',
+        )
+        parser.add_argument(
+            '--host-type',
+            choices=['HR', 'HOS'],
+            default='HOS',
+            help="Host type for rows without send_to_hr (default: HOS)",
+        )
+        parser.add_argument(
+            '--group',
+            help='Register rows without a group column as one group visit with this name',
+        )
+        parser.add_argument(
+            '--report',
+            help='Write the per-row report to this CSV file',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help=f'Rows resolved and inserted per batch (default: {IMPORT_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options['created_by']:
+            try:
+                created_by = get_user_model().objects.get(username=options['created_by'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['created_by']}")
+
+        started = time.perf_counter()
+        with open(options['path'], 'rb') as f:
+            report = import_visitors(
+                iter_import_rows(f, options['path']),
+                created_by=created_by,
+                default_host_type=options['host_type'],
+                batch_size=options['batch_size'],
+                group_name=options['group'],
+            )
+        elapsed = time.perf_counter() - started
+
+        for entry in report:
+            if entry['status'] == 'error':
+                self.stdout.write(self.style.WARNING(f"Row {entry['row']}: {'; '.join(entry['errors'])}"))
+        summary = summarize(report)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['created']} of {summary['rows']} rows "
+            f"({summary['new_visitors']} new visitors, {summary['errors']} errors) in {elapsed:.2f}s"
+        ))
+
+        if options['report']:
+            with open(options['report'], 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['row', 'name', 'status', 'visitor', 'visitor_id', 'visit_request_id', 'errors'])
+                for entry in report:
+                    writer.writerow([
+                        entry['row'], entry['name'], entry['status'], entry.get('visitor', ''),
+                        entry.get('visitor_id', ''), entry.get('visit_request_id', ''), '; '.join(entry.get('errors', [])),
+                    ])
@@ -0,0 +1,223 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from pymongo import InsertOne, UpdateMany, UpdateOne
+
+from visitorapi.exports import CURSOR_BATCH_SIZE
+from visitorapi.identity import normalize_email, normalize_name, normalize_phone
+from visitorapi.mongo_models import MongoVisitor, MongoVisitRequest
+from visitorapi.search import invalidate_search_cache
+
+# Working collections; they survive interruptions so a rerun resumes
+BLOCKS_COLLECTION = 'visitor_merge_blocks'  # {key, visitor_id}
+MERGES_COLLECTION = 'visitor_merges'  # {_id: duplicate id, into: primary id, done}
+STATE_COLLECTION = 'visitor_merge_state'
+
+
+def block_keys(doc):
+    """
+    Blocking keys for a visitor. Visitors sharing a key are duplicates: the
+    same normalized email, or the same normalized phone and name.
+    """
+    keys = []
+    email = normalize_email(doc.get('email'))
+    if email:
+        keys.append(f'email:{email}')
+    phone = normalize_phone(doc.get('phone'))
+    first_name, last_name = normalize_name(doc.get('first_name')), normalize_name(doc.get('last_name'))
+    if phone and (first_name or last_name):
+        keys.append(f'phone:{phone}|{first_name}|{last_name}')
+    return keys
+
+
+class Command(BaseCommand):
+    help = 'Find duplicate Mongo visitors by blocking on normalized email, phone and name, and merge them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report the duplicates that would be merged without changing visitors or visit requests',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Discard blocking progress from an earlier run and rescan every visitor',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CURSOR_BATCH_SIZE,
+            help=f'Visitors or duplicate groups processed per batch (default: {CURSOR_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        db = MongoVisitor._get_collection().database
+        self.blocks = db[BLOCKS_COLLECTION]
+        self.merges = db[MERGES_COLLECTION]
+        self.state = db[STATE_COLLECTION]
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+
+        if options['restart']:
+            self.blocks.drop()
+            self.state.delete_one({'_id': 'blocks'})
+
+        if not self.dry_run:
+            # Finish merges an interrupted run recorded but did not apply
+            pending = list(self.merges.find({'done': False}))
+            if pending:
+                self.stdout.write(f'Resuming {len(pending)} interrupted merges...')
+                self._apply([(doc['into'], [doc['_id']]) for doc in pending])
+
+        self._build_blocks()
+        groups, duplicates = self._merge_blocks()
+
+        verb = 'Would merge' if self.dry_run else 'Merged'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {duplicates} duplicate visitors into {groups} visitors.'))
+        # Blocks are only reused to resume an interrupted run, never a finished one
+        self.blocks.drop()
+        self.state.delete_one({'_id': 'blocks'})
+        if duplicates and not self.dry_run:
+            invalidate_search_cache()
+
+    def _build_blocks(self):
+        """Stream visitors in _id order into (key, visitor_id) rows, resuming after the last batch written"""
+        state = self.state.find_one({'_id': 'blocks'}) or {}
+        if state.get('done'):
+            self.stdout.write('Blocking keys already built; resuming merge.')
+            return
+        query = {'_id': {'$gt': state['last_id']}} if state.get('last_id') else {}
+        cursor = MongoVisitor._get_collection().find(
+            query,
+            projection=['email', 'phone', 'first_name', 'last_name'],
+            sort=[('_id', 1)],
+            batch_size=self.batch_size,
+        )
+        scanned = 0
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                scanned += self._write_blocks(batch)
+                batch = []
+        if batch:
+            scanned += self._write_blocks(batch)
+        self.blocks.create_index('key')
+        self.state.update_one({'_id': 'blocks'}, {'$set': {'done': True}}, upsert=True)
+        self.stdout.write(f'Built blocking keys for {scanned} visitors.')
+
+    def _write_blocks(self, docs):
+        rows = [InsertOne({'key': key, 'visitor_id': doc['_id']}) for doc in docs for key in block_keys(doc)]
+        if rows:
+            # Rows from a batch interrupted before its checkpoint are written again; $addToSet below dedupes them
+            self.blocks.bulk_write(rows, ordered=False)
+        self.state.update_one({'_id': 'blocks'}, {'$set': {'last_id': docs[-1]['_id']}}, upsert=True)
+        return len(docs)
+
+    def _resolve(self, visitor_ids):
+        """Map each visitor to its surviving visitor, following merges recorded by earlier batches or runs"""
+        hops = {}
+        frontier = set(visitor_ids)
+        while frontier:
+            found = {doc['_id']: doc['into'] for doc in self.merges.find({'_id': {'$in': list(frontier)}})}
+            hops.update(found)
+            frontier = set(found.values()) - set(hops)
+
+        def survivor(visitor_id):
+            while visitor_id in hops:
+                visitor_id = hops[visitor_id]
+            return visitor_id
+
+        return {visitor_id: survivor(visitor_id) for visitor_id in visitor_ids}
+
+    def _merge_blocks(self):
+        """Stream blocks with more than one visitor and merge each batch of groups"""
+        cursor = self.blocks.aggregate(
+            [
+                {'$group': {'_id': '$key', 'visitor_ids': {'$addToSet': '$visitor_id'}}},
+                {'$match': {'visitor_ids.1': {'$exists': True}}},
+            ],
+            allowDiskUse=True,
+            batchSize=self.batch_size,
+        )
+        groups = duplicates = 0
+        batch = []
+        for block in cursor:
+            batch.append(block['visitor_ids'])
+            if len(batch) >= self.batch_size:
+                merged = self._merge_groups(batch)
+                groups, duplicates = groups + merged[0], duplicates + merged[1]
+                batch = []
+        if batch:
+            merged = self._merge_groups(batch)
+            groups, duplicates = groups + merged[0], duplicates + merged[1]
+        return groups, duplicates
+
+    def _merge_groups(self, blocks):
+        resolved = self._resolve({visitor_id for block in blocks for visitor_id in block})
+        # Survivors still present; blocks sharing a visitor are combined
+        members = {
+            doc['_id']: doc
+            for doc in MongoVisitor._get_collection().find(
+                {'_id': {'$in': list(set(resolved.values()))}},
+                projection=['email', 'photo'],
+            )
+        }
+        parent = {}
+
+        def find(visitor_id):
+            while parent.get(visitor_id, visitor_id) != visitor_id:
+                visitor_id = parent[visitor_id]
+            return visitor_id
+
+        for block in blocks:
+            ids = sorted({resolved[v] for v in block if resolved[v] in members})
+            for other in ids[1:]:
+                parent[find(other)] = find(ids[0])
+
+        clusters = {}
+        for visitor_id in list(parent):
+            clusters.setdefault(find(visitor_id), set()).add(visitor_id)
+        merges = []
+        for root, ids in clusters.items():
+            ids.add(root)
+            # Keep the visitor with an email if any, then the oldest (ObjectIds sort by creation time)
+            primary = min(ids, key=lambda v: (not members[v].get('email'), v))
+            merges.append((primary, sorted(ids - {primary})))
+
+        if merges and not self.dry_run:
+            self.merges.bulk_write(
+                [UpdateOne({'_id': dup}, {'$set': {'into': primary, 'done': False}}, upsert=True)
+                 for primary, dups in merges for dup in dups],
+                ordered=False,
+            )
+            self._apply(merges, members)
+        return len(merges), sum(len(dups) for _, dups in merges)
+
+    def _apply(self, merges, members=None):
+        """Repoint visit requests, carry over missing photos, and delete the duplicates"""
+        visitors = MongoVisitor._get_collection()
+        if members is None:
+            ids = [v for primary, dups in merges for v in [primary, *dups]]
+            members = {doc['_id']: doc for doc in visitors.find({'_id': {'$in': ids}}, projection=['photo'])}
+        now = timezone.localtime(timezone.now())
+
+        MongoVisitRequest._get_collection().bulk_write(
+            [UpdateMany(
+                {'visitor_id': {'$in': [str(dup) for dup in dups]}},
+                {'$set': {'visitor_id': str(primary), 'updated_at': now}},
+            ) for primary, dups in merges],
+            ordered=False,
+        )
+        photos = []
+        for primary, dups in merges:
+            if not members.get(primary, {}).get('photo'):
+                photo = next((members[d]['photo'] for d in dups if members.get(d, {}).get('photo')), None)
+                if photo:
+                    photos.append(UpdateOne({'_id': primary}, {'$set': {'photo': photo, 'updated_at': now}}))
+        if photos:
+            visitors.bulk_write(photos, ordered=False)
+
+        duplicate_ids = [dup for _, dups in merges for dup in dups]
+        visitors.delete_many({'_id': {'$in': duplicate_ids}})
+        self.merges.update_many({'_id': {'$in': duplicate_ids}}, {'$set': {'done': True}})
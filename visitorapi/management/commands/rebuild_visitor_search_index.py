@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+
+from visitorapi.exports import CURSOR_BATCH_SIZE
+from visitorapi.mongo_models import MongoVisitor
+from visitorapi.search import visitor_search_keys
+
+
+class Command(BaseCommand):
+    help = 'Recompute the normalized search keys used by the visitor autocomplete'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=CURSOR_BATCH_SIZE,
+            help=f'Visitors updated per bulk write (default: {CURSOR_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        collection = MongoVisitor._get_collection()
+        MongoVisitor.ensure_indexes()
+
+        # Raw projection cursor; keys are written without touching updated_at
+        cursor = collection.find(
+            {},
+            projection=['first_name', 'last_name', 'email', 'phone', 'id_proof_number', 'search_keys'],
+            batch_size=options['batch_size'],
+        )
+        scanned = updated = 0
+        ops = []
+        for doc in cursor:
+            scanned += 1
+            keys = visitor_search_keys(
+                doc.get('first_name'), doc.get('last_name'), doc.get('email'),
+                doc.get('phone'), doc.get('id_proof_number'),
+            )
+            if keys != doc.get('search_keys'):
+                ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {'search_keys': keys}}))
+            if len(ops) >= options['batch_size']:
+                updated += collection.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            updated += collection.bulk_write(ops, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Scanned {scanned} visitors, updated search keys on {updated}.'))
@@ -0,0 +1,51 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from visitorapi.mongo_models import MongoOutboxEmail
+from visitorapi.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails from the outbox, once or continuously'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running, draining the outbox every --interval seconds',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=getattr(settings, 'EMAIL_OUTBOX_POLL_SECONDS', 10),
+            help='Seconds between drains with --loop',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50),
+            help='Emails sent per SMTP connection',
+        )
+        parser.add_argument(
+            '--retry-dead',
+            action='store_true',
+            help='Queue dead-lettered emails again before draining',
+        )
+
+    def handle(self, *args, **options):
+        if options['retry_dead']:
+            requeued = MongoOutboxEmail.objects(status='DEAD').update(
+                set__status='QUEUED', set__attempts=0, set__next_attempt_at=timezone.localtime(timezone.now()),
+            )
+            self.stdout.write(f'Requeued {requeued} dead-lettered emails.')
+
+        while True:
+            sent, failed = drain_outbox(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed.'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -1,10 +1,19 @@
-from django.contrib.sessions.models import Session
-from django.utils import timezone
 from django.conf import settings
 import os
 import hashlib
+import time
+
+from .session_epoch import EPOCH_KEY, bump_session_epoch, current_epoch, prune_later
+
+REFRESHED_AT = '_refreshed_at'  # Session key: when the session was last saved, in epoch seconds
 
 class SessionInvalidationMiddleware:
+    """
+    Logs out sessions created before the current session epoch (see
+    visitorapi.session_epoch) when they are next used, and stamps new
+    sessions with the epoch. A server restart bumps the epoch. Must come
+    before AuthenticationMiddleware.
+    """
     def __init__(self, get_response):
         self.get_response = get_response
         # Check if this is a server restart by looking for a restart flag
@@ -31,16 +40,52 @@ class SessionInvalidationMiddleware:
                 should_clear = True
         
         if should_clear and getattr(settings, 'CLEAR_SESSIONS_ON_RESTART', True):
-            # Clear all existing sessions
-            session_count = Session.objects.count()
-            Session.objects.all().delete()
+            # Workers starting together bump the epoch once; old rows are deleted in the background
+            epoch = bump_session_epoch(coalesce_seconds=getattr(settings, 'SESSION_RESTART_COALESCE_SECONDS', 120))
+            prune_later()
             
             # Create restart flag file with server ID
             with open(restart_flag_file, 'w') as f:
                 f.write(server_id)
             
-            print(f"Server restart detected. Cleared {session_count} user sessions.")
+            print(f"Server restart detected. Sessions from before epoch {epoch} are logged out.")
+
+    def __call__(self, request):
+        session = getattr(request, 'session', None)
+        epoch = None
+        if session is not None and settings.SESSION_COOKIE_NAME in request.COOKIES and session.keys():
+            epoch = current_epoch()
+            # Sessions from before the epoch was first bumped carry none
+            if session.get(EPOCH_KEY, 0) != epoch:
+                session.flush()
+
+        response = self.get_response(request)
+
+        if session is not None and session.modified and EPOCH_KEY not in session and session.keys():
+            session[EPOCH_KEY] = current_epoch() if epoch is None else epoch
+        return response
+
+
+class SessionRefreshMiddleware:
+    """
+    Keeps the sliding SESSION_COOKIE_AGE expiry without saving the session on
+    every request: an unchanged session is saved again only once its last
+    save is SESSION_REFRESH_SECONDS old, so the idle timeout lies between
+    SESSION_COOKIE_AGE - SESSION_REFRESH_SECONDS and SESSION_COOKIE_AGE.
+    Must come right after SessionMiddleware.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
 
     def __call__(self, request):
         response = self.get_response(request)
-        return response 
\ No newline at end of file
+        session = getattr(request, 'session', None)
+        if session is None or not (session.modified or settings.SESSION_COOKIE_NAME in request.COOKIES):
+            return response
+        if not session.keys():
+            # No session, an expired or revoked one, or one just flushed
+            return response
+        now = int(time.time())
+        if session.modified or now - session.get(REFRESHED_AT, 0) >= getattr(settings, 'SESSION_REFRESH_SECONDS', 300):
+            session[REFRESHED_AT] = now
+        return response
@@ -1,4 +1,4 @@
-from mongoengine import Document, StringField, EmailField, ImageField, DateTimeField, BooleanField, DateField, IntField, ReferenceField, EmbeddedDocumentField, EmbeddedDocument, ListField
+from mongoengine import Document, StringField, EmailField, ImageField, DateTimeField, BooleanField, DateField, IntField, ReferenceField, EmbeddedDocumentField, EmbeddedDocument, ListField, DictField, BinaryField
 import qrcode
 from PIL import Image
 from io import BytesIO
@@ -16,19 +16,132 @@ class MongoVisitor(Document):
     id_proof_type = StringField(required=True, max_length=50)
     id_proof_number = StringField(required=True, max_length=100)
     photo = StringField(null=True, blank=True)  # Store file path/URL
+    photo_thumbnail = StringField(null=True, blank=True)  # Set once the photo is processed, see visitorapi.photos
+    search_keys = ListField(StringField())  # Normalized prefixes for autocomplete, see visitorapi.search
+    identity_key = StringField(unique=True, sparse=True)  # Normalized email or name/phone/company, see visitorapi.identity
     created_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
     updated_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
     
+    # Fields needed to display a visitor on dashboards and cards
+    PROJECTION_FIELDS = (
+        'first_name', 'last_name', 'email', 'phone', 'company',
+        'id_proof_type', 'id_proof_number', 'photo', 'photo_thumbnail',
+    )
+    
     meta = {
         'collection': 'visitors',
         'indexes': [
             'email',
             ('first_name', 'last_name', 'phone', 'company'),  # Compound index for unique constraint
+            'updated_at',  # Export watermark
+            'search_keys',  # Registration autocomplete
+            {'fields': ['photo'], 'sparse': True},  # Photo worker: is a staged upload still in use
         ]
     }
     
     def __str__(self):
         return f"{self.first_name} {self.last_name} ({self.company})"
+    
+    def build_search_keys(self):
+        from visitorapi.search import visitor_search_keys
+        return visitor_search_keys(self.first_name, self.last_name, self.email, self.phone, self.id_proof_number)
+    
+    def build_identity_key(self):
+        from visitorapi.identity import visitor_identity_key
+        return visitor_identity_key(self.email, self.first_name, self.last_name, self.phone, self.company)
+    
+    def _after_write(self):
+        from visitorapi.search import invalidate_search_cache
+        from visitorapi.visitor_index import index_visitor
+        index_visitor(self)
+        invalidate_search_cache()
+    
+    def save(self, *args, **kwargs):
+        # Bump on every write so delta exports and export watermarks see the change
+        self.updated_at = timezone.localtime(timezone.now())
+        self.search_keys = self.build_search_keys()
+        identity_key = self.build_identity_key()
+        if identity_key != self.identity_key:
+            # A key held by another visitor makes this one a duplicate: left
+            # unkeyed, as backfill_identity_keys does
+            taken = MongoVisitor.objects(identity_key=identity_key, id__ne=self.id).only('id').first()
+            self.identity_key = None if taken else identity_key
+        result = super().save(*args, **kwargs)
+        self._after_write()
+        return result
+    
+    @classmethod
+    def key_unkeyed_by_email(cls, email, identity_key, fields):
+        """
+        Give the visitor stored with this email but no identity key (saved
+        before keys existed, or left unkeyed by backfill_identity_keys) its
+        key, updating it with fields. Returns the document, or None.
+        """
+        from pymongo import ReturnDocument
+        
+        return cls._get_collection().find_one_and_update(
+            {'email': email, 'identity_key': None},
+            {'$set': dict(fields, identity_key=identity_key)},
+            return_document=ReturnDocument.AFTER,
+        )
+    
+    @classmethod
+    def resolve(cls, email, fields):
+        """
+        Find or create the visitor with this identity in one atomic round trip.
+        
+        With an email, the provided (non-None) fields overwrite the stored
+        details; without one, an existing visitor is returned untouched.
+        """
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+        
+        # Same validation create() would have done, without a round trip
+        candidate = cls(email=email or None, **fields)
+        candidate.validate()
+        
+        now = timezone.localtime(timezone.now())
+        provided = {k: v for k, v in fields.items() if v is not None}
+        derived = {'updated_at': now, 'search_keys': candidate.build_search_keys()}
+        on_insert = {'created_at': now, 'identity_key': candidate.build_identity_key()}
+        if email:
+            on_insert['email'] = email
+            update = {'$set': dict(provided, **derived), '$setOnInsert': on_insert}
+        else:
+            update = {'$setOnInsert': dict(provided, **derived, **on_insert)}
+        
+        collection = cls._get_collection()
+        for attempt in range(3):
+            try:
+                doc = collection.find_one_and_update(
+                    {'identity_key': on_insert['identity_key']},
+                    update,
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                break
+            except DuplicateKeyError:
+                if attempt == 2:
+                    raise
+            # Either another desk inserted the same visitor first, which the
+            # retry matches, or the insert hit the unique email index of a
+            # visitor without an identity key, which gets it now
+            if email:
+                try:
+                    doc = cls.key_unkeyed_by_email(email, on_insert['identity_key'], update['$set'])
+                except DuplicateKeyError:
+                    doc = None
+                if doc:
+                    break
+        
+        visitor = cls._from_son(doc)
+        search_keys = visitor.build_search_keys()
+        if email and search_keys != visitor.search_keys:
+            # Some fields were kept from the stored visitor
+            visitor.search_keys = search_keys
+            collection.update_one({'_id': visitor.id}, {'$set': {'search_keys': search_keys}})
+        visitor._after_write()
+        return visitor
 
 class MongoVisitRequest(Document):
     """MongoDB model for VisitRequest - keeping same field names for Excel compatibility"""
@@ -86,21 +199,87 @@ class MongoVisitRequest(Document):
     day_10_checkin = DateTimeField(null=True, blank=True)
     day_10_checkout = DateTimeField(null=True, blank=True)
     overdue_notification_sent = BooleanField(default=False)
+    group_id = StringField(null=True, blank=True)  # Reference to MongoVisitGroup ID
     
     meta = {
         'collection': 'visit_requests',
         'indexes': [
             'visitor_id',
+            'group_id',
             'host_id',
             'status',
             'visit_date',
-            'created_at'
+            'created_at',
+            'updated_at',  # Export watermark
+            ('status', '-created_at'),  # Print queue: approved requests, newest first
+            ('host_id', 'created_at'),  # Filtered exports by host and date range
+            ('overdue_notification_sent', 'visit_date'),  # Overdue checkout detector
         ]
     }
     
     def __str__(self):
         return f"Visit request for visitor {self.visitor_id} on {self.visit_date}"
     
+    def save(self, *args, **kwargs):
+        # Bump on every write (approval, check-in/out, printing) for delta exports
+        self.updated_at = timezone.localtime(timezone.now())
+        return super().save(*args, **kwargs)
+    
+    @classmethod
+    def unprinted_approved_page(cls, page=1, page_size=50):
+        """
+        Return (total, rows) for one page of the print queue: approved requests
+        whose card is missing or not yet printed, newest first. Each row is a
+        dict with 'visit_request', 'visitor' and 'visitor_card' documents.
+        Everything is resolved in a single aggregation.
+        """
+        pipeline = [
+            {'$match': {'status': 'APPROVED'}},
+            {'$sort': {'created_at': -1}},
+            # visitor_cards stores the request id as a string
+            {'$addFields': {'_vr_id': {'$toString': '$_id'}}},
+            {'$lookup': {
+                'from': MongoVisitorCard._get_collection_name(),
+                'localField': '_vr_id',
+                'foreignField': 'visit_request_id',
+                'as': '_cards',
+            }},
+            # Anti-join: keep requests with no card, or whose first card is unprinted
+            {'$match': {'_cards.0.printed': {'$ne': True}}},
+            {'$addFields': {
+                '_cards': {'$slice': ['$_cards', 1]},
+                '_visitor_oid': {'$convert': {
+                    'input': '$visitor_id', 'to': 'objectId', 'onError': None, 'onNull': None,
+                }},
+            }},
+            {'$lookup': {
+                'from': MongoVisitor._get_collection_name(),
+                'localField': '_visitor_oid',
+                'foreignField': '_id',
+                'pipeline': [{'$project': {f: 1 for f in MongoVisitor.PROJECTION_FIELDS}}],
+                'as': '_visitor',
+            }},
+            # Requests whose visitor no longer exists are skipped
+            {'$unwind': '$_visitor'},
+            {'$project': {'_vr_id': 0, '_visitor_oid': 0}},
+            {'$facet': {
+                'total': [{'$count': 'n'}],
+                'rows': [{'$skip': max(page - 1, 0) * page_size}, {'$limit': page_size}],
+            }},
+        ]
+        result = next(iter(cls.objects.aggregate(pipeline)), {})
+        total = result['total'][0]['n'] if result.get('total') else 0
+        rows = []
+        for doc in result.get('rows', []):
+            cards = doc.pop('_cards')
+            visitor = doc.pop('_visitor')
+            rows.append({
+                'visit_request': cls._from_son(doc),
+                'visitor': MongoVisitor._from_son(visitor),
+                'visitor_card': MongoVisitorCard._from_son(cards[0]) if cards else None,
+            })
+        return total, rows
+    
     def can_check_in_today(self):
         """Check if visitor can check in today"""
         from datetime import date
@@ -181,6 +360,81 @@ class MongoVisitRequest(Document):
         
         return f'day_{days_diff + 1}_checkout'
 
+class MongoVisitGroup(Document):
+    """
+    A delegation registered together. Members are ordinary visit requests
+    carrying the group's id; the group is approved or rejected as one unit,
+    while check-in and check-out stay per member.
+    """
+    name = StringField(required=True, max_length=100)
+    host_id = StringField(required=True)  # Reference to HRUser ID, shared by all members
+    purpose = StringField(null=True, blank=True)
+    status = StringField(choices=MongoVisitRequest.STATUS_CHOICES, default='PENDING', max_length=20)
+    member_count = IntField(default=0)
+    approved_by_id = StringField(null=True, blank=True)  # Reference to HRUser ID
+    created_by_id = StringField(null=True, blank=True)  # Reference to HRUser ID
+    created_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    updated_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    
+    meta = {
+        'collection': 'visit_groups',
+        'indexes': [
+            ('host_id', 'status', '-created_at'),  # Dashboard pending groups
+        ]
+    }
+    
+    def __str__(self):
+        return f"Group {self.name} ({self.member_count} visitors)"
+    
+    def save(self, *args, **kwargs):
+        self.updated_at = timezone.localtime(timezone.now())
+        return super().save(*args, **kwargs)
+    
+    def members(self):
+        return MongoVisitRequest.objects(group_id=str(self.id))
+    
+    def set_status(self, status, user_id=None):
+        """
+        Apply status to the group and all of its still pending members with a
+        single update. Returns the visitor ids of the members that changed.
+        """
+        pending = list(self.members().filter(status='PENDING').only('visitor_id'))
+        self.status = status
+        fields = {'status': status, 'updated_at': timezone.localtime(timezone.now())}
+        if status == 'APPROVED' and user_id:
+            self.approved_by_id = fields['approved_by_id'] = str(user_id)
+        self.save()
+        if pending:
+            MongoVisitRequest._get_collection().update_many(
+                {'_id': {'$in': [vr.id for vr in pending]}, 'status': 'PENDING'},
+                {'$set': fields},
+            )
+        return [vr.visitor_id for vr in pending]
+    
+    @classmethod
+    def pending_with_members(cls, host_ids, since):
+        """
+        Pending groups for the given hosts created since a date, each as a dict
+        with 'group' and its 'visitors', resolved with one query per collection.
+        """
+        groups = list(cls.objects(host_id__in=host_ids, status='PENDING', created_at__gte=since).order_by('-created_at'))
+        if not groups:
+            return []
+        visitor_ids = {}
+        for vr in MongoVisitRequest.objects(group_id__in=[str(g.id) for g in groups]).only('group_id', 'visitor_id'):
+            visitor_ids.setdefault(vr.group_id, []).append(vr.visitor_id)
+        visitors = {
+            str(v.id): v
+            for v in MongoVisitor.objects(id__in=[vid for ids in visitor_ids.values() for vid in ids]).only(*MongoVisitor.PROJECTION_FIELDS)
+        }
+        return [
+            {
+                'group': group,
+                'visitors': [visitors[vid] for vid in visitor_ids.get(str(group.id), []) if vid in visitors],
+            }
+            for group in groups
+        ]
+
 class MongoVisitorCard(Document):
     """MongoDB model for VisitorCard - keeping same field names for Excel compatibility"""
     CARD_STATUS_CHOICES = [
@@ -197,6 +451,7 @@ class MongoVisitorCard(Document):
     issued_by_id = StringField(null=True, blank=True)  # Reference to HRUser ID
     qr_code_image = StringField(null=True, blank=True)  # Store file path/URL
     printed = BooleanField(default=False)
+    updated_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
     
     meta = {
         'collection': 'visitor_cards',
@@ -204,7 +459,8 @@ class MongoVisitorCard(Document):
             'card_number',
             'visit_request_id',
             'status',
-            'issued_at'
+            'issued_at',
+            'updated_at',  # Delta exports
         ]
     }
     
@@ -213,6 +469,7 @@ class MongoVisitorCard(Document):
     
     def save(self, *args, **kwargs):
         print(f"SAVE CALLED for card_number={self.card_number}")
+        self.updated_at = timezone.localtime(timezone.now())
         super().save(*args, **kwargs)
         if not self.qr_code_image:
             print(f"Generating QR for card_number={self.card_number}")
@@ -258,3 +515,140 @@ class MongoVisitorCard(Document):
         if self.qr_code_image:
             return f"/media/visitor_qrcodes/{self.qr_code_image}"
         return ""
+
+class MongoExportJob(Document):
+    """Background export job; finished artifacts are reused while job_key is unchanged"""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    ]
+    
+    # Hash of format, filters and the data watermark at submission time
+    job_key = StringField(required=True, unique=True)
+    export_format = StringField(required=True, max_length=10)
+    filters = DictField()
+    sheet_title = StringField(max_length=31)
+    status = StringField(choices=STATUS_CHOICES, default='QUEUED', max_length=20)
+    dispatched = BooleanField(default=False)  # Handed to a worker pool
+    rows_done = IntField(default=0)
+    total = IntField(null=True)
+    file_path = StringField(null=True, blank=True)
+    error = StringField(null=True, blank=True)
+    created_by_id = StringField(null=True, blank=True)  # Reference to HRUser ID
+    created_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    updated_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    finished_at = DateTimeField(null=True, blank=True)
+    
+    meta = {
+        'collection': 'export_jobs',
+        'indexes': [
+            'finished_at',
+        ]
+    }
+    
+    def __str__(self):
+        return f"{self.export_format} export {self.id} ({self.status})"
+    
+    @property
+    def progress(self):
+        """Percentage of rows written, or None while the total is unknown"""
+        if self.status == 'DONE':
+            return 100
+        if not self.total:
+            return None
+        return min(int(self.rows_done * 100 / self.total), 99)
+
+class MongoIdempotencyKey(Document):
+    """Response stored for a client idempotency key; Mongo removes it at expires_at"""
+    key = StringField(primary_key=True)  # Request path, user id and client key
+    fingerprint = StringField(required=True)  # Hash of the request parameters
+    status_code = IntField(null=True)  # None while the first request is in progress
+    content = BinaryField()
+    content_type = StringField()
+    locked_until = DateTimeField()
+    created_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    expires_at = DateTimeField(required=True)
+    
+    meta = {
+        'collection': 'idempotency_keys',
+        'indexes': [
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+        ]
+    }
+    
+    def __str__(self):
+        return f"Idempotency key {self.key} ({self.status_code or 'in progress'})"
+
+class MongoOutboxEmail(Document):
+    """Email queued by a view and sent later by the outbox worker"""
+    STATUS_CHOICES = [
+        ('QUEUED', 'Queued'),
+        ('SENDING', 'Sending'),
+        ('SENT', 'Sent'),
+        ('DEAD', 'Dead'),  # Gave up after a permanent error or too many attempts
+        ('DIGEST', 'Held for digest'),
+        ('ROLLING', 'Being rolled into a digest'),
+        ('DIGESTED', 'Sent as part of a digest'),
+    ]
+    
+    subject = StringField(required=True)
+    body = StringField(required=True)
+    from_email = StringField(null=True, blank=True)
+    to = ListField(StringField(), required=True)
+    # Set for emails that must be queued at most once. Not null=True: an explicit
+    # null is indexed by the unique sparse index, so only one unkeyed email could exist
+    dedupe_key = StringField()
+    digest = BooleanField(default=False)  # Notification eligible for per-recipient digests
+    status = StringField(choices=STATUS_CHOICES, default='QUEUED', max_length=20)
+    attempts = IntField(default=0)
+    next_attempt_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    claim = StringField(null=True, blank=True)  # Batch token of the worker sending it
+    locked_until = DateTimeField(null=True, blank=True)
+    last_error = StringField(null=True, blank=True)
+    created_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    sent_at = DateTimeField(null=True, blank=True)
+    
+    meta = {
+        'collection': 'email_outbox',
+        'indexes': [
+            ('status', 'next_attempt_at'),  # Worker: due queued emails
+            'claim',
+            ('to', 'created_at'),  # Digests: recent notifications per recipient
+            {'fields': ['dedupe_key'], 'unique': True, 'sparse': True},
+            {'fields': ['sent_at'], 'expireAfterSeconds': 7 * 24 * 3600},  # Sent and digested emails are kept a week
+        ]
+    }
+    
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+class MongoRevokedSession(Document):
+    """Signed-cookie session ended by logout; Mongo removes it once the cookie would have expired anyway"""
+    sid = StringField(primary_key=True)  # Random id carried in the session cookie
+    revoked_at = DateTimeField(default=lambda: timezone.localtime(timezone.now()))
+    expires_at = DateTimeField(required=True)
+    
+    meta = {
+        'collection': 'revoked_sessions',
+        'indexes': [
+            {'fields': ['expires_at'], 'expireAfterSeconds': 0},
+        ]
+    }
+    
+    def __str__(self):
+        return f"Revoked session {self.sid}"
+
+class MongoSessionEpoch(Document):
+    """Current session epoch; sessions stamped with an older one are logged out on their next request"""
+    name = StringField(primary_key=True)
+    epoch = IntField(default=0)
+    bumped_at = DateTimeField(null=True, blank=True)
+    
+    meta = {
+        'collection': 'session_epochs',
+    }
+    
+    def __str__(self):
+        return f"Session epoch {self.name}: {self.epoch}"
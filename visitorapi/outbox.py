@@ -0,0 +1,310 @@
+import logging
+import smtplib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_drain_pending = threading.Event()
+_digest_timer = None
+
+
+def _now():
+    return timezone.localtime(timezone.now())
+
+
+def _get_executor():
+    """Per-process single sender thread, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+    return _executor
+
+
+def _digest_seconds():
+    return getattr(settings, 'EMAIL_DIGEST_SECONDS', 0)
+
+
+def enqueue_emails(emails, digest=False):
+    """
+    Queue (subject, body, recipients, from_email[, dedupe_key]) tuples for
+    sending and return the number queued. Emails without recipients are
+    skipped, and so are emails whose dedupe_key was already queued. This is
+    the only thing request handlers do with email; sending happens in the
+    outbox worker.
+
+    With digest and EMAIL_DIGEST_SECONDS set, each recipient gets their own
+    copy: sent right away if they had no notification within the window,
+    otherwise held and rolled into one summary per window.
+    """
+    from visitorapi.mongo_models import MongoOutboxEmail
+
+    collection = MongoOutboxEmail._get_collection()
+    now = _now()
+    window = _digest_seconds() if digest else 0
+    if window:
+        emails = [
+            (subject, body, [recipient], from_email, f'{dedupe_key[0]}:{recipient}' if dedupe_key and dedupe_key[0] else None)
+            for subject, body, recipients, from_email, *dedupe_key in emails
+            for recipient in dict.fromkeys(r for r in recipients if r)
+        ]
+        # Recipients notified within the window get held copies
+        recent = set(collection.distinct('to', {
+            'digest': True,
+            'to': {'$in': list({email[2][0] for email in emails})},
+            'created_at': {'$gt': now - timedelta(seconds=window)},
+        })) if emails else set()
+
+    docs = []
+    for subject, body, recipients, from_email, *dedupe_key in emails:
+        recipients = [r for r in recipients if r]
+        if not recipients:
+            continue
+        held = bool(window) and recipients[0] in recent
+        docs.append(MongoOutboxEmail(
+            subject=subject,
+            body=body,
+            to=recipients,
+            from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+            dedupe_key=dedupe_key[0] if dedupe_key else None,
+            digest=bool(window),
+            status='DIGEST' if held else 'QUEUED',
+            created_at=now,
+            next_attempt_at=now,
+        ).to_mongo())
+        if window:
+            recent.add(recipients[0])
+    if not docs:
+        return 0
+    try:
+        queued = len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        queued = e.details['nInserted']
+    if queued and getattr(settings, 'EMAIL_OUTBOX_DRAIN_IN_PROCESS', True):
+        drain_later()
+        if any(doc['status'] == 'DIGEST' for doc in docs):
+            _roll_up_later(window)
+    return queued
+
+
+def enqueue_email(subject, body, recipients, from_email=None, dedupe_key=None, digest=False):
+    return enqueue_emails([(subject, body, recipients, from_email, dedupe_key)], digest=digest)
+
+
+def _digest_body(docs, window):
+    minutes = max(round(window / 60), 1)
+    parts = [f"You have {len(docs)} notifications from the Visitor Management System "
+             f"(collected over {minutes} minute{'s' if minutes != 1 else ''}):"]
+    for number, doc in enumerate(docs, start=1):
+        parts.append(f"{'-' * 40}\n{number}. {doc['subject']}\n\n{doc['body']}")
+    return '\n\n'.join(parts)
+
+
+def roll_up_digests(now=None):
+    """
+    Turn each recipient's held notifications into one queued summary once the
+    oldest has waited EMAIL_DIGEST_SECONDS. Returns the number of digests.
+    """
+    from visitorapi.mongo_models import MongoOutboxEmail
+
+    collection = MongoOutboxEmail._get_collection()
+    now = now or _now()
+    held = {'$or': [
+        {'status': 'DIGEST'},
+        # Left mid roll-up by a worker that died
+        {'status': 'ROLLING', 'locked_until': {'$lt': now}},
+    ]}
+    due = collection.aggregate([
+        {'$match': held},
+        {'$unwind': '$to'},
+        {'$group': {'_id': '$to', 'oldest': {'$min': '$created_at'}}},
+        {'$match': {'oldest': {'$lte': now - timedelta(seconds=_digest_seconds())}}},
+    ])
+    digests = 0
+    for group in due:
+        claim = uuid.uuid4().hex
+        collection.update_many({'$and': [{'to': group['_id']}, held]}, {'$set': {
+            'status': 'ROLLING',
+            'claim': claim,
+            'locked_until': now + timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LOCK_SECONDS', 300)),
+        }})
+        docs = list(collection.find({'claim': claim, 'status': 'ROLLING'}).sort('created_at', 1))
+        if not docs:
+            continue
+        if len(docs) == 1:
+            subject, body = docs[0]['subject'], docs[0]['body']
+        else:
+            subject = f"Visitor Management: {len(docs)} notifications"
+            body = _digest_body(docs, _digest_seconds())
+        try:
+            collection.insert_one(MongoOutboxEmail(
+                subject=subject,
+                body=body,
+                to=[group['_id']],
+                from_email=docs[0].get('from_email'),
+                dedupe_key=f'digest:{claim}',
+                digest=True,
+                created_at=now,
+                next_attempt_at=now,
+            ).to_mongo())
+        except DuplicateKeyError:
+            pass
+        collection.update_many({'claim': claim}, {'$set': {
+            'status': 'DIGESTED', 'sent_at': now, 'claim': None, 'locked_until': None,
+        }})
+        digests += 1
+    if digests:
+        logger.info(f"Email outbox: rolled held notifications into {digests} digests")
+    return digests
+
+
+def drain_later():
+    """Drain the outbox on the sender thread; queued drains are coalesced"""
+    if not _drain_pending.is_set():
+        _drain_pending.set()
+        _get_executor().submit(_drain_in_background)
+
+
+def _roll_up_later(window):
+    """Drain once the window of the notifications just held has passed"""
+    global _digest_timer
+    with _executor_lock:
+        if _digest_timer is None or not _digest_timer.is_alive():
+            _digest_timer = threading.Timer(window + 1, drain_later)
+            _digest_timer.daemon = True
+            _digest_timer.start()
+
+
+def _drain_in_background():
+    from visitorapi.mongo_models import MongoOutboxEmail
+
+    _drain_pending.clear()
+    try:
+        drain_outbox()
+        # Held notifications not yet due need another pass
+        if _digest_seconds() and MongoOutboxEmail.objects(status='DIGEST').only('id').first():
+            _roll_up_later(_digest_seconds())
+    except Exception:
+        logger.exception("Draining the email outbox failed")
+
+
+def _claim_batch(batch_size):
+    """
+    Claim up to batch_size due emails for this worker. Emails left SENDING by
+    a worker that died are claimable again once their lock expires.
+    """
+    from visitorapi.mongo_models import MongoOutboxEmail
+
+    collection = MongoOutboxEmail._get_collection()
+    now = _now()
+    due = {'$or': [
+        {'status': 'QUEUED', 'next_attempt_at': {'$lte': now}},
+        {'status': 'SENDING', 'locked_until': {'$lt': now}},
+    ]}
+    ids = [doc['_id'] for doc in collection.find(due, projection=['_id'], limit=batch_size).sort('next_attempt_at', 1)]
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    collection.update_many(
+        {'$and': [{'_id': {'$in': ids}}, due]},
+        {'$set': {
+            'status': 'SENDING',
+            'claim': claim,
+            'locked_until': now + timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LOCK_SECONDS', 300)),
+        }},
+    )
+    return list(collection.find({'claim': claim, 'status': 'SENDING'}))
+
+
+def _is_permanent(error):
+    """SMTP 5xx replies and refused recipients will not succeed on retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _failed(doc, error, now):
+    attempts = doc.get('attempts', 0) + 1
+    max_attempts = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+    if _is_permanent(error) or attempts >= max_attempts:
+        logger.error(f"Email {doc['_id']} to {', '.join(doc['to'])} dead-lettered after {attempts} attempts: {error}")
+        fields = {'status': 'DEAD'}
+    else:
+        # Exponential backoff: base, 2x base, 4x base, ...
+        delay = getattr(settings, 'EMAIL_OUTBOX_RETRY_SECONDS', 60) * 2 ** (attempts - 1)
+        fields = {'status': 'QUEUED', 'next_attempt_at': now + timedelta(seconds=delay)}
+    fields.update(attempts=attempts, last_error=str(error)[:500], claim=None, locked_until=None)
+    return UpdateOne({'_id': doc['_id'], 'claim': doc['claim']}, {'$set': fields})
+
+
+def send_batch(docs, connection=None):
+    """
+    Send claimed emails over one SMTP connection and record the outcome of
+    each. Returns (sent, failed).
+    """
+    from visitorapi.mongo_models import MongoOutboxEmail
+
+    connection = connection or get_connection(fail_silently=False)
+    sent_ids = []
+    ops = []
+    try:
+        connection.open()
+    except Exception as e:
+        # SMTP is unreachable: every email in the batch is retried later
+        logger.warning(f"Could not connect to the mail server: {e}")
+        now = _now()
+        ops = [_failed(doc, e, now) for doc in docs]
+    else:
+        try:
+            for doc in docs:
+                message = EmailMessage(doc['subject'], doc['body'], doc.get('from_email'), doc['to'], connection=connection)
+                try:
+                    connection.send_messages([message])
+                    sent_ids.append(doc['_id'])
+                except Exception as e:
+                    ops.append(_failed(doc, e, _now()))
+        finally:
+            connection.close()
+
+    collection = MongoOutboxEmail._get_collection()
+    if sent_ids:
+        now = _now()
+        ops.append(UpdateMany({'_id': {'$in': sent_ids}}, {'$set': {
+            'status': 'SENT', 'sent_at': now, 'claim': None, 'locked_until': None,
+        }, '$inc': {'attempts': 1}}))
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+    return len(sent_ids), len(docs) - len(sent_ids)
+
+
+def drain_outbox(batch_size=None):
+    """Send due emails batch by batch until none are left; returns (sent, failed)"""
+    batch_size = batch_size or getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 50)
+    total_sent = total_failed = 0
+    roll_up_digests()
+    while True:
+        docs = _claim_batch(batch_size)
+        if not docs:
+            break
+        sent, failed = send_batch(docs)
+        total_sent += sent
+        total_failed += failed
+        if sent == 0:
+            # Nothing got through (e.g. SMTP is down); leave the rest for the next run
+            break
+    if total_sent or total_failed:
+        logger.info(f"Email outbox: {total_sent} sent, {total_failed} failed")
+    return total_sent, total_failed
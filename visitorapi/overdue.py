@@ -0,0 +1,264 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from time import monotonic
+
+from django.conf import settings
+from django.utils import timezone
+
+from .exports import CURSOR_BATCH_SIZE, _chunks
+
+logger = logging.getLogger(__name__)
+
+MAX_VISIT_DAYS = 10  # day_1_* .. day_10_* slots on MongoVisitRequest
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _local(dt):
+    """pymongo returns naive UTC datetimes"""
+    if dt is not None and timezone.is_naive(dt):
+        dt = timezone.make_aware(dt, dt_timezone.utc)
+    return timezone.localtime(dt) if dt else None
+
+
+def open_sessions_query(today):
+    """
+    Visit requests checked in today and not yet checked out or notified.
+    Today's slot depends on the visit date, so there is one branch per slot,
+    each an equality on visit_date that the (overdue_notification_sent,
+    visit_date) index can serve.
+    """
+    from mongoengine.queryset.visitor import Q
+    from visitorapi.mongo_models import MongoVisitRequest
+
+    open_today = None
+    for day in range(1, MAX_VISIT_DAYS + 1):
+        branch = Q(visit_date=today - timedelta(days=day - 1)) & Q(**{
+            f'day_{day}_checkin__ne': None,
+            f'day_{day}_checkout': None,
+        })
+        open_today = branch if open_today is None else open_today | branch
+    return MongoVisitRequest.objects(open_today, overdue_notification_sent=False)
+
+
+def overdue_query(now):
+    """Open sessions of today whose end time has passed"""
+    # end_time is stored as 'HH:MM:SS', so string order is time order
+    return open_sessions_query(now.date()).filter(end_time__lte=now.strftime('%H:%M:%S'))
+
+
+def due_at(visit_request, today):
+    """When today's session of a visit becomes overdue, or None for an unparsable end_time"""
+    try:
+        end_time = time.fromisoformat(visit_request.end_time)
+    except (TypeError, ValueError):
+        return None
+    return timezone.make_aware(datetime.combine(today, end_time), timezone.get_current_timezone())
+
+
+def alert_key(visit_request):
+    """Outbox dedupe key: each visit's overdue alert is queued at most once"""
+    return f'overdue:{visit_request.id}'
+
+
+def _recipients(chunk):
+    """Host, creator and visitor email addresses for a chunk of visits, in two queries"""
+    from visitorapi.models import HRUser
+    from visitorapi.mongo_models import MongoVisitor
+
+    user_ids = {vr.host_id for vr in chunk} | {vr.created_by_id for vr in chunk if vr.created_by_id}
+    user_emails = dict(HRUser.objects.filter(id__in=[uid for uid in user_ids if uid.isdigit()]).values_list('id', 'email'))
+    visitors = {
+        str(v.id): v
+        for v in MongoVisitor.objects(id__in=list({vr.visitor_id for vr in chunk})).only(
+            'first_name', 'last_name', 'email', 'company',
+        )
+    }
+    return {str(uid): email for uid, email in user_emails.items() if email}, visitors
+
+
+def _message(vr, visitor, now):
+    day = (now.date() - vr.visit_date).days + 1
+    checkin_time = _local(getattr(vr, f'day_{day}_checkin'))
+    name = f"{visitor.first_name} {visitor.last_name}"
+    subject = f"Visitor Overdue Checkout Alert: {name}"
+    message = (
+        f"Visitor {name} (Company: {visitor.company})\n"
+        f"Visit Date: {vr.visit_date}\n"
+        f"Purpose: {vr.purpose}\n"
+        f"Expected End Time: {vr.end_time}\n"
+        f"Checked in at: {checkin_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"\nThis visitor has not checked out as of {now.strftime('%Y-%m-%d %H:%M:%S')} (IST).\n"
+        f"Please take necessary action."
+    )
+    return subject, message
+
+
+def notify_overdue(now=None, batch_size=CURSOR_BATCH_SIZE, visit_ids=None):
+    """
+    Queue one alert per overdue visit (optionally only among visit_ids) to its
+    host, creator and visitor, then flag the visits. Returns the number of
+    visits notified.
+    """
+    from visitorapi.mongo_models import MongoVisitRequest
+    from .outbox import enqueue_emails
+
+    now = now or timezone.localtime(timezone.now())
+    visits = overdue_query(now)
+    if visit_ids is not None:
+        visits = visits.filter(id__in=list(visit_ids))
+    visits = visits.only(
+        'visitor_id', 'host_id', 'created_by_id', 'visit_date', 'end_time', 'purpose',
+        *[f'day_{day}_checkin' for day in range(1, MAX_VISIT_DAYS + 1)],
+    ).no_cache().batch_size(batch_size)
+
+    notified = 0
+    for chunk in _chunks(visits, batch_size):
+        user_emails, visitors = _recipients(chunk)
+        emails = []
+        for vr in chunk:
+            visitor = visitors.get(vr.visitor_id)
+            if not visitor:
+                continue
+            recipients = {user_emails.get(vr.host_id), user_emails.get(vr.created_by_id), visitor.email} - {None, ''}
+            if recipients:
+                subject, message = _message(vr, visitor, now)
+                emails.append((subject, message, sorted(recipients), settings.DEFAULT_FROM_EMAIL, alert_key(vr)))
+        # Queued before flagging, and deduplicated, so a crash in between
+        # neither loses nor repeats an alert
+        enqueue_emails(emails, digest=True)
+        # Visits without anyone to notify are flagged too, so they are not rescanned.
+        # updated_at is bumped like every other write, for delta exports and watermarks
+        MongoVisitRequest._get_collection().update_many(
+            {'_id': {'$in': [vr.id for vr in chunk]}},
+            {'$set': {'overdue_notification_sent': True, 'updated_at': timezone.localtime(timezone.now())}},
+        )
+        notified += len(emails)
+    if notified:
+        logger.info(f"Queued overdue checkout alerts for {notified} visits")
+    return notified
+
+
+class OverdueScheduler:
+    """
+    Fires each overdue alert when it falls due instead of polling.
+
+    Today's open sessions are loaded once into a min-heap keyed on the time
+    they become overdue; check-ins in this process push entries and
+    check-outs cancel them. Nothing is kept outside MongoDB: the open
+    sessions and overdue_notification_sent flags are the persisted state, so
+    a restart reloads the heap and fires anything that fell due meanwhile.
+    Sessions checked in by other processes are picked up by a periodic
+    reload of today's open sessions (OVERDUE_SCHEDULER_RESYNC_SECONDS).
+    """
+
+    def __init__(self):
+        self._heap = []  # (due_at, visit_id)
+        self._due = {}  # visit_id -> due_at of its live heap entry
+        self._cond = threading.Condition()
+        self._loaded_on = None
+        self._next_load = 0
+
+    def load(self, now):
+        """Replace the heap with today's open sessions, in one indexed query"""
+        today = now.date()
+        loaded = {}
+        for vr in open_sessions_query(today).only('end_time'):
+            when = due_at(vr, today)
+            if when:
+                loaded[str(vr.id)] = when
+        with self._cond:
+            # Keep today's entries scheduled while the query ran; firing re-checks them anyway
+            due = {visit_id: when for visit_id, when in self._due.items() if when.date() == today}
+            due.update(loaded)
+            self._due = due
+            self._heap = [(when, visit_id) for visit_id, when in due.items()]
+            heapq.heapify(self._heap)
+            self._loaded_on = today
+            self._cond.notify()
+        self._next_load = monotonic() + getattr(settings, 'OVERDUE_SCHEDULER_RESYNC_SECONDS', 900)
+        logger.info(f"Overdue scheduler: {len(due)} open sessions for {today}")
+
+    def schedule(self, visit_id, when):
+        with self._cond:
+            self._due[visit_id] = when
+            heapq.heappush(self._heap, (when, visit_id))
+            self._cond.notify()
+
+    def cancel(self, visit_id):
+        with self._cond:
+            # The heap entry is skipped when it is popped
+            self._due.pop(visit_id, None)
+
+    def _pop_due(self, now):
+        visit_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            when, visit_id = heapq.heappop(self._heap)
+            if self._due.get(visit_id) == when:
+                del self._due[visit_id]
+                visit_ids.append(visit_id)
+        return visit_ids
+
+    def _wait_seconds(self, now):
+        midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), time.min))
+        deadlines = [(midnight - now).total_seconds(), self._next_load - monotonic()]
+        if self._heap:
+            deadlines.append((self._heap[0][0] - now).total_seconds())
+        return max(min(deadlines), 0.05)
+
+    def run_once(self):
+        """Reload if due, then fire the alerts that are due; returns seconds until the next deadline"""
+        now = timezone.localtime(timezone.now())
+        if self._loaded_on != now.date() or monotonic() >= self._next_load:
+            self.load(now)
+        with self._cond:
+            visit_ids = self._pop_due(now)
+        if visit_ids:
+            # Re-checked against the database, so sessions closed elsewhere are skipped
+            notify_overdue(now, visit_ids=visit_ids)
+        return self._wait_seconds(timezone.localtime(timezone.now()))
+
+    def run(self):
+        while True:
+            try:
+                timeout = self.run_once()
+            except Exception:
+                logger.exception("Overdue scheduler pass failed; reloading shortly")
+                self._next_load = 0
+                timeout = 30
+            with self._cond:
+                self._cond.wait(timeout)
+
+
+def start_overdue_scheduler(force=False):
+    """
+    Run this process's overdue scheduler on a daemon thread when
+    OVERDUE_SCHEDULER is enabled. Called from the web entry points and by
+    overdue_checkout_notify --scheduler, not on every Django setup, so
+    management commands and export workers do not start one.
+    """
+    global _scheduler
+    if not (force or getattr(settings, 'OVERDUE_SCHEDULER', False)):
+        return None
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = OverdueScheduler()
+            threading.Thread(target=_scheduler.run, name='overdue-scheduler', daemon=True).start()
+    return _scheduler
+
+
+def visit_checked_in(visit_request):
+    """Schedule the overdue alert for a check-in made in this process"""
+    if _scheduler is not None and not visit_request.overdue_notification_sent:
+        today = timezone.localtime(timezone.now()).date()
+        when = due_at(visit_request, today)
+        if when:
+            _scheduler.schedule(str(visit_request.id), when)
+
+
+def visit_checked_out(visit_request):
+    if _scheduler is not None:
+        _scheduler.cancel(str(visit_request.id))
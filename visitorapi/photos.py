@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+PHOTO_DIR = 'visitor_photos'
+# Uploads are kept here, under their content hash, until they are processed
+STAGING_DIR = f'{PHOTO_DIR}/originals'
+
+# format -> (file extension, Pillow save options)
+PHOTO_FORMATS = {
+    'JPEG': ('.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'WEBP': ('.webp', {'quality': 80, 'method': 4}),
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Per-process worker pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'PHOTO_WORKERS', 2),
+                thread_name_prefix='photo',
+            )
+    return _executor
+
+
+def _photo_format():
+    photo_format = getattr(settings, 'PHOTO_FORMAT', 'JPEG').upper()
+    return photo_format, *PHOTO_FORMATS[photo_format]
+
+
+def processed_paths(content_hash):
+    """Storage paths of the badge photo and thumbnail for an upload's content hash"""
+    _, extension, _ = _photo_format()
+    base = f'{PHOTO_DIR}/{content_hash[:2]}/{content_hash}'
+    return f'{base}{extension}', f'{base}_thumb{extension}'
+
+
+def store_photo(uploaded):
+    """
+    Store an uploaded photo and return (photo path, thumbnail path or None).
+
+    Uploads are addressed by a hash of their bytes: a re-upload of a photo
+    that was already processed reuses the stored files without decoding. New
+    photos are staged as uploaded and shrunk later by process_photo_later.
+    """
+    data = uploaded.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    photo_path, thumbnail_path = processed_paths(content_hash)
+    if default_storage.exists(photo_path):
+        return photo_path, thumbnail_path
+
+    extension = os.path.splitext(uploaded.name or '')[1].lower()[:5]
+    staged_path = f'{STAGING_DIR}/{content_hash}{extension}'
+    if not default_storage.exists(staged_path):
+        staged_path = default_storage.save(staged_path, ContentFile(data))
+    return staged_path, None
+
+
+def _save(path, image, photo_format, options):
+    if default_storage.exists(path):
+        return
+    buffer = BytesIO()
+    # No exif/icc arguments: metadata (including GPS) is dropped
+    image.save(buffer, photo_format, **options)
+    default_storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def process_photo(visitor_id, staged_path):
+    """
+    Decode a staged upload once, downsize it to the badge resolution, re-encode
+    it without metadata, write a thumbnail, and point the visitor at them.
+    """
+    from visitorapi.mongo_models import MongoVisitor
+
+    try:
+        content_hash = os.path.splitext(os.path.basename(staged_path))[0]
+        photo_path, thumbnail_path = processed_paths(content_hash)
+        photo_format, _, options = _photo_format()
+        max_size = getattr(settings, 'PHOTO_MAX_SIZE', (480, 600))
+
+        if not default_storage.exists(photo_path):
+            with default_storage.open(staged_path, 'rb') as f:
+                image = Image.open(f)
+                # JPEG sources can be decoded straight at a reduced scale
+                image.draft('RGB', (max_size[0] * 2, max_size[1] * 2))
+                image = ImageOps.exif_transpose(image).convert('RGB')
+            image.thumbnail(max_size, Image.LANCZOS)
+            _save(photo_path, image, photo_format, options)
+            image.thumbnail(getattr(settings, 'PHOTO_THUMBNAIL_SIZE', (96, 96)), Image.LANCZOS)
+            _save(thumbnail_path, image, photo_format, options)
+
+        # Only swap if the visitor still uses this upload
+        MongoVisitor.objects(id=visitor_id, photo=staged_path).update_one(
+            set__photo=photo_path,
+            set__photo_thumbnail=thumbnail_path,
+            set__updated_at=timezone.localtime(timezone.now()),
+        )
+        if not MongoVisitor.objects(photo=staged_path).only('id').first():
+            default_storage.delete(staged_path)
+    except Exception:
+        # The visitor keeps the original upload
+        logger.exception(f"Processing photo {staged_path} for visitor {visitor_id} failed")
+
+
+def process_photo_later(visitor_id, photo_path):
+    """Queue processing of a staged upload on the photo worker pool"""
+    if photo_path and photo_path.startswith(f'{STAGING_DIR}/'):
+        _get_executor().submit(process_photo, str(visitor_id), photo_path)
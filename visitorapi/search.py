@@ -0,0 +1,226 @@
+import logging
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Shortest and longest prefix stored as a search key
+MIN_PREFIX = 2
+MAX_PREFIX = 20
+
+# Maximum number of visitors returned to the registration autocomplete
+SEARCH_LIMIT = 10
+
+# Candidates fetched per cache miss; a result set smaller than this is complete
+# and can answer longer queries without going back to MongoDB
+CACHE_CANDIDATES = 100
+CACHE_PREFIX = 'visitor_search'
+
+# Fields returned by find_visitors
+RESULT_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'company', 'id_proof_type', 'id_proof_number')
+
+_non_alnum = re.compile(r'[^0-9a-z]+')
+_letters = re.compile(r'[a-z]')
+
+
+def fold(value):
+    """Case-folded, accent-stripped form of a string"""
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in value if not unicodedata.combining(c)).casefold()
+
+
+def digits_only(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def _tokens(value):
+    return [token for token in _non_alnum.split(fold(value)) if token]
+
+
+def _prefixes(token):
+    return {token[:n] for n in range(MIN_PREFIX, min(len(token), MAX_PREFIX) + 1)}
+
+
+def visitor_tokens(first_name, last_name, email, phone, id_proof_number):
+    """
+    Normalized tokens a visitor can be found by: case-folded name and email
+    tokens, the digits-only phone (with and without country code) and the
+    alphanumeric-only ID proof number.
+    """
+    tokens = set(_tokens(f'{first_name or ""} {last_name or ""}') + _tokens(email))
+    phone_digits = digits_only(phone)
+    tokens.add(phone_digits)
+    if len(phone_digits) > 10:
+        tokens.add(phone_digits[-10:])
+    tokens.add(''.join(_tokens(id_proof_number)))
+    return sorted(token for token in tokens if len(token) >= MIN_PREFIX)
+
+
+def visitor_search_keys(first_name, last_name, email, phone, id_proof_number):
+    """Index keys for a visitor: every prefix of each of its tokens"""
+    keys = set()
+    for token in visitor_tokens(first_name, last_name, email, phone, id_proof_number):
+        keys |= _prefixes(token)
+    return sorted(keys)
+
+
+def parse_query(query):
+    """
+    Split a search query into (tokens, compact), or None if it has nothing
+    searchable. A visitor matches when every token is a prefix of one of its
+    tokens, or when compact is; compact is the query with separators removed,
+    so phone numbers and ID numbers typed with spaces or dashes still match.
+    """
+    folded = fold(query)
+    if not _letters.search(folded):
+        # Phone-like: "+91 98765-4" -> "91987654"
+        compact = digits_only(folded)[:MAX_PREFIX]
+        return ([compact], compact) if len(compact) >= MIN_PREFIX else None
+    tokens = sorted({token[:MAX_PREFIX] for token in _tokens(folded) if len(token) >= MIN_PREFIX})
+    if not tokens:
+        return None
+    return tokens, ''.join(_tokens(folded))[:MAX_PREFIX]
+
+
+def query_filter(query):
+    """Mongo filter on the search_keys index for a search query, or None"""
+    parsed = parse_query(query)
+    if parsed is None:
+        return None
+    tokens, compact = parsed
+    if tokens == [compact]:
+        return {'search_keys': compact}
+    return {'$or': [{'search_keys': {'$all': tokens}}, {'search_keys': compact}]}
+
+
+def result_from_document(doc):
+    """Autocomplete result for a raw visitor document"""
+    return dict({'id': str(doc['_id'])}, **{f: doc.get(f) for f in RESULT_FIELDS})
+
+
+def _matches(result, tokens, compact):
+    """Python equivalent of query_filter for one autocomplete result"""
+    visitor = visitor_tokens(*(result.get(f) for f in ('first_name', 'last_name', 'email', 'phone', 'id_proof_number')))
+    if any(t.startswith(compact) for t in visitor):
+        return True
+    return all(any(t.startswith(token) for t in visitor) for token in tokens)
+
+
+def _narrows(parent, child):
+    """True if every visitor matching the child query also matches the parent query"""
+    parent_tokens, parent_compact = parent
+    child_tokens, child_compact = child
+    return child_compact.startswith(parent_compact) and all(
+        any(token.startswith(p) for token in child_tokens) for p in parent_tokens
+    )
+
+
+_cache_stats = Counter()
+_cache_stats_lock = threading.Lock()
+
+
+def _record(outcome):
+    with _cache_stats_lock:
+        _cache_stats[outcome] += 1
+        total = sum(_cache_stats.values())
+        if total % 1000 == 0:
+            logger.info(f"Visitor search cache: {search_cache_stats()}")
+
+
+def search_cache_stats():
+    """Lookups in this process by outcome (hit, narrowed, miss) and the hit rate"""
+    stats = dict(_cache_stats)
+    total = sum(stats.values())
+    stats['hit_rate'] = (stats.get('hit', 0) + stats.get('narrowed', 0)) / total if total else 0.0
+    return stats
+
+
+def _generation():
+    return cache.get_or_set(f'{CACHE_PREFIX}:generation', 0, None)
+
+
+def invalidate_search_cache():
+    """Drop cached search results; called on every visitor write"""
+    try:
+        cache.incr(f'{CACHE_PREFIX}:generation')
+    except ValueError:
+        cache.set(f'{CACHE_PREFIX}:generation', 1, None)
+
+
+def _cached_search(query, limit, ttl):
+    """
+    find_visitors through a short-TTL cache keyed by the normalized query.
+
+    Each miss fetches up to CACHE_CANDIDATES visitors. While a desk user keeps
+    typing ("raj" -> "rajv" -> "rajve"), a query that narrows a cached query
+    whose candidate set was complete is answered by filtering those candidates.
+    """
+    from visitorapi.mongo_models import MongoVisitor
+
+    parsed = parse_query(query)
+    if parsed is None:
+        return []
+    normalized = ' '.join(_tokens(query))
+    generation = _generation()
+    keys = {
+        normalized[:n].rstrip(): f"{CACHE_PREFIX}:{generation}:{normalized[:n].rstrip().replace(' ', '+')}"
+        for n in range(len(normalized), MIN_PREFIX - 1, -1)
+    }
+    cached = cache.get_many(list(keys.values()))
+
+    entry = cached.get(keys[normalized])
+    if entry is not None:
+        _record('hit')
+        return entry['results'][:limit]
+    for prefix in sorted(keys, key=len, reverse=True):
+        parent = cached.get(keys[prefix])
+        if parent is not None and parent['complete'] and _narrows(parent['parsed'], parsed):
+            results = [r for r in parent['results'] if _matches(r, *parsed)]
+            cache.set(keys[normalized], {'parsed': parsed, 'results': results, 'complete': True}, ttl)
+            _record('narrowed')
+            return results[:limit]
+
+    _record('miss')
+    cursor = MongoVisitor._get_collection().find(
+        query_filter(query),
+        projection=list(RESULT_FIELDS),
+        limit=CACHE_CANDIDATES,
+    )
+    results = [result_from_document(doc) for doc in cursor]
+    complete = len(results) < CACHE_CANDIDATES
+    cache.set(keys[normalized], {'parsed': parsed, 'results': results, 'complete': complete}, ttl)
+    return results[:limit]
+
+
+def find_visitors(query, limit=SEARCH_LIMIT):
+    """
+    Visitors for the registration autocomplete: answered from this worker's
+    in-memory index when it is enabled and built, otherwise by a bounded
+    lookup on the search_keys index, through the result cache when
+    VISITOR_SEARCH_CACHE_TTL is set.
+    """
+    from visitorapi.mongo_models import MongoVisitor
+    from visitorapi.visitor_index import get_visitor_index
+
+    index = get_visitor_index()
+    if index is not None:
+        return index.search(query, limit)
+
+    ttl = getattr(settings, 'VISITOR_SEARCH_CACHE_TTL', 0)
+    if ttl:
+        return _cached_search(query, limit, ttl)
+
+    mongo_filter = query_filter(query)
+    if mongo_filter is None:
+        return []
+    cursor = MongoVisitor._get_collection().find(
+        mongo_filter,
+        projection=list(RESULT_FIELDS),
+        limit=limit,
+    )
+    return [result_from_document(doc) for doc in cursor]
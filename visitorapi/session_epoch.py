@@ -0,0 +1,121 @@
+"""
+Logging everyone out in O(1). Sessions are stamped with the epoch current
+when they were created; bumping the stored epoch makes every older session
+invalid, and SessionInvalidationMiddleware rejects them on their next
+request. The rows left behind are deleted later, off the request path.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone as dt_timezone
+from time import monotonic
+
+from django.conf import settings
+from django.utils import timezone
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+EPOCH_KEY = '_epoch'  # Session key: epoch the session was created under
+EPOCH_NAME = 'sessions'
+PRUNE_BATCH_SIZE = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+_cached = None  # (epoch, bumped_at, monotonic time read)
+
+
+def _get_executor():
+    """Per-process single cleanup thread, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session-prune')
+    return _executor
+
+
+def _read():
+    from visitorapi.mongo_models import MongoSessionEpoch
+
+    doc = MongoSessionEpoch._get_collection().find_one({'_id': EPOCH_NAME}) or {}
+    return doc.get('epoch', 0), doc.get('bumped_at')
+
+
+def current_epoch():
+    """The stored epoch, re-read at most every SESSION_EPOCH_CHECK_SECONDS per process"""
+    global _cached
+    cached = _cached
+    if cached is None or monotonic() - cached[2] >= getattr(settings, 'SESSION_EPOCH_CHECK_SECONDS', 5):
+        epoch, bumped_at = _read()
+        _cached = cached = (epoch, bumped_at, monotonic())
+    return cached[0]
+
+
+def bump_session_epoch(coalesce_seconds=0):
+    """
+    Invalidate every existing session and return the new epoch. With
+    coalesce_seconds, a bump made that recently by another process counts
+    instead, so workers starting together log users out only once.
+    """
+    from visitorapi.mongo_models import MongoSessionEpoch
+
+    global _cached
+    collection = MongoSessionEpoch._get_collection()
+    now = timezone.now()
+    query = {'_id': EPOCH_NAME}
+    if coalesce_seconds:
+        query['bumped_at'] = {'$lt': now - timedelta(seconds=coalesce_seconds)}
+    try:
+        doc = collection.find_one_and_update(
+            query,
+            {'$inc': {'epoch': 1}, '$set': {'bumped_at': now}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        epoch, bumped_at = doc['epoch'], doc['bumped_at']
+        logger.info(f"Session epoch bumped to {epoch}; existing sessions are invalid")
+    except DuplicateKeyError:
+        # Bumped within coalesce_seconds
+        epoch, bumped_at = _read()
+    _cached = (epoch, bumped_at, monotonic())
+    return epoch
+
+
+def prune_stale_sessions(batch_size=PRUNE_BATCH_SIZE):
+    """
+    Delete expired session rows and rows last saved before the latest epoch
+    bump, a batch at a time. Such a row expires no later than bumped_at +
+    SESSION_COOKIE_AGE, while any row saved since expires after it. Returns
+    the number of rows deleted.
+    """
+    from django.contrib.sessions.models import Session
+    from django.db.models import Q
+
+    _, bumped_at = _read()
+    stale = Q(expire_date__lt=timezone.now())
+    if bumped_at is not None:
+        if timezone.is_naive(bumped_at):
+            # pymongo returns naive UTC datetimes
+            bumped_at = timezone.make_aware(bumped_at, dt_timezone.utc)
+        stale |= Q(expire_date__lte=bumped_at + timedelta(seconds=settings.SESSION_COOKIE_AGE))
+    deleted = 0
+    while True:
+        keys = list(Session.objects.filter(stale).values_list('pk', flat=True)[:batch_size])
+        if not keys:
+            break
+        deleted += Session.objects.filter(pk__in=keys).delete()[0]
+    if deleted:
+        logger.info(f"Pruned {deleted} stale sessions")
+    return deleted
+
+
+def prune_later():
+    _get_executor().submit(_prune_in_background)
+
+
+def _prune_in_background():
+    try:
+        prune_stale_sessions()
+    except Exception:
+        logger.exception("Pruning stale sessions failed")
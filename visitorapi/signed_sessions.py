@@ -0,0 +1,60 @@
+"""
+Session engine that keeps session data in a signed cookie instead of the
+django_session table, so no request writes to the database. Enable with
+SESSION_ENGINE = 'visitorapi.signed_sessions'.
+
+Each session carries a random id; logging out records it in a revocation
+list in MongoDB, so a copy of the old cookie is refused until it would have
+expired anyway. The cookie is signed, not encrypted: the user id and other
+session data are readable by the browser.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.backends import signed_cookies
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+SID_KEY = '_sid'
+
+
+def is_revoked(sid):
+    from visitorapi.mongo_models import MongoRevokedSession
+
+    return MongoRevokedSession._get_collection().find_one({'_id': sid}, projection=['_id']) is not None
+
+
+def revoke(sid):
+    from visitorapi.mongo_models import MongoRevokedSession
+
+    now = timezone.now()
+    MongoRevokedSession._get_collection().update_one(
+        {'_id': sid},
+        {'$set': {'revoked_at': now, 'expires_at': now + timedelta(seconds=settings.SESSION_COOKIE_AGE)}},
+        upsert=True,
+    )
+
+
+class SessionStore(signed_cookies.SessionStore):
+    def load(self):
+        session = super().load()
+        sid = session.get(SID_KEY)
+        if sid and is_revoked(sid):
+            self.create()
+            return {}
+        return session
+
+    def save(self, must_create=False):
+        self._session.setdefault(SID_KEY, get_random_string(32))
+        super().save(must_create)
+
+    def cycle_key(self):
+        # A new id on login, so logging out does not depend on the pre-login cookie
+        self._session[SID_KEY] = get_random_string(32)
+        super().cycle_key()
+
+    def flush(self):
+        sid = self._session.get(SID_KEY)
+        super().flush()
+        if sid:
+            revoke(sid)
@@ -0,0 +1,818 @@
+import socket
+import socketserver
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import mongoengine
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import mongo_models
+from .mongo_models import MongoOutboxEmail
+from .outbox import drain_outbox, enqueue_email
+
+REJECTED = 'rejected@example.com'
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for Django's backend; refuses RCPT TO the REJECTED address with a 550"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        recipients = []
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                return
+            command = line.split(' ', 1)[0].upper()
+            if command == 'EHLO':
+                self.reply('250 localhost')
+            elif command in ('HELO', 'NOOP', 'RSET', 'MAIL'):
+                recipients = [] if command in ('RSET', 'MAIL') else recipients
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                address = line.split(':', 1)[1].strip().strip('<>')
+                if address == REJECTED:
+                    self.reply('550 No such user')
+                else:
+                    recipients.append(address)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.messages.append(recipients)
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+
+
+def _closed_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _smtp_settings(port):
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=port,
+        EMAIL_USE_TLS=False,
+        EMAIL_USE_SSL=False,
+        EMAIL_HOST_USER='',
+        EMAIL_HOST_PASSWORD='',
+        EMAIL_TIMEOUT=5,
+    )
+
+
+def _reset_collections():
+    """Documents cache their collection; drop the cache so the current connection is used"""
+    for model in vars(mongo_models).values():
+        if isinstance(model, type) and issubclass(model, mongoengine.Document) and model is not mongoengine.Document:
+            model._collection = None
+
+
+class MongoTestCase(TestCase):
+    """Runs against a separate test_<db> Mongo database, dropped afterwards"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.mongo_db = f"test_{settings.MONGODB_SETTINGS['db']}"
+        mongoengine.disconnect()
+        mongoengine.connect(**dict(settings.MONGODB_SETTINGS, db=cls.mongo_db))
+        _reset_collections()
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.get_connection().drop_database(cls.mongo_db)
+        mongoengine.disconnect()
+        mongoengine.connect(**settings.MONGODB_SETTINGS)
+        _reset_collections()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        db = mongoengine.get_db()
+        for name in db.list_collection_names():
+            db[name].delete_many({})
+
+
+@override_settings(
+    EMAIL_OUTBOX_DRAIN_IN_PROCESS=False,
+    EMAIL_DIGEST_SECONDS=0,
+    EMAIL_OUTBOX_RETRY_SECONDS=60,
+    EMAIL_OUTBOX_MAX_ATTEMPTS=6,
+    DEFAULT_FROM_EMAIL='vms@example.com',
+)
+class EmailOutboxTests(MongoTestCase):
+    """The outbox against a local SMTP stand-in"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.smtp = SMTPStandIn()
+        threading.Thread(target=cls.smtp.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.smtp.shutdown()
+        cls.smtp.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.smtp.connections = 0
+        self.smtp.messages = []
+
+    def _utc_now(self):
+        # pymongo returns naive UTC datetimes
+        return timezone.now().replace(tzinfo=None)
+
+    def test_batch_is_sent_over_one_connection(self):
+        for number in range(3):
+            enqueue_email(f'Subject {number}', 'Body', [f'host{number}@example.com'])
+
+        with _smtp_settings(self.smtp.server_address[1]):
+            self.assertEqual(drain_outbox(batch_size=10), (3, 0))
+
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(MongoOutboxEmail.objects(status='SENT').count(), 3)
+
+    def test_emails_without_dedupe_key_are_all_queued(self):
+        self.assertEqual(enqueue_email('Approved', 'Body', ['host@example.com']), 1)
+        self.assertEqual(enqueue_email('Rejected', 'Body', ['host@example.com']), 1)
+
+        docs = list(MongoOutboxEmail._get_collection().find())
+        self.assertEqual(len(docs), 2)
+        # The unique sparse index only skips documents without the field
+        self.assertTrue(all('dedupe_key' not in doc for doc in docs))
+
+    def test_dedupe_key_queues_once(self):
+        self.assertEqual(enqueue_email('Overdue', 'Body', ['host@example.com'], dedupe_key='overdue:1'), 1)
+        self.assertEqual(enqueue_email('Overdue', 'Body', ['host@example.com'], dedupe_key='overdue:1'), 0)
+        self.assertEqual(MongoOutboxEmail.objects.count(), 1)
+
+    def test_550_reply_dead_letters_the_email(self):
+        enqueue_email('Refused', 'Body', [REJECTED])
+        enqueue_email('Accepted', 'Body', ['host@example.com'])
+
+        with _smtp_settings(self.smtp.server_address[1]):
+            self.assertEqual(drain_outbox(batch_size=10), (1, 1))
+
+        refused = MongoOutboxEmail.objects.get(subject='Refused')
+        self.assertEqual(refused.status, 'DEAD')
+        self.assertEqual(refused.attempts, 1)
+        self.assertEqual(MongoOutboxEmail.objects.get(subject='Accepted').status, 'SENT')
+
+    def test_unreachable_server_requeues_with_exponential_backoff(self):
+        enqueue_email('Retry me', 'Body', ['host@example.com'])
+        collection = MongoOutboxEmail._get_collection()
+
+        with _smtp_settings(_closed_port()):
+            for attempt, delay in ((1, 60), (2, 120), (3, 240)):
+                before = self._utc_now()
+                self.assertEqual(drain_outbox(), (0, 1))
+                doc = collection.find_one({'subject': 'Retry me'})
+                self.assertEqual(doc['status'], 'QUEUED')
+                self.assertEqual(doc['attempts'], attempt)
+                wait = (doc['next_attempt_at'] - before).total_seconds()
+                self.assertAlmostEqual(wait, delay, delta=5)
+                # Not due yet: a drain now leaves it alone
+                self.assertEqual(drain_outbox(), (0, 0))
+                collection.update_one({'_id': doc['_id']}, {'$set': {'next_attempt_at': before}})
+
+    def test_expired_sending_claim_is_reclaimed(self):
+        now = self._utc_now()
+        for subject, locked_until in (('Expired', now - timedelta(minutes=1)), ('Locked', now + timedelta(minutes=5))):
+            MongoOutboxEmail(
+                subject=subject,
+                body='Body',
+                to=['host@example.com'],
+                from_email='vms@example.com',
+                status='SENDING',
+                claim='worker-that-died',
+                locked_until=locked_until,
+            ).save()
+
+        with _smtp_settings(self.smtp.server_address[1]):
+            self.assertEqual(drain_outbox(), (1, 0))
+
+        self.assertEqual(MongoOutboxEmail.objects.get(subject='Expired').status, 'SENT')
+        locked = MongoOutboxEmail.objects.get(subject='Locked')
+        self.assertEqual(locked.status, 'SENDING')
+        self.assertEqual(locked.claim, 'worker-that-died')
+
+
+class ExportWatermarkTests(MongoTestCase):
+    def test_host_name_change_invalidates_artifacts(self):
+        from .export_jobs import data_watermark
+        from .models import HRUser
+
+        user = HRUser.objects.create_user(username='approver', employee_id='E1', first_name='Asha')
+        before = data_watermark()
+        self.assertEqual(data_watermark(), before)
+        user.first_name = 'Asha R'
+        user.save()
+        self.assertNotEqual(data_watermark(), before)
+
+
+class IdempotencyTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from django.contrib.auth.models import AnonymousUser
+        from django.test import RequestFactory
+
+        self.factory = RequestFactory()
+        self.anonymous = AnonymousUser()
+        self.calls = 0
+
+    def _post(self, view, data, key='key-1', **headers):
+        request = self.factory.post('/register/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY=key, **headers)
+        request.user = self.anonymous
+        return view(request)
+
+    def _counting_view(self):
+        from django.http import JsonResponse
+        from .idempotency import idempotent
+
+        @idempotent
+        def view(request):
+            self.calls += 1
+            return JsonResponse({'call': self.calls}, status=201)
+        return view
+
+    def test_repeat_replays_stored_response(self):
+        view = self._counting_view()
+        first = self._post(view, {'name': 'Asha'})
+        repeat = self._post(view, {'name': 'Asha'})
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(repeat.status_code, 201)
+        self.assertEqual(repeat.content, first.content)
+        self.assertEqual(repeat['Idempotent-Replayed'], 'true')
+
+    def test_same_key_with_different_payload_is_refused(self):
+        view = self._counting_view()
+        self._post(view, {'name': 'Asha'})
+        response = self._post(view, {'name': 'Ravi'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_repeat_while_first_is_running_gets_409(self):
+        from django.http import JsonResponse
+        from .idempotency import idempotent
+
+        nested = []
+
+        @idempotent
+        def view(request):
+            self.calls += 1
+            if self.calls == 1:
+                # The client retries before this request has finished
+                nested.append(self._post(view, {'name': 'Asha'}))
+            return JsonResponse({}, status=201)
+
+        self.assertEqual(self._post(view, {'name': 'Asha'}).status_code, 201)
+        self.assertEqual(nested[0].status_code, 409)
+        self.assertEqual(nested[0]['Retry-After'], '1')
+        self.assertEqual(self.calls, 1)
+
+    def test_keys_are_scoped_per_api_token(self):
+        view = self._counting_view()
+        self._post(view, {'name': 'Asha'}, HTTP_AUTHORIZATION='Token desk-1')
+        self._post(view, {'name': 'Asha'}, HTTP_AUTHORIZATION='Token desk-2')
+        self.assertEqual(self.calls, 2)
+
+        replay = self._post(view, {'name': 'Asha'}, HTTP_AUTHORIZATION='Token desk-1')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.calls, 2)
+
+
+class BulkImportTests(MongoTestCase):
+    ROW = {
+        'first_name': 'Asha', 'last_name': 'Rao', 'phone': '9876543210', 'company': 'Acme',
+        'id_proof_type': 'Aadhaar', 'id_proof_number': '1234', 'purpose': 'Meeting',
+    }
+
+    def setUp(self):
+        super().setUp()
+        from .models import HRUser
+
+        HRUser.objects.create_user(username='host', employee_id='H1', user_type='HR')
+
+    def test_validate_row_cleans_values(self):
+        from .bulk_import import validate_row
+
+        row, errors = validate_row(dict(self.ROW, phone=9876543210.0, end_time='18:15', allow_mobile='Yes'))
+        self.assertEqual(errors, [])
+        self.assertEqual(row['phone'], '9876543210')
+        self.assertEqual(row['end_time'], '18:15:00')
+        self.assertTrue(row['allow_mobile'])
+        self.assertFalse(row['allow_laptop'])
+
+    def test_validate_row_reports_bad_values(self):
+        from .bulk_import import validate_row
+
+        _, errors = validate_row(dict(self.ROW, first_name='', email='not-an-email', end_time='late', valid_upto='31/12/2026'))
+        self.assertEqual(errors, [
+            'first_name is required', 'email is invalid', 'end_time must be HH:MM', 'valid_upto must be YYYY-MM-DD',
+        ])
+
+    def test_validate_row_applies_document_field_limits(self):
+        from .bulk_import import validate_row
+
+        _, errors = validate_row(dict(self.ROW, first_name='A' * 101))
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('first_name:'))
+
+    def test_failed_upsert_is_reported_on_its_row_only(self):
+        from .bulk_import import import_visitors
+        from .mongo_models import MongoVisitor
+
+        # Holds the email under another identity, so upserting its row hits the unique email index
+        MongoVisitor._get_collection().insert_one(dict(self.ROW, email='taken@example.com', identity_key='contact:other'))
+        report = import_visitors(
+            [dict(self.ROW, first_name='Ravi', email='taken@example.com'), dict(self.ROW, email='asha@example.com')],
+            default_host_type='HR',
+        )
+
+        self.assertEqual([entry['status'] for entry in report], ['error', 'created'])
+        self.assertTrue(report[0]['errors'][0].startswith('Visitor could not be saved'))
+        self.assertEqual(report[1]['visitor'], 'new')
+
+
+class ExportFilterTests(SimpleTestCase):
+    def test_filters_are_normalized(self):
+        from datetime import date
+        from .exports import filters_to_params, parse_export_filters
+
+        filters = parse_export_filters({
+            'date_from': '2026-01-01', 'date_to': ' 2026-01-31 ', 'host': '7', 'host_type': 'hos',
+            'status': 'approved, pending,APPROVED', 'checked_in': 'true', 'group': '',
+        })
+        self.assertEqual(filters, {
+            'date_from': date(2026, 1, 1), 'date_to': date(2026, 1, 31), 'host': '7', 'host_type': 'HOS',
+            'status': ['APPROVED', 'PENDING'], 'checked_in': True,
+        })
+        self.assertEqual(parse_export_filters(filters_to_params(filters)), filters)
+
+    def test_no_parameters_means_no_filters(self):
+        from .exports import parse_export_filters
+
+        self.assertEqual(parse_export_filters({}), {})
+
+    def test_invalid_dates_are_rejected(self):
+        from .exports import parse_export_filters
+
+        for params, message in (
+            ({'date_from': '01/02/2026'}, 'Invalid date_from: expected YYYY-MM-DD.'),
+            ({'date_to': '2026-02-30'}, 'Invalid date_to: expected YYYY-MM-DD.'),
+            ({'date_from': '2026-02-01', 'date_to': '2026-01-01'}, 'date_from must not be after date_to.'),
+        ):
+            with self.subTest(params=params):
+                with self.assertRaisesMessage(ValueError, message):
+                    parse_export_filters(params)
+
+    def test_invalid_status_and_host_type_are_rejected(self):
+        from .exports import parse_export_filters
+
+        with self.assertRaisesMessage(ValueError, 'Invalid status: ARCHIVED, LOST.'):
+            parse_export_filters({'status': 'approved,lost,archived'})
+        with self.assertRaisesMessage(ValueError, 'Invalid host_type: expected HR or HOS.'):
+            parse_export_filters({'host_type': 'guest'})
+
+
+class ExportFormatTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from datetime import date
+        from .models import HRUser
+        from .mongo_models import MongoVisitor, MongoVisitorCard, MongoVisitRequest
+
+        host = HRUser.objects.create_user(username='host', employee_id='H1', first_name='Asha', last_name='Rao', user_type='HR')
+        visitor = MongoVisitor.objects.create(
+            first_name='Ravi', last_name='Kumar, Jr.', email='ravi@example.com', phone='9876543210',
+            company='Acme "Labs"', id_proof_type='Aadhaar', id_proof_number='1234',
+        )
+        visit = MongoVisitRequest.objects.create(
+            visitor_id=str(visitor.id), host_id=str(host.pk), purpose='Meeting', visit_date=date(2026, 3, 2),
+            start_time=timezone.now(), end_time='18:00', status='APPROVED', approved_by_id=str(host.pk),
+            valid_upto=date(2026, 3, 4), day_1_checkin=timezone.now(),
+        )
+        # Raw insert: save() would render a QR image to disk
+        MongoVisitorCard._get_collection().insert_one({'visit_request_id': str(visit.id), 'card_number': 'VC-1'})
+
+    def _rows(self):
+        from .exports import export_queryset, iter_export_rows
+
+        return list(iter_export_rows(export_queryset()))
+
+    def _xlsx_rows(self, rows):
+        import os
+        import tempfile
+        import openpyxl
+        from .exports import write_xlsx
+
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            write_xlsx(rows, 'Visitors', path)
+            sheet = openpyxl.load_workbook(path, read_only=True).active
+            return [['' if value is None else value for value in row] for row in sheet.iter_rows(values_only=True)]
+        finally:
+            os.unlink(path)
+
+    def test_csv_matches_xlsx(self):
+        import csv
+        from .exports import iter_csv
+
+        rows = self._rows()
+        text = b''.join(iter_csv(rows)).decode('utf-8')
+        self.assertEqual(list(csv.reader(text.splitlines())), self._xlsx_rows(rows))
+
+    def test_ndjson_matches_xlsx(self):
+        import json
+        from .exports import iter_ndjson
+
+        rows = self._rows()
+        header, *values = self._xlsx_rows(rows)
+        lines = b''.join(iter_ndjson(rows)).decode('utf-8').splitlines()
+        self.assertEqual(len(header), 38)
+        self.assertEqual([json.loads(line) for line in lines], [
+            {name.lower().replace(' ', '_'): value for name, value in zip(header, row)} for row in values
+        ])
+        self.assertEqual(json.loads(lines[0])['visitor_card_id'], 'VC-1')
+        self.assertEqual(json.loads(lines[0])['approved_by'], 'Asha Rao')
+
+    def test_gzip_response_decompresses_to_the_rows(self):
+        import gzip
+        from django.test import RequestFactory
+        from .exports import CSV_CONTENT_TYPE, iter_csv, streaming_response
+
+        rows = self._rows()
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        response = streaming_response(iter_csv(rows), CSV_CONTENT_TYPE, 'visitors.csv', request)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b''.join(iter_csv(rows)))
+
+
+class DeltaTokenTests(SimpleTestCase):
+    def test_token_round_trips(self):
+        from .exports import make_delta_token, parse_delta_token
+
+        until = timezone.now()
+        self.assertEqual(parse_delta_token(make_delta_token(until)), until)
+
+    def test_tampered_token_is_rejected(self):
+        from django.core import signing
+        from .exports import make_delta_token, parse_delta_token
+
+        token = make_delta_token(timezone.now())
+        payload, signature = token.rsplit(':', 1)
+        forged = signing.dumps({'until': '2000-01-01T00:00:00+00:00'}, salt='another-salt')
+        for bad in (payload + ':' + signature[::-1], forged, 'not-a-token', ''):
+            with self.subTest(token=bad):
+                with self.assertRaisesMessage(ValueError, 'Invalid updated_since token.'):
+                    parse_delta_token(bad)
+
+    @override_settings(DELTA_TOKEN_MAX_AGE=60)
+    def test_expired_token_is_rejected(self):
+        import time
+        from .exports import make_delta_token, parse_delta_token
+
+        with mock.patch('django.core.signing.time.time', return_value=time.time() - 61):
+            stale = make_delta_token(timezone.now())
+        with self.assertRaisesMessage(ValueError, 'Expired updated_since token: omit it for a full sync.'):
+            parse_delta_token(stale)
+        self.assertIsNotNone(parse_delta_token(make_delta_token(timezone.now())))
+
+
+def _create_visitor(first_name, last_name, **fields):
+    from .mongo_models import MongoVisitor
+
+    fields = dict({'phone': '9876543210', 'company': 'Acme', 'id_proof_type': 'Aadhaar', 'id_proof_number': '1234'}, **fields)
+    return MongoVisitor.objects.create(first_name=first_name, last_name=last_name, **fields)
+
+
+@override_settings(VISITOR_SEARCH_CACHE_TTL=0)
+class VisitorSearchTests(MongoTestCase):
+    def test_query_filter(self):
+        from .search import query_filter
+
+        self.assertEqual(query_filter('Ra'), {'search_keys': 'ra'})
+        self.assertEqual(query_filter('+91 98765-4'), {'search_keys': '91987654'})
+        self.assertEqual(
+            query_filter('Ravi  Kú'),
+            {'$or': [{'search_keys': {'$all': ['ku', 'ravi']}}, {'search_keys': 'raviku'}]},
+        )
+        self.assertIsNone(query_filter('r'))
+        self.assertIsNone(query_filter(' - '))
+
+    def test_visitors_are_found_by_normalized_keys(self):
+        from .search import find_visitors
+
+        ravi = _create_visitor('Ravi', 'Kumar', email='Ravi.K@Example.com', phone='+91 98765 43210', id_proof_number='AB-12 34')
+        _create_visitor('Asha', 'Rao', phone='9123456789')
+
+        for query in ('rav', 'KUMAR', 'kum rav', 'ravi.k@', '98765', '+91 98765', '9198765432', 'ab1234', 'AB-12-3'):
+            with self.subTest(query=query):
+                self.assertEqual([r['id'] for r in find_visitors(query)], [str(ravi.id)])
+        self.assertEqual(find_visitors('ravi rao'), [])
+
+    def test_results_are_limited(self):
+        from .search import find_visitors
+
+        for n in range(5):
+            _create_visitor('Ravi', f'Kumar{n}', email=f'ravi{n}@example.com')
+        self.assertEqual(len(find_visitors('ravi', limit=3)), 3)
+
+    def test_search_keys_follow_updates(self):
+        from .search import find_visitors
+
+        visitor = _create_visitor('Ravi', 'Kumar')
+        visitor.first_name = 'Rajesh'
+        visitor.save()
+        self.assertEqual(find_visitors('ravi'), [])
+        self.assertEqual([r['id'] for r in find_visitors('raje')], [str(visitor.id)])
+
+
+@override_settings(VISITOR_SEARCH_CACHE_TTL=30)
+class SearchCacheTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import cache
+
+        cache.clear()
+        for n, (first_name, last_name) in enumerate([
+            ('Raj', 'Mehta'), ('Rajveer', 'Singh'), ('Rajvi', 'Kumar'), ('Rajesh', 'Kumar'), ('Ravi', 'Rajvanshi'),
+        ]):
+            _create_visitor(first_name, last_name, email=f'visitor{n}@example.com')
+
+    def _ids(self, results):
+        return [r['id'] for r in results]
+
+    def _outcomes(self, *queries):
+        from .search import find_visitors, search_cache_stats
+
+        before = search_cache_stats()
+        for query in queries:
+            find_visitors(query)
+        after = search_cache_stats()
+        return {k: after.get(k, 0) - before.get(k, 0) for k in ('hit', 'narrowed', 'miss')}
+
+    def _uncached(self, query):
+        from .search import find_visitors
+
+        with override_settings(VISITOR_SEARCH_CACHE_TTL=0):
+            return self._ids(find_visitors(query))
+
+    def test_longer_query_narrows_cached_prefix(self):
+        from .mongo_models import MongoVisitor
+        from .search import find_visitors
+
+        self.assertEqual(self._outcomes('raj'), {'hit': 0, 'narrowed': 0, 'miss': 1})
+        for query in ('rajv', 'rajve', 'rajv ku', 'raj sin'):
+            with self.subTest(query=query):
+                with mock.patch.object(MongoVisitor, '_get_collection', side_effect=AssertionError('queried MongoDB')):
+                    self.assertEqual(self._outcomes(query), {'hit': 0, 'narrowed': 1, 'miss': 0})
+                    cached = self._ids(find_visitors(query))
+                self.assertEqual(cached, self._uncached(query))
+        self.assertEqual(self._outcomes('rajv'), {'hit': 1, 'narrowed': 0, 'miss': 0})
+
+    def test_incomplete_prefix_is_not_narrowed(self):
+        with mock.patch('visitorapi.search.CACHE_CANDIDATES', 3):
+            self.assertEqual(self._outcomes('raj', 'rajv'), {'hit': 0, 'narrowed': 0, 'miss': 2})
+
+    def test_unrelated_query_is_not_narrowed(self):
+        # Typing over "raj" with "ram" shares the cache prefix "ra" only, which was never searched
+        self.assertEqual(self._outcomes('raj', 'ram'), {'hit': 0, 'narrowed': 0, 'miss': 2})
+
+    def test_visitor_write_invalidates_cached_results(self):
+        from .search import _generation, find_visitors
+
+        self.assertEqual(len(find_visitors('rajv')), 3)
+        generation = _generation()
+        visitor = _create_visitor('Rajvardhan', 'Rao', email='rajvardhan@example.com')
+
+        self.assertEqual(_generation(), generation + 1)
+        self.assertEqual(self._outcomes('rajv'), {'hit': 0, 'narrowed': 0, 'miss': 1})
+        self.assertIn(str(visitor.id), self._ids(find_visitors('rajv')))
+        self.assertEqual(self._ids(find_visitors('rajv')), self._uncached('rajv'))
+
+    def test_resolve_invalidates_cached_results(self):
+        from .mongo_models import MongoVisitor
+        from .search import find_visitors
+
+        find_visitors('rajv')
+        visitor = MongoVisitor.resolve('rajvardhan@example.com', {
+            'first_name': 'Rajvardhan', 'last_name': 'Rao', 'phone': '9876543210', 'company': 'Acme',
+            'id_proof_type': 'Aadhaar', 'id_proof_number': '1234',
+        })
+        self.assertIn(str(visitor.id), self._ids(find_visitors('rajv')))
+
+
+class VisitorIdentityTests(MongoTestCase):
+    FIELDS = {
+        'first_name': 'Ravi', 'last_name': 'Kumar', 'phone': '98765 43210', 'company': 'Acme',
+        'id_proof_type': 'Aadhaar', 'id_proof_number': '1234',
+    }
+
+    def test_phone_is_normalized_with_and_without_country_code(self):
+        from .identity import normalize_phone
+
+        for phone in ('9876543210', '98765-43210', '098765 43210', '+91 98765 43210', '919876543210', '0091 9876543210'):
+            with self.subTest(phone=phone):
+                self.assertEqual(normalize_phone(phone), '+919876543210')
+        with override_settings(DEFAULT_PHONE_COUNTRY_CODE='44'):
+            self.assertEqual(normalize_phone('7911123456'), '+447911123456')
+        self.assertEqual(normalize_phone('+1 (415) 555-0100'), '+14155550100')
+        self.assertIsNone(normalize_phone(' - '))
+
+    def test_email_is_case_folded(self):
+        from .identity import visitor_identity_key
+
+        self.assertEqual(visitor_identity_key(' Ravi.K@Example.COM ', 'Ravi', 'Kumar', '1', 'Acme'), 'email:ravi.k@example.com')
+        self.assertEqual(visitor_identity_key('', 'Ravi', 'Kumar', '1', 'Acme'), visitor_identity_key(None, 'Ravi', 'Kumar', '1', 'Acme'))
+
+    def test_contact_key_ignores_case_accents_spacing_and_country_code(self):
+        from .identity import visitor_identity_key
+
+        self.assertEqual(
+            visitor_identity_key(None, 'Rávi ', 'KUMAR', '+91 98765 43210', 'Acme  Labs'),
+            visitor_identity_key(None, 'ravi', 'Kumar', '9876543210', 'acme labs'),
+        )
+
+    def test_resolve_matches_normalized_identity(self):
+        from .mongo_models import MongoVisitor
+
+        first = MongoVisitor.resolve(None, self.FIELDS)
+        again = MongoVisitor.resolve(None, dict(self.FIELDS, first_name='RAVI', phone='+91 9876543210'))
+        self.assertEqual(again.id, first.id)
+
+        by_email = MongoVisitor.resolve('Ravi@Example.com', self.FIELDS)
+        updated = MongoVisitor.resolve('ravi@example.com', dict(self.FIELDS, company='Globex'))
+        self.assertEqual(updated.id, by_email.id)
+        self.assertEqual(updated.company, 'Globex')
+        self.assertEqual(MongoVisitor.objects.count(), 2)
+
+    def test_concurrent_resolves_return_one_visitor(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .mongo_models import MongoVisitor
+
+        for email, identity_key in (
+            ('ravi@example.com', 'email:ravi@example.com'),
+            (None, 'contact:ravi|kumar|+919876543210|acme'),
+        ):
+            with self.subTest(email=email):
+                MongoVisitor.objects.delete()
+                barrier = threading.Barrier(2)
+
+                def resolve(phone):
+                    barrier.wait()
+                    return MongoVisitor.resolve(email, dict(self.FIELDS, phone=phone))
+
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    visitors = list(pool.map(resolve, ['9876543210', '+91 98765 43210']))
+
+                self.assertEqual(visitors[0].id, visitors[1].id)
+                self.assertEqual(MongoVisitor.objects.count(), 1)
+                self.assertEqual(MongoVisitor.objects.get().identity_key, identity_key)
+
+
+@override_settings(
+    CLEAR_SESSIONS_ON_RESTART=False,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    SESSION_EPOCH_CHECK_SECONDS=0,
+)
+class SessionEpochTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from .models import HRUser
+
+        HRUser.objects.create_user(username='hr', password='secret-pw', employee_id='E1', user_type='HR')
+
+    def _login(self):
+        response = self.client.post('/login/', {'username': 'hr', 'password': 'secret-pw'})
+        self.assertEqual(response.status_code, 302)
+
+    def _logged_in(self):
+        # The login page sends signed-in HR users on to their dashboard
+        return self.client.get('/login/').status_code == 302
+
+    def test_new_login_is_stamped_with_current_epoch(self):
+        from .session_epoch import EPOCH_KEY, bump_session_epoch
+
+        bump_session_epoch()
+        epoch = bump_session_epoch()
+        self._login()
+        self.assertEqual(self.client.session[EPOCH_KEY], epoch)
+        self.assertTrue(self._logged_in())
+
+    def test_session_from_older_epoch_is_flushed(self):
+        from django.contrib.sessions.models import Session
+        from .session_epoch import bump_session_epoch
+
+        self._login()
+        session_key = self.client.session.session_key
+        bump_session_epoch()
+
+        self.assertFalse(self._logged_in())
+        self.assertFalse(Session.objects.filter(pk=session_key).exists())
+
+    def test_session_from_before_epochs_is_flushed(self):
+        from .session_epoch import EPOCH_KEY, bump_session_epoch
+
+        self._login()
+        session = self.client.session
+        del session[EPOCH_KEY]
+        session.save()
+        bump_session_epoch()
+        self.assertFalse(self._logged_in())
+
+    def test_restarts_within_coalesce_window_bump_once(self):
+        from .session_epoch import bump_session_epoch, current_epoch
+
+        epoch = bump_session_epoch(coalesce_seconds=120)
+        self.assertEqual(bump_session_epoch(coalesce_seconds=120), epoch)
+        self.assertEqual(current_epoch(), epoch)
+        self.assertEqual(bump_session_epoch(), epoch + 1)
+
+
+@override_settings(
+    CLEAR_SESSIONS_ON_RESTART=False,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    LOGIN_FAILURE_LIMIT=3,
+    LOGIN_IP_FAILURE_LIMIT=5,
+)
+class LoginThrottleTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import cache
+        from .models import HRUser
+
+        cache.clear()
+        HRUser.objects.create_user(username='hr', password='secret-pw', employee_id='E1', user_type='HR')
+
+    def _post(self, username='hr', password='wrong'):
+        return self.client.post('/login/', {'username': username, 'password': password})
+
+    def test_throttled_login_is_refused_before_authenticate(self):
+        from django.contrib.auth import authenticate
+
+        for _ in range(3):
+            response = self._post()
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Invalid username or password.')
+
+        with mock.patch('visitorapi.views.authenticate', side_effect=authenticate) as patched:
+            response = self._post(password='secret-pw')
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, 'Too many failed login attempts', status_code=429)
+        patched.assert_not_called()
+
+    def test_username_counter_ignores_case_and_resets_on_success(self):
+        self._post()
+        self._post(username=' HR ')
+        self.assertEqual(self._post(password='secret-pw').status_code, 302)
+        self.client.logout()
+
+        for _ in range(2):
+            self._post()
+        self.assertEqual(self._post(password='secret-pw').status_code, 302)
+
+    def test_client_address_is_throttled_across_usernames(self):
+        for n in range(5):
+            self.assertEqual(self._post(username=f'guess-{n}').status_code, 200)
+        self.assertEqual(self._post(password='secret-pw').status_code, 429)
+        # Another address is unaffected
+        response = self.client.post('/login/', {'username': 'hr', 'password': 'secret-pw'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, 302)
@@ -8,9 +8,16 @@ from .views import (
     visitor_registration,
     register_visitor,
     search_visitors,
+    import_visitors_view,
     ajax_password_reset,
     export_visitors_excel,
     export_hos_visitors_excel,
+    export_visitors_csv,
+    export_visitors_ndjson,
+    export_visitors_delta,
+    create_export_job,
+    export_job_status,
+    download_export_job,
     registration_user_login_view,
     registration_users_list,
     add_registration_user,
@@ -48,6 +55,7 @@ urlpatterns = [
     path('register/', visitor_registration, name='visitor-registration'),
     path('register_visitor/', register_visitor, name='register-visitor-api'),
     path('search_visitors/', search_visitors, name='search-visitors-api'),
+    path('import_visitors/', import_visitors_view, name='import-visitors-api'),
     path('password_reset/', auth_views.PasswordResetView.as_view(template_name='password_reset.html'), name='password_reset'),
     path('password_reset_done/', auth_views.PasswordResetDoneView.as_view(template_name='password_reset_done.html'), name='password_reset_done'),
     path('reset/<uidb64>/<token>/', auth_views.PasswordResetConfirmView.as_view(template_name='password_reset_confirm.html'), name='password_reset_confirm'),
@@ -55,6 +63,12 @@ urlpatterns = [
     path('ajax/password_reset/', ajax_password_reset, name='ajax_password_reset'),
     path('export-visitors-excel/', export_visitors_excel, name='export_visitors_excel'),
     path('export-hos-visitors-excel/', export_hos_visitors_excel, name='export_hos_visitors_excel'),
+    path('export-visitors-csv/', export_visitors_csv, name='export_visitors_csv'),
+    path('export-visitors-ndjson/', export_visitors_ndjson, name='export_visitors_ndjson'),
+    path('export-visitors-delta/', export_visitors_delta, name='export_visitors_delta'),
+    path('export-jobs/', create_export_job, name='create_export_job'),
+    path('export-jobs/<str:job_id>/', export_job_status, name='export_job_status'),
+    path('export-jobs/<str:job_id>/download/', download_export_job, name='download_export_job'),
     path('registration-login/', registration_user_login_view, name='registration-login'),
     path('registration-users-list/', registration_users_list, name='registration-users-list'),
     path('add-registration-user/', add_registration_user, name='add-registration-user'),
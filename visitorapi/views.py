@@ -29,7 +29,6 @@ from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth.tokens import default_token_generator
 from django.conf import settings
 from django.urls import reverse
-from django.core.mail import send_mail
 import logging
 from django.views.decorators.http import require_POST
 from django.contrib.auth import get_user_model
@@ -38,6 +37,8 @@ import random
 import string
 from rest_framework.parsers import MultiPartParser, FormParser
 from django.utils.timezone import localtime
+from bson import ObjectId
+from .idempotency import idempotent
 
 # Helper function for safe timezone conversion
 def safe_localtime(dt):
@@ -127,6 +128,7 @@ def visitor_registration(request):
     )
     return render(request, 'visitor_form.html', {'frequent_visitors': frequent_visitors})
 
+@idempotent
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register_visitor(request):
@@ -134,23 +136,21 @@ def register_visitor(request):
     if not request.user.is_authenticated or not is_registration_user(request.user):
         return Response({'error': 'Authentication required'}, status=401)
     try:
-        # Determine host based on 'Send to HR' checkbox
+        from .host_routing import route_host
+        
+        # Determine host based on 'Send to HR' checkbox; the host list is cached per worker
         send_to_hr = request.data.get('send_to_hr') in ['on', 'true', 'True', True]
-        if send_to_hr:
-            host = HRUser.objects.filter(user_type='HR').first()
-        else:
-            host = HRUser.objects.filter(user_type='HOS').first()
-        if not host:
+        host_id = route_host('HR' if send_to_hr else 'HOS')
+        if not host_id:
             return Response({'error': 'No host available to assign the visit.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         email = request.data.get('email')
         
-        # Handle photo upload
-        photo_path = None
+        # Handle photo upload: stored by content hash, shrunk off the request thread
+        photo_path = photo_thumbnail = None
         if request.FILES.get('photo'):
-            from django.core.files.storage import default_storage
-            photo = request.FILES['photo']
-            photo_path = default_storage.save(f'visitor_photos/{photo.name}', photo)
+            from .photos import store_photo
+            photo_path, photo_thumbnail = store_photo(request.FILES['photo'])
         
         visitor_data = {
             'first_name': request.data.get('first_name'),
@@ -160,37 +160,19 @@ def register_visitor(request):
             'id_proof_type': request.data.get('id_proof_type'),
             'id_proof_number': request.data.get('id_proof_number'),
             'photo': photo_path,
+            'photo_thumbnail': photo_thumbnail,
         }
 
         # Import MongoDB models
         from visitorapi.mongo_models import MongoVisitor, MongoVisitRequest
         
-        if email:
-            # If email is provided, check if visitor exists and update or create
-            existing_visitor = MongoVisitor.objects.filter(email=email).first()
-            if existing_visitor:
-                # Update existing visitor
-                for key, value in visitor_data.items():
-                    if value is not None:  # Only update if value is provided
-                        setattr(existing_visitor, key, value)
-                existing_visitor.save()
-                visitor = existing_visitor
-            else:
-                # Create new visitor
-                visitor = MongoVisitor.objects.create(**visitor_data, email=email)
-        else:
-            # If no email, check for existing visitor by name, phone, and company
-            existing_visitor = MongoVisitor.objects.filter(
-                first_name=visitor_data['first_name'],
-                last_name=visitor_data['last_name'],
-                phone=visitor_data['phone'],
-                company=visitor_data['company']
-            ).first()
-            if existing_visitor:
-                # Do NOT update the existing visitor's details!
-                visitor = existing_visitor
-            else:
-                visitor = MongoVisitor.objects.create(**visitor_data, email=None)
+        # Single atomic upsert keyed on the normalized email, or name/phone/company
+        # when there is no email; an existing visitor's details are only updated
+        # when the email is provided
+        visitor = MongoVisitor.resolve(email, visitor_data)
+        if photo_path:
+            from .photos import process_photo_later
+            process_photo_later(visitor.id, photo_path)
 
         # Handle device permissions (checkboxes return 'on' if checked, None if unchecked)
         allow_mobile = request.data.get('allow_mobile') == 'on'
@@ -224,7 +206,7 @@ def register_visitor(request):
         ist_now = timezone.localtime(timezone.now())
         MongoVisitRequest.objects.create(
             visitor_id=str(visitor.id),
-            host_id=str(host.id),
+            host_id=host_id,
             purpose=request.data.get('purpose'),
             other_purpose=request.data.get('other_purpose'),
             visit_date=ist_now.date(),
@@ -245,6 +227,32 @@ def register_visitor(request):
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@parser_classes([MultiPartParser, FormParser])
+def import_visitors_view(request):
+    """Pre-register visitors from an uploaded CSV or XLSX file; returns a per-row report"""
+    if not request.user.is_authenticated or not is_registration_user(request.user):
+        return Response({'error': 'Authentication required'}, status=401)
+    upload = request.FILES.get('file')
+    if not upload:
+        return Response({'error': 'No file uploaded'}, status=status.HTTP_400_BAD_REQUEST)
+    if not upload.name.lower().endswith(('.csv', '.xlsx')):
+        return Response({'error': 'Upload a .csv or .xlsx file'}, status=status.HTTP_400_BAD_REQUEST)
+
+    from .bulk_import import import_visitors, iter_import_rows, summarize
+
+    try:
+        report = import_visitors(
+            iter_import_rows(upload.file, upload.name),
+            created_by=request.user,
+            group_name=(request.data.get('group') or '').strip()[:100] or None,
+        )
+    except Exception as e:
+        logger.exception("Visitor import failed")
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'summary': summarize(report), 'rows': report})
+
 def is_hr_user(user):
     return hasattr(user, 'user_type') and user.user_type == 'HR'
 
@@ -254,102 +262,57 @@ def is_registration_user(user):
 def is_hos_user(user):
     return hasattr(user, 'user_type') and user.user_type == 'HOS'
 
-# Update login_view to handle only HR users
+def portal_login(request, template, is_portal_user, success_url):
+    """
+    Shared login for the HR, registration and HOS portals. The password is
+    verified once, by authenticate(), and the portal is checked on the user it
+    returns. Usernames or addresses with too many recent failures are turned
+    away before any hashing.
+    """
+    from .login_throttle import is_throttled, record_failure, reset_failures
 
-def login_view(request):
     if request.user.is_authenticated:
-        if is_hr_user(request.user):
-            return redirect('hr-dashboard')
+        if is_portal_user(request.user):
+            return redirect(success_url)
         else:
             logout(request)
             messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'login.html')
+            return render(request, template)
     if request.method == 'POST':
         username = request.POST.get('username')
         password = request.POST.get('password')
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        try:
-            user_obj = User.objects.get(username=username)
-        except User.DoesNotExist:
-            messages.error(request, 'Invalid username.')
-            return render(request, 'login.html')
-        if not user_obj.check_password(password):
-            messages.error(request, 'Invalid password.')
-            return render(request, 'login.html')
+        if is_throttled(request, username):
+            messages.error(request, 'Too many failed login attempts. Please try again later.')
+            return render(request, template, status=429)
         user = authenticate(request, username=username, password=password)
-        if user is not None and is_hr_user(user):
+        if user is None:
+            record_failure(request, username)
+            messages.error(request, 'Invalid username or password.')
+            return render(request, template)
+        reset_failures(request, username)
+        if is_portal_user(user):
             login(request, user)
-            return redirect('hr-dashboard')
+            return redirect(success_url)
         else:
             messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'login.html')
-    return render(request, 'login.html')
+            return render(request, template)
+    return render(request, template)
+
+# Update login_view to handle only HR users
+
+def login_view(request):
+    return portal_login(request, 'login.html', is_hr_user, 'hr-dashboard')
 
 # Registration user login view
 
 def registration_user_login_view(request):
-    if request.user.is_authenticated:
-        if is_registration_user(request.user):
-            return redirect('visitor-registration')
-        else:
-            logout(request)
-            messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'registration_login.html')
-    if request.method == 'POST':
-        username = request.POST.get('username')
-        password = request.POST.get('password')
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        try:
-            user_obj = User.objects.get(username=username)
-        except User.DoesNotExist:
-            messages.error(request, 'Invalid username.')
-            return render(request, 'registration_login.html')
-        if not user_obj.check_password(password):
-            messages.error(request, 'Invalid password.')
-            return render(request, 'registration_login.html')
-        user = authenticate(request, username=username, password=password)
-        if user is not None and is_registration_user(user):
-            login(request, user)
-            return redirect('visitor-registration')
-        else:
-            messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'registration_login.html')
-    return render(request, 'registration_login.html')
+    return portal_login(request, 'registration_login.html', is_registration_user, 'visitor-registration')
 
 # HOS login view
 
 @csrf_protect
 def hos_login_view(request):
-    if request.user.is_authenticated:
-        if is_hos_user(request.user):
-            return redirect('hos-dashboard')
-        else:
-            logout(request)
-            messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'hos_login.html')
-    if request.method == 'POST':
-        username = request.POST.get('username')
-        password = request.POST.get('password')
-        from django.contrib.auth import get_user_model
-        User = get_user_model()
-        try:
-            user_obj = User.objects.get(username=username)
-        except User.DoesNotExist:
-            messages.error(request, 'Invalid username.')
-            return render(request, 'hos_login.html')
-        if not user_obj.check_password(password):
-            messages.error(request, 'Invalid password.')
-            return render(request, 'hos_login.html')
-        user = authenticate(request, username=username, password=password)
-        if user is not None and is_hos_user(user):
-            login(request, user)
-            return redirect('hos-dashboard')
-        else:
-            messages.error(request, 'You do not have permission to access this portal.')
-            return render(request, 'hos_login.html')
-    return render(request, 'hos_login.html')
+    return portal_login(request, 'hos_login.html', is_hos_user, 'hos-dashboard')
 
 # Restrict dashboards
 
@@ -362,7 +325,7 @@ def hr_dashboard_view(request):
         return redirect('login')
     
     # Import MongoDB models
-    from visitorapi.mongo_models import MongoVisitRequest, MongoVisitor
+    from visitorapi.mongo_models import MongoVisitGroup, MongoVisitRequest, MongoVisitor
     
     now = timezone.now()
     today = now.date()
@@ -374,11 +337,16 @@ def hr_dashboard_view(request):
     
     # Get requests from MongoDB and fetch visitor data
     pending_requests_data = []
+    # Group members are listed once per group (pending_groups)
     pending_requests = MongoVisitRequest.objects.filter(
         status='PENDING', 
         host_id__in=hr_user_ids, 
-        created_at__gte=seven_days_ago
+        created_at__gte=seven_days_ago,
+        group_id=None
     ).order_by('-created_at')
+    pending_groups = MongoVisitGroup.pending_with_members(hr_user_ids, seven_days_ago)
+    for item in pending_groups:
+        item['group'].created_at_ist = safe_localtime(item['group'].created_at)
     
     for req in pending_requests:
         try:
@@ -522,6 +490,7 @@ def hr_dashboard_view(request):
 
     context = {
         'pending_requests': pending_requests_data,
+        'pending_groups': pending_groups,
         'approved_requests': approved_requests_data,
         'rejected_requests': rejected_requests_data,
         'frequent_visitors': frequent_visitors,
@@ -539,7 +508,7 @@ def hos_dashboard_view(request):
         return redirect('hos-login')
     
     # Import MongoDB models
-    from visitorapi.mongo_models import MongoVisitRequest, MongoVisitor
+    from visitorapi.mongo_models import MongoVisitGroup, MongoVisitRequest, MongoVisitor
     
     now = timezone.now()
     today = now.date()
@@ -549,11 +518,16 @@ def hos_dashboard_view(request):
     hos_user_id = str(request.user.id)
     
     # Query MongoDB for HOS-specific data
+    # Group members are listed once per group (pending_groups)
     pending_requests = MongoVisitRequest.objects.filter(
         status='PENDING', 
         host_id=hos_user_id, 
-        created_at__gte=seven_days_ago
+        created_at__gte=seven_days_ago,
+        group_id=None
     ).order_by('-created_at')
+    pending_groups = MongoVisitGroup.pending_with_members([hos_user_id], seven_days_ago)
+    for item in pending_groups:
+        item['group'].created_at_ist = safe_localtime(item['group'].created_at)
     
     approved_requests = MongoVisitRequest.objects.filter(
         status='APPROVED', 
@@ -706,6 +680,7 @@ def hos_dashboard_view(request):
     
     context = {
         'pending_requests': pending_requests_structured,
+        'pending_groups': pending_groups,
         'approved_requests': approved_requests_structured,
         'rejected_requests': rejected_requests_structured,
         'frequent_visitors': frequent_visitors_data,
@@ -723,30 +698,11 @@ def search_visitors(request):
     if not request.user.is_authenticated or not is_registration_user(request.user):
         return JsonResponse({'error': 'Authentication required'}, status=401)
     
-    # Import MongoDB models
-    from visitorapi.mongo_models import MongoVisitor
+    from .search import find_visitors
     
     query = request.GET.get('q', '').strip()
-    results = []
-    if query:
-        visitors = MongoVisitor.objects.filter(
-            models.Q(first_name__icontains=query) |
-            models.Q(last_name__icontains=query) |
-            models.Q(email__icontains=query) |
-            models.Q(phone__icontains=query) |
-            models.Q(id_proof_number__icontains=query)
-        )[:10]
-        for v in visitors:
-            results.append({
-                'id': str(v.id),  # Convert ObjectId to string
-                'first_name': v.first_name,
-                'last_name': v.last_name,
-                'email': v.email,
-                'phone': v.phone,
-                'company': v.company,
-                'id_proof_type': v.id_proof_type,
-                'id_proof_number': v.id_proof_number,
-            })
+    # Bounded lookup on the normalized prefix index instead of unanchored regexes
+    results = find_visitors(query) if query else []
     return JsonResponse({'results': results})
 
 @login_required(login_url='/login/')
@@ -785,20 +741,16 @@ def update_request_status(request, request_id, action):
         
         visit_request.save()
         
-        # Send email if possible
+        # Queue the email; the outbox worker sends it off the request
         if visitor_email and subject and message:
-            try:
-                send_mail(
-                    subject,
-                    message,
-                    f"Godrej Visitor Management System <{settings.EMAIL_HOST_USER}>",
-                    [visitor_email],
-                    fail_silently=False,
-                )
-                email_sent = True
-            except Exception as e:
-                logging.error(f"Failed to send email to visitor: {visitor_email}. Error: {e}")
-        # Optionally, you could log email_sent or show a message
+            from .outbox import enqueue_email
+            email_sent = enqueue_email(
+                subject,
+                message,
+                [visitor_email],
+                f"Godrej Visitor Management System <{settings.EMAIL_HOST_USER}>",
+                digest=True,
+            ) > 0
     user_type = getattr(request.user, 'user_type', None)
     if user_type == 'HOS':
         return redirect('hos-dashboard')
@@ -806,285 +758,176 @@ def update_request_status(request, request_id, action):
         return redirect('hr-dashboard')
 
 @login_required(login_url='/login/')
-def export_visitors_excel(request):
-    """Export visitors data as Excel file"""
-    import openpyxl
-    from django.utils import timezone
-    import tempfile
-    import os
-    
-    def get_user_display_name(user):
-        if not user:
-            return ""
-        if user.first_name or user.last_name:
-            return f"{user.first_name or ''} {user.last_name or ''}".strip()
-        return user.username or user.email or str(user)
-
-    # Create Excel workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'Visitors'
-    
-    # Header with day-specific columns
-    header = [
-        'Visitor ID', 'First Name', 'Last Name', 'Email', 'Phone', 'Organization',
-        'ID Proof Type', 'ID Proof Number', 'Photo URL',
-        "Reference Employee Name", "Reference Employee Department", "Reference Purpose",
-        'Start Time', 'End Time', 'Valid Upto',
-        'Visitor Card ID', 'Approved By', 'Approver Type'
-    ]
-    
-    # Add day-specific check-in/check-out columns (10 days)
-    for day in range(1, 11):
-        header.extend([f'Day {day} Check In', f'Day {day} Check Out'])
-    
-    ws.append(header)
-    
-    # Get MongoDB data
-    from visitorapi.mongo_models import MongoVisitRequest, MongoVisitor, MongoVisitorCard
-    
-    visit_requests = MongoVisitRequest.objects.all()
-    if not visit_requests.count():
-        ws.append(['No data found'] + [''] * (len(header) - 1))
-    else:
-        for vr in visit_requests:
-            # Get visitor data
-            try:
-                visitor = MongoVisitor.objects.get(id=vr.visitor_id)
-            except MongoVisitor.DoesNotExist:
+@require_POST
+def update_group_status(request, group_id, action):
+    """Approve or reject every pending member of a group visit in one request"""
+    from visitorapi.mongo_models import MongoVisitGroup, MongoVisitor
+    
+    group = MongoVisitGroup.objects(id=group_id).first() if ObjectId.is_valid(group_id) else None
+    company_name = "Godrej"
+    if group and action.upper() in ('APPROVE', 'REJECT'):
+        approve = action.upper() == 'APPROVE'
+        visitor_ids = group.set_status('APPROVED' if approve else 'REJECTED', request.user.id)
+        
+        emails = []
+        sender = f"Godrej Visitor Management System <{settings.EMAIL_HOST_USER}>"
+        for visitor in MongoVisitor.objects(id__in=visitor_ids).only('first_name', 'last_name', 'email'):
+            if not visitor.email:
                 continue
-            
-            # Get visitor card ID if exists
-            visitor_card_id = ''
-            try:
-                visitor_card = MongoVisitorCard.objects.filter(visit_request_id=str(vr.id)).first()
-                visitor_card_id = visitor_card.card_number if visitor_card else ''
-            except:
-                visitor_card_id = ''
-            
-            # Get approver information
-            approver_name = ''
-            approver_type = ''
-            if vr.approved_by_id:
-                try:
-                    approver = HRUser.objects.get(id=vr.approved_by_id)
-                    approver_name = get_user_display_name(approver)
-                    approver_type = approver.user_type
-                except HRUser.DoesNotExist:
-                    approver_name = f"User {vr.approved_by_id}"
-                    approver_type = 'Unknown'
-            elif vr.host_id:
-                try:
-                    host = HRUser.objects.get(id=vr.host_id)
-                    approver_name = get_user_display_name(host)
-                    approver_type = host.user_type
-                except HRUser.DoesNotExist:
-                    approver_name = f"User {vr.host_id}"
-                    approver_type = 'Unknown'
-            
-            # Base row data
-            row_data = [
-                str(visitor.id), visitor.first_name, visitor.last_name, visitor.email or '', visitor.phone, visitor.company,
-                visitor.id_proof_type, visitor.id_proof_number,
-                visitor.photo or '',
-                vr.reference_employee_name or '',
-                vr.reference_employee_department or '',
-                vr.reference_purpose or '',
-                # Convert to IST time for display
-                timezone.localtime(vr.start_time).strftime('%Y-%m-%d %H:%M') if vr.start_time and timezone.is_aware(vr.start_time) else (vr.start_time.strftime('%Y-%m-%d %H:%M') if vr.start_time else ''),
-                vr.end_time or '',
-                # Handle valid_upto - it can be date or datetime
-                vr.valid_upto.strftime('%Y-%m-%d') if vr.valid_upto else '',
-                visitor_card_id,
-                approver_name,
-                approver_type
-            ]
-            
-            # Add day-specific check-in/check-out data
-            for day in range(1, 11):
-                checkin_field = f'day_{day}_checkin'
-                checkout_field = f'day_{day}_checkout'
-                
-                checkin_time = getattr(vr, checkin_field)
-                checkout_time = getattr(vr, checkout_field)
-                
-                # Convert to IST time for display
-                if checkin_time:
-                    if timezone.is_aware(checkin_time):
-                        ist_checkin_time = timezone.localtime(checkin_time)
-                        row_data.append(ist_checkin_time.strftime('%Y-%m-%d %H:%M:%S'))
-                    else:
-                        row_data.append(checkin_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    row_data.append('')
-                
-                if checkout_time:
-                    if timezone.is_aware(checkout_time):
-                        ist_checkout_time = timezone.localtime(checkout_time)
-                        row_data.append(checkout_time.strftime('%Y-%m-%d %H:%M:%S'))
-                    else:
-                        row_data.append(checkout_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    row_data.append('')
-            
-            ws.append(row_data)
-    
-    # Save to temporary file and send as response
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-        wb.save(tmp.name)
-        tmp_path = tmp.name
-    
-    # Read file and send as response
-    with open(tmp_path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="visitors.xlsx"'
-        response['Content-Length'] = os.path.getsize(tmp_path)
+            visitor_name = f"{visitor.first_name} {visitor.last_name}" if visitor.first_name or visitor.last_name else "Visitor"
+            if approve:
+                subject = f"Your visit to {company_name} has been approved"
+                message = f"Dear {visitor_name}, your visit request has been approved. Please carry your ID and visit as per your appointment."
+            else:
+                subject = f"Your visit to {company_name} has been rejected"
+                message = f"Dear {visitor_name}, unfortunately your visit request has been rejected. Please contact HR for more details."
+            emails.append((subject, message, [visitor.email], sender))
+        if emails:
+            from .outbox import enqueue_emails
+            enqueue_emails(emails, digest=True)
+        messages.success(request, f"{group.name}: {len(visitor_ids)} visit requests {'approved' if approve else 'rejected'}.")
+    user_type = getattr(request.user, 'user_type', None)
+    if user_type == 'HOS':
+        return redirect('hos-dashboard')
+    else:
+        return redirect('hr-dashboard')
+
+@login_required(login_url='/login/')
+def export_visitors_excel(request):
+    """Export visitors data as Excel file, optionally filtered by query parameters"""
+    from .export_shards import export_rows
+    from .exports import parse_export_filters, xlsx_response
     
-    # Clean up temporary file
-    os.unlink(tmp_path)
-    return response
+    try:
+        filters = parse_export_filters(request.GET)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    rows = export_rows(filters)
+    return xlsx_response(rows, 'Visitors', 'visitors.xlsx')
 
 @login_required(login_url='/hos-login/')
 def export_hos_visitors_excel(request):
-    """Export HOS visitors data as Excel file"""
+    """Export HOS visitors data as Excel file, optionally filtered by query parameters"""
     if not is_hos_user(request.user):
         return HttpResponse('Access denied', status=403)
-
-    import openpyxl
-    from django.utils import timezone
-    import tempfile
-    import os
-    
-    def get_user_display_name(user):
-        if not user:
-            return ""
-        if user.first_name or user.last_name:
-            return f"{user.first_name or ''} {user.last_name or ''}".strip()
-        return user.username or user.email or str(user)
-
-    # Create Excel workbook
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = 'HOS Visitors'
     
-    # Header with day-specific columns
-    header = [
-        'Visitor ID', 'First Name', 'Last Name', 'Email', 'Phone', 'Organization',
-        'ID Proof Type', 'ID Proof Number', 'Photo URL',
-        "Reference Employee Name", "Reference Employee Department", "Reference Purpose",
-        'Start Time', 'End Time', 'Valid Upto',
-        'Visitor Card ID', 'Approved By', 'Approver Type'
-    ]
+    from .export_shards import export_rows
+    from .exports import parse_export_filters, xlsx_response
     
-    # Add day-specific check-in/check-out columns (10 days)
-    for day in range(1, 11):
-        header.extend([f'Day {day} Check In', f'Day {day} Check Out'])
-    
-    ws.append(header)
+    # Without filters, export ALL visits (both HR and HOS) - same as HR export
+    try:
+        filters = parse_export_filters(request.GET)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    rows = export_rows(filters)
+    return xlsx_response(rows, 'HOS Visitors', 'hos_visitors.xlsx')
+
+@login_required(login_url='/login/')
+def export_visitors_csv(request):
+    """Export visitors data as a streamed CSV file with the same columns as the Excel export"""
+    from .export_shards import export_rows
+    from .exports import CSV_CONTENT_TYPE, iter_csv, parse_export_filters, streaming_response
     
-    # Export ALL visits (both HR and HOS) - same as HR export
-    from visitorapi.mongo_models import MongoVisitRequest, MongoVisitor, MongoVisitorCard
+    try:
+        filters = parse_export_filters(request.GET)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    rows = export_rows(filters)
+    return streaming_response(iter_csv(rows), CSV_CONTENT_TYPE, 'visitors.csv', request)
+
+@login_required(login_url='/login/')
+def export_visitors_ndjson(request):
+    """Export visitors data as streamed newline-delimited JSON, one visit per line"""
+    from .export_shards import export_rows
+    from .exports import NDJSON_CONTENT_TYPE, iter_ndjson, parse_export_filters, streaming_response
     
-    visit_requests = MongoVisitRequest.objects.all()
-    if not visit_requests.count():
-        ws.append(['No data found'] + [''] * (len(header) - 1))
-    else:
-        for vr in visit_requests:
-            # Get visitor data
-            try:
-                visitor = MongoVisitor.objects.get(id=vr.visitor_id)
-            except MongoVisitor.DoesNotExist:
-                continue
-            
-            # Get visitor card ID if exists
-            visitor_card_id = ''
-            try:
-                visitor_card = MongoVisitorCard.objects.filter(visit_request_id=str(vr.id)).first()
-                visitor_card_id = visitor_card.card_number if visitor_card else ''
-            except:
-                visitor_card_id = ''
-
-            # Get approver information
-            approver_name = ''
-            approver_type = ''
-            if vr.approved_by_id:
-                try:
-                    approver = HRUser.objects.get(id=vr.approved_by_id)
-                    approver_name = get_user_display_name(approver)
-                    approver_type = approver.user_type
-                except HRUser.DoesNotExist:
-                    approver_name = f"User {vr.approved_by_id}"
-                    approver_type = 'Unknown'
-            elif vr.host_id:
-                try:
-                    host = HRUser.objects.get(id=vr.host_id)
-                    approver_name = get_user_display_name(host)
-                    approver_type = host.user_type
-                except HRUser.DoesNotExist:
-                    approver_name = f"User {vr.host_id}"
-                    approver_type = 'Unknown'
-
-            # Base row data
-            row_data = [
-                str(visitor.id), visitor.first_name, visitor.last_name, visitor.email or '', visitor.phone, visitor.company,
-                visitor.id_proof_type, visitor.id_proof_number,
-                visitor.photo or '',
-                vr.reference_employee_name or '',
-                vr.reference_employee_department or '',
-                vr.reference_purpose or '',
-                # Convert to IST time for display
-                timezone.localtime(vr.start_time).strftime('%Y-%m-%d %H:%M') if vr.start_time and timezone.is_aware(vr.start_time) else (vr.start_time.strftime('%Y-%m-%d %H:%M') if vr.start_time else ''),
-                vr.end_time or '',
-                # Handle valid_upto - it can be date or datetime
-                vr.valid_upto.strftime('%Y-%m-%d') if vr.valid_upto else '',
-                visitor_card_id,
-                approver_name,
-                approver_type
-            ]
-            
-            # Add day-specific check-in/check-out data
-            for day in range(1, 11):
-                checkin_field = f'day_{day}_checkin'
-                checkout_field = f'day_{day}_checkout'
-                
-                checkin_time = getattr(vr, checkin_field)
-                checkout_time = getattr(vr, checkout_field)
-                
-                # Convert to IST time for display
-                if checkin_time:
-                    if timezone.is_aware(checkin_time):
-                        ist_checkin_time = timezone.localtime(checkin_time)
-                        row_data.append(ist_checkin_time.strftime('%Y-%m-%d %H:%M:%S'))
-                    else:
-                        row_data.append(checkin_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    row_data.append('')
-                
-                if checkout_time:
-                    if timezone.is_aware(checkout_time):
-                        ist_checkout_time = timezone.localtime(checkout_time)
-                        row_data.append(checkout_time.strftime('%Y-%m-%d %H:%M:%S'))
-                    else:
-                        row_data.append(checkout_time.strftime('%Y-%m-%d %H:%M:%S'))
-                else:
-                    row_data.append('')
-            
-            ws.append(row_data)
+    try:
+        filters = parse_export_filters(request.GET)
+    except ValueError as e:
+        return HttpResponse(str(e), status=400)
+    rows = export_rows(filters)
+    return streaming_response(iter_ndjson(rows), NDJSON_CONTENT_TYPE, 'visitors.ndjson', request)
+
+@login_required(login_url='/login/')
+def export_visitors_delta(request):
+    """
+    Export visit requests, visitors and cards changed since the updated_since
+    token as NDJSON. The last line (and the X-Next-Token header) carries the
+    token to pass on the next call; omit updated_since for a full sync.
+    """
+    from .exports import DELTA_SAFETY_SECONDS, NDJSON_CONTENT_TYPE, iter_delta, make_delta_token, parse_delta_token, streaming_response
     
-    # Save to temporary file and send as response
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-        wb.save(tmp.name)
-        tmp_path = tmp.name
+    since = None
+    token = request.GET.get('updated_since')
+    if token:
+        try:
+            since = parse_delta_token(token)
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+    until = timezone.now() - timedelta(seconds=DELTA_SAFETY_SECONDS)
+    if since and since >= until:
+        until = since
+    response = streaming_response(iter_delta(since, until), NDJSON_CONTENT_TYPE, 'visitors_delta.ndjson', request)
+    response['X-Next-Token'] = make_delta_token(until)
+    return response
+
+def _export_job_payload(job):
+    payload = {
+        'job_id': str(job.id),
+        'format': job.export_format,
+        'status': job.status,
+        'rows_done': job.rows_done,
+        'total': job.total,
+        'progress': job.progress,
+        'error': job.error,
+        'status_url': reverse('export_job_status', args=[str(job.id)]),
+    }
+    if job.status == 'DONE':
+        payload['download_url'] = reverse('download_export_job', args=[str(job.id)])
+    return payload
+
+@login_required(login_url='/login/')
+@require_POST
+def create_export_job(request):
+    """Queue an export in the background; identical exports of unchanged data reuse one job"""
+    from .export_jobs import EXPORT_FORMATS, submit_export
+    from .exports import parse_export_filters
+    
+    export_format = (request.POST.get('format') or 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'error': f"Unsupported format. Use one of: {', '.join(EXPORT_FORMATS)}."}, status=400)
+    try:
+        filters = parse_export_filters(request.POST)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    sheet_title = 'HOS Visitors' if is_hos_user(request.user) else 'Visitors'
+    job = submit_export(export_format, filters, sheet_title, request.user)
+    return JsonResponse(_export_job_payload(job), status=202)
+
+@login_required(login_url='/login/')
+def export_job_status(request, job_id):
+    """Progress of a background export job"""
+    from visitorapi.mongo_models import MongoExportJob
     
-    # Read file and send as response
-    with open(tmp_path, 'rb') as f:
-        response = HttpResponse(f.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="hos_visitors.xlsx"'
-        response['Content-Length'] = os.path.getsize(tmp_path)
+    job = MongoExportJob.objects(id=job_id).first() if ObjectId.is_valid(job_id) else None
+    if not job:
+        return JsonResponse({'error': 'Export job not found.'}, status=404)
+    return JsonResponse(_export_job_payload(job))
+
+@login_required(login_url='/login/')
+def download_export_job(request, job_id):
+    """Download the finished artifact of a background export job"""
+    import os
+    from django.http import FileResponse
+    from .export_jobs import EXPORT_FORMATS
+    from visitorapi.mongo_models import MongoExportJob
     
-    # Clean up temporary file
-    os.unlink(tmp_path)
-    return response
+    job = MongoExportJob.objects(id=job_id).first() if ObjectId.is_valid(job_id) else None
+    if not job or job.status != 'DONE' or not job.file_path or not os.path.exists(job.file_path):
+        return JsonResponse({'error': 'Export is not ready.'}, status=404)
+    extension, content_type = EXPORT_FORMATS[job.export_format]
+    filename = ('hos_visitors' if job.sheet_title == 'HOS Visitors' else 'visitors') + extension
+    return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=filename, content_type=content_type)
 
 @csrf_exempt
 @api_view(['POST'])
@@ -1257,53 +1100,48 @@ def hos_logout_view(request):
 def clear_all_sessions(request):
     """Clear all user sessions - Admin only function"""
     if request.method == 'POST':
-        from django.contrib.sessions.models import Session
-        session_count = Session.objects.count()
-        Session.objects.all().delete()
+        from visitorapi.session_epoch import bump_session_epoch, prune_later
+        # Every session from before the bump is rejected on its next request;
+        # the rows are deleted in the background
+        bump_session_epoch()
+        prune_later()
         # Log out the current user and flush their session to avoid SessionInterrupted
         logout(request)
         request.session.flush()
-        messages.success(request, f'Successfully cleared {session_count} user sessions. All users will need to log in again.')
+        messages.success(request, 'Successfully cleared all user sessions. All users will need to log in again.')
         return redirect('login')
     else:
         return render(request, 'clear_sessions_confirm.html')
 
 def print_card_dashboard(request):
-    # Show all approved VisitRequests where the card is not printed or does not exist yet
-    # Use MongoDB models for visitor data
-    import logging
-    logger = logging.getLogger(__name__)
-    
-    # Import MongoDB models
-    from visitorapi.mongo_models import MongoVisitRequest, MongoVisitor, MongoVisitorCard
-    
-    approved_requests = MongoVisitRequest.objects.filter(status='APPROVED').order_by('-created_at')
-    requests_with_cards = []
-    
-    # Debug logging to track visitor data
-    for req in approved_requests:
-        try:
-            visitor = MongoVisitor.objects.get(id=req.visitor_id)
-            logger.info(f"Processing request {req.id}: {visitor.first_name} {visitor.last_name} (Visitor ID: {visitor.id})")
-            
-            # Check if visitor card exists
-            visitor_card = MongoVisitorCard.objects.filter(visit_request_id=str(req.id)).first()
-            
-            # Exclude if card exists and is printed
-            if visitor_card and visitor_card.printed:
-                continue
-                
-            requests_with_cards.append({
-                'visit_request': req,
-                'visitor': visitor,
-                'visitor_card': visitor_card
-            })
-        except MongoVisitor.DoesNotExist:
-            logger.warning(f"Visitor not found for request {req.id}")
-            continue
+    # Show approved VisitRequests where the card is not printed or does not exist yet
+    from visitorapi.mongo_models import MongoVisitGroup, MongoVisitRequest
     
-    logger.info(f"Total requests to display: {len(requests_with_cards)}")
-    return render(request, 'print_card_dashboard.html', {'requests_with_cards': requests_with_cards})
+    page_size = 50
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except (TypeError, ValueError):
+        page = 1
+    
+    total, requests_with_cards = MongoVisitRequest.unprinted_approved_page(page=page, page_size=page_size)
+    num_pages = max((total + page_size - 1) // page_size, 1)
+    group_ids = {row['visit_request'].group_id for row in requests_with_cards if row['visit_request'].group_id}
+    if group_ids:
+        groups = {str(g.id): g for g in MongoVisitGroup.objects(id__in=list(group_ids)).only('name', 'member_count')}
+        for row in requests_with_cards:
+            row['group'] = groups.get(row['visit_request'].group_id)
+    logger.debug(f"Print queue page {page}/{num_pages}: {len(requests_with_cards)} of {total} requests")
+    
+    return render(request, 'print_card_dashboard.html', {
+        'requests_with_cards': requests_with_cards,
+        'total_requests': total,
+        'page': page,
+        'num_pages': num_pages,
+        'has_previous': page > 1,
+        'has_next': page < num_pages,
+        'previous_page': page - 1,
+        'next_page': page + 1,
+    })
 
 @require_POST
 @csrf_protect
@@ -1333,6 +1171,11 @@ def print_card_step2(request):
     from visitorapi.mongo_models import MongoVisitorCard, MongoVisitRequest, MongoVisitor
     if request.method == 'POST':
         selected_visitor_ids = request.POST.getlist('selected_visitors')
+        selected_group_ids = [gid for gid in request.POST.getlist('selected_groups') if ObjectId.is_valid(gid)]
+        if selected_group_ids:
+            # A selected group prints all of its approved members, including those on other pages
+            group_members = MongoVisitRequest.objects(group_id__in=selected_group_ids, status='APPROVED').scalar('id')
+            selected_visitor_ids = list(dict.fromkeys(selected_visitor_ids + [str(vid) for vid in group_members]))
         if not selected_visitor_ids:
             messages.error(request, 'No visitors selected for card printing.')
             return redirect('print_card_dashboard')
@@ -1478,21 +1321,22 @@ def upload_visitor_photo(request, visitor_id):
         if not photo:
             return JsonResponse({'success': False, 'error': 'No photo uploaded'}, status=400)
         
-        # Handle photo upload (MongoDB stores photo path as string)
-        # For now, we'll store the filename
-        import os
-        from django.core.files.storage import default_storage
+        # Handle photo upload (MongoDB stores photo path as string); stored by
+        # content hash and shrunk to badge size off the request thread
+        from .photos import process_photo_later, store_photo
         
-        # Save the photo to media directory
-        file_path = default_storage.save(f'visitor_photos/{photo.name}', photo)
+        file_path, thumbnail_path = store_photo(photo)
         visitor.photo = file_path
+        visitor.photo_thumbnail = thumbnail_path
         visitor.save()
+        process_photo_later(visitor.id, file_path)
         
         return JsonResponse({'success': True, 'photo_url': f'/media/{file_path}'})
     except MongoVisitor.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Visitor not found'}, status=404)
 
 @csrf_exempt
+@idempotent
 def checkout_visitor(request):
     # Import MongoDB models
     from visitorapi.mongo_models import MongoVisitorCard, MongoVisitRequest
@@ -1526,6 +1370,8 @@ def checkout_visitor(request):
             setattr(visit_request, checkout_field, ist_time)
             visit_request.save(update_fields=[checkout_field])
             checkout_time_ist = ist_time.strftime('%Y-%m-%d %H:%M:%S')
+            from .overdue import visit_checked_out
+            visit_checked_out(visit_request)
             
             return JsonResponse({
                 'success': True, 
@@ -1540,6 +1386,7 @@ def checkout_visitor(request):
     return JsonResponse({'success': False, 'error': 'Invalid request'})
 
 @csrf_exempt
+@idempotent
 def checkin_visitor(request):
     # Import MongoDB models
     from visitorapi.mongo_models import MongoVisitorCard, MongoVisitRequest
@@ -1582,6 +1429,8 @@ def checkin_visitor(request):
             setattr(visit_request, checkin_field, ist_time)
             visit_request.save(update_fields=[checkin_field])
             checkin_time_ist = ist_time.strftime('%Y-%m-%d %H:%M:%S')
+            from .overdue import visit_checked_in
+            visit_checked_in(visit_request)
             
             return JsonResponse({
                 'success': True, 
@@ -1667,6 +1516,8 @@ def manual_checkout_visitor(request):
                 visit.checkout_by_hr = True
                 visit.save(update_fields=[checkout_field, 'checkout_by_hr'])
                 checked_out = True
+                from .overdue import visit_checked_out
+                visit_checked_out(visit)
                 return JsonResponse({'success': True, 'checkout_time': ist_time.strftime('%Y-%m-%d %H:%M:%S') + ' HR'})
         
         if not checked_out:
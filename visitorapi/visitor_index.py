@@ -0,0 +1,191 @@
+import bisect
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .search import RESULT_FIELDS, SEARCH_LIMIT, parse_query, result_from_document, visitor_tokens
+
+logger = logging.getLogger(__name__)
+
+TOKEN_FIELDS = ('first_name', 'last_name', 'email', 'phone', 'id_proof_number')
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _document_tokens(doc):
+    return visitor_tokens(*(doc.get(f) for f in TOKEN_FIELDS))
+
+
+class VisitorPrefixIndex:
+    """
+    In-memory autocomplete index for one worker process.
+
+    Normalized visitor tokens are kept in a sorted array of (token, visitor_id)
+    pairs, so a prefix lookup is a bisect followed by a short scan. Writes made
+    by this process are applied immediately; writes made by other workers are
+    picked up by a periodic check of the visitors' updated_at watermark.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._entries = []  # sorted (token, visitor_id)
+        self._tokens = {}  # visitor_id -> tokens
+        self._results = {}  # visitor_id -> autocomplete result
+        self.watermark = None  # Latest updated_at seen in Mongo (naive UTC)
+        self.checked_at = 0.0
+        self.ready = False
+
+    def build(self):
+        """Load every visitor from a projection of the visitors collection"""
+        from visitorapi.mongo_models import MongoVisitor
+
+        started = time.perf_counter()
+        entries, tokens, results = [], {}, {}
+        watermark = None
+        cursor = MongoVisitor._get_collection().find(
+            {}, projection=list(set(RESULT_FIELDS) | {'updated_at'}), batch_size=5000,
+        )
+        for doc in cursor:
+            visitor_id = str(doc['_id'])
+            doc_tokens = _document_tokens(doc)
+            tokens[visitor_id] = doc_tokens
+            results[visitor_id] = result_from_document(doc)
+            entries.extend((token, visitor_id) for token in doc_tokens)
+            if doc.get('updated_at') and (watermark is None or doc['updated_at'] > watermark):
+                watermark = doc['updated_at']
+        entries.sort()
+
+        with self._lock:
+            self._entries, self._tokens, self._results = entries, tokens, results
+            self.watermark = watermark
+            self.checked_at = time.monotonic()
+            self.ready = True
+        logger.info(
+            f"Visitor search index built: {len(results)} visitors, {len(entries)} tokens, "
+            f"{self.footprint() / 2**20:.1f} MiB in {time.perf_counter() - started:.2f}s"
+        )
+
+    def _remove(self, visitor_id):
+        for token in self._tokens.pop(visitor_id, ()):
+            i = bisect.bisect_left(self._entries, (token, visitor_id))
+            if i < len(self._entries) and self._entries[i] == (token, visitor_id):
+                del self._entries[i]
+        self._results.pop(visitor_id, None)
+
+    def upsert(self, doc):
+        """Add or replace one visitor from a raw document or its to_mongo() form"""
+        visitor_id = str(doc['_id'])
+        doc_tokens = _document_tokens(doc)
+        with self._lock:
+            self._remove(visitor_id)
+            self._tokens[visitor_id] = doc_tokens
+            self._results[visitor_id] = result_from_document(doc)
+            for token in doc_tokens:
+                bisect.insort(self._entries, (token, visitor_id))
+
+    def sync(self):
+        """
+        Catch up with writes made by other workers: re-read visitors updated
+        since the watermark, and rebuild if visitors were deleted.
+        """
+        from visitorapi.mongo_models import MongoVisitor
+
+        collection = MongoVisitor._get_collection()
+        self.checked_at = time.monotonic()
+        latest = collection.find_one({}, projection=['updated_at'], sort=[('updated_at', -1)])
+        latest = latest.get('updated_at') if latest else None
+        if latest and (self.watermark is None or latest > self.watermark):
+            query = {'updated_at': {'$gte': self.watermark}} if self.watermark else {}
+            for doc in collection.find(query, projection=list(set(RESULT_FIELDS) | {'updated_at'})):
+                self.upsert(doc)
+            self.watermark = latest
+        if collection.estimated_document_count() < len(self._results):
+            self.build()
+
+    def _matching(self, prefix):
+        """Visitor ids with a token starting with prefix"""
+        matched = set()
+        i = bisect.bisect_left(self._entries, (prefix, ''))
+        while i < len(self._entries) and self._entries[i][0].startswith(prefix):
+            matched.add(self._entries[i][1])
+            i += 1
+        return matched
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        interval = getattr(settings, 'VISITOR_SEARCH_SYNC_SECONDS', 30)
+        if time.monotonic() - self.checked_at > interval:
+            # One thread syncs; the others answer from the current state
+            if self._sync_lock.acquire(blocking=False):
+                try:
+                    self.sync()
+                except Exception:
+                    # Serve possibly stale results rather than fail the autocomplete
+                    logger.exception("Visitor search index sync failed")
+                finally:
+                    self._sync_lock.release()
+
+        parsed = parse_query(query)
+        if parsed is None:
+            return []
+        tokens, compact = parsed
+        with self._lock:
+            matched = set.intersection(*(self._matching(token) for token in tokens))
+            if compact not in tokens:
+                matched |= self._matching(compact)
+            return [self._results[visitor_id] for visitor_id in sorted(matched)[:limit]]
+
+    def footprint(self):
+        """Approximate bytes held by the index structures"""
+        with self._lock:
+            size = sys.getsizeof(self._entries) + sys.getsizeof(self._tokens) + sys.getsizeof(self._results)
+            for token, visitor_id in self._entries:
+                size += sys.getsizeof((token, visitor_id)) + sys.getsizeof(token)
+            for visitor_id, doc_tokens in self._tokens.items():
+                size += sys.getsizeof(visitor_id) + sys.getsizeof(doc_tokens)
+            for result in self._results.values():
+                size += sys.getsizeof(result) + sum(sys.getsizeof(v) for v in result.values())
+            return size
+
+    def stats(self):
+        return {
+            'visitors': len(self._results),
+            'tokens': len(self._entries),
+            'bytes': self.footprint(),
+        }
+
+
+def start_visitor_index():
+    """Build this worker's index in the background when VISITOR_SEARCH_IN_MEMORY is enabled"""
+    global _index
+    if not getattr(settings, 'VISITOR_SEARCH_IN_MEMORY', False):
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = VisitorPrefixIndex()
+            threading.Thread(target=_build, args=(_index,), name='visitor-index', daemon=True).start()
+    return _index
+
+
+def _build(index):
+    try:
+        index.build()
+    except Exception:
+        logger.exception("Visitor search index build failed; searches fall back to MongoDB")
+
+
+def get_visitor_index():
+    """This worker's index once it is built, otherwise None"""
+    index = _index
+    return index if index is not None and index.ready else None
+
+
+def index_visitor(visitor):
+    """Apply a visitor write made in this process to the in-memory index"""
+    index = get_visitor_index()
+    if index is not None:
+        index.upsert(visitor.to_mongo())